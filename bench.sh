@@ -0,0 +1,3 @@
+#!/bin/sh
+
+PYTHONPATH=$PYTHONPATH:./lib/pymaker:./lib/pyexchange python3 -m benchmarks.benchmark $@
@@ -0,0 +1,197 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from texttable import Texttable
+from web3 import Web3
+
+from benchmarks.fakes import BalanceModel, FakeChain, FakeProvider, FakeExchanges
+from inventory_keeper.inventory_keeper import InventoryKeeper
+
+BASE_ADDRESS = '0x' + 'ba5e' * 10
+
+MEMBER_TYPES = ['radarrelay-market-maker-keeper',
+                'etherdelta-market-maker-keeper',
+                'bibox-market-maker-keeper',
+                'okex-market-maker-keeper',
+                'gateio-market-maker-keeper']
+
+
+def address(prefix: str, index: int) -> str:
+    return '0x' + prefix + hex(index)[2:].rjust(40 - len(prefix), '0')
+
+
+def create_config(members: int, tokens: int) -> dict:
+    """Creates a config with `members` members, each of them having all `tokens` tokens.
+
+    Member types are assigned round-robin. Oasis members are not included, as reading
+    their open orders would require a fake order book.
+    """
+    token_names = ['ETH'] + [f"TKN{index}" for index in range(tokens - 1)]
+    token_addresses = {'ETH': '0x' + '00' * 20}
+    token_addresses.update({f"TKN{index}": address('70c0', index) for index in range(tokens - 1)})
+
+    member_list = []
+    for index in range(members):
+        member_type = MEMBER_TYPES[index % len(MEMBER_TYPES)]
+        if member_type == 'radarrelay-market-maker-keeper':
+            member_config = {'marketMakerAddress': address('ee', index)}
+        elif member_type == 'etherdelta-market-maker-keeper':
+            member_config = {'etherDeltaAddress': address('ed', 0), 'marketMakerAddress': address('ee', index)}
+        elif member_type == 'bibox-market-maker-keeper':
+            member_config = {'apiKey': f"key-{index}", 'secret': 'secret'}
+        else:
+            member_config = {'apiKey': f"key-{index}", 'secretKey': 'secret'}
+
+        member_list.append({'name': f"Member {index}",
+                            'type': member_type,
+                            'config': member_config,
+                            'tokens': {token_name: {'minAmount': 1.0, 'avgAmount': 5.0, 'maxAmount': 9.0}
+                                       for token_name in token_names}})
+
+    return {'tokens': {token_name: token_addresses[token_name] for token_name in token_names},
+            'base': {'name': 'Base account', 'address': BASE_ADDRESS, 'minEthBalance': 0.5},
+            'members': member_list}
+
+
+def measure(function, provider: FakeProvider, exchanges: FakeExchanges, trace_memory: bool) -> dict:
+    provider.reset()
+    exchanges.reset()
+
+    if trace_memory:
+        tracemalloc.start()
+
+    started_at = time.perf_counter()
+    function()
+    wall_time = time.perf_counter() - started_at
+
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {'wall_time': wall_time,
+            'rpc_round_trips': provider.round_trips,
+            'rpc_calls': sum(provider.calls.values()),
+            'exchange_calls': sum(exchanges.calls.values()),
+            'peak_memory': peak_memory}
+
+
+def run_scenario(members: int, tokens: int, rpc_latency: float, exchange_latency: float, threads: int,
+                 out_of_range: float, trace_memory: bool) -> list:
+    config = create_config(members, tokens)
+    balance_model = BalanceModel(out_of_range=out_of_range, seed=members * 1000 + tokens)
+
+    chain = FakeChain(balance_model, BASE_ADDRESS)
+    provider = FakeProvider(chain, rpc_latency)
+    exchanges = FakeExchanges(balance_model, list(config['tokens'].keys()), exchange_latency)
+    exchanges.install()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, 'config.json')
+        with open(config_file, 'w') as file:
+            json.dump(config, file)
+
+        keeper = InventoryKeeper(['--config', config_file,
+                                  '--balance-fetch-threads', str(threads),
+                                  '--inventory-snapshot-ttl', '0'], web3=Web3(provider))
+
+        result = []
+        for name, function in [('approve', keeper.approve),
+                               ('print_inventory', keeper.print_inventory),
+                               ('rebalance_members', keeper.rebalance_members)]:
+            keeper.invalidate_inventory_snapshot()
+            result.append(dict(measure(function, provider, exchanges, trace_memory), operation=name))
+
+        # transfers are sent in the background, they are not a part of the measured cycle
+        keeper.transfer_pipeline.wait()
+
+    return result
+
+
+def main(args: list):
+    parser = argparse.ArgumentParser(prog='inventory-keeper-benchmark')
+
+    parser.add_argument("--members", type=str, default="10,50,200",
+                        help="Comma-separated numbers of members (default: `10,50,200')")
+
+    parser.add_argument("--tokens", type=str, default="2,10",
+                        help="Comma-separated numbers of tokens, including ETH (default: `2,10')")
+
+    parser.add_argument("--rpc-latency", type=str, default="0,0.01",
+                        help="Comma-separated latencies of each JSON-RPC round trip (in seconds, default: `0,0.01')")
+
+    parser.add_argument("--exchange-latency", type=str, default="0.05",
+                        help="Comma-separated latencies of each exchange API call (in seconds, default: `0.05')")
+
+    parser.add_argument("--balance-fetch-threads", type=int, default=1,
+                        help="Number of member balances being read at the same time (default: 1)")
+
+    parser.add_argument("--out-of-range", type=float, default=0.1,
+                        help="Fraction of balances outside of the `minAmount` - `maxAmount` range (default: 0.1)")
+
+    parser.add_argument("--no-memory", dest='trace_memory', action='store_false',
+                        help="Do not measure peak memory, as tracing memory allocations slows the keeper down")
+
+    parser.add_argument("--json", dest='json', action='store_true',
+                        help="Print results as JSON instead of a table")
+
+    arguments = parser.parse_args(args)
+
+    # the keeper logs a warning for each deposit to an exchange, which is not supported
+    logging.basicConfig(level=logging.ERROR)
+
+    results = []
+    for members, tokens, rpc_latency, exchange_latency in itertools.product(
+            map(int, arguments.members.split(',')),
+            map(int, arguments.tokens.split(',')),
+            map(float, arguments.rpc_latency.split(',')),
+            map(float, arguments.exchange_latency.split(','))):
+        for result in run_scenario(members, tokens, rpc_latency, exchange_latency, arguments.balance_fetch_threads,
+                                   arguments.out_of_range, arguments.trace_memory):
+            results.append(dict(result, members=members, tokens=tokens,
+                                rpc_latency=rpc_latency, exchange_latency=exchange_latency))
+
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    table = Texttable(max_width=250)
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['i', 'i', 'f', 'f', 't', 'f', 'i', 'i', 'i', 't'])
+    table.set_cols_align(['r', 'r', 'r', 'r', 'l', 'r', 'r', 'r', 'r', 'r'])
+    table.add_rows([["Members", "Tokens", "RPC latency", "Exchange latency", "Operation",
+                     "Wall time", "RPC round trips", "RPC calls", "Exchange calls", "Peak memory"]] +
+                   [[result['members'], result['tokens'], result['rpc_latency'], result['exchange_latency'],
+                     result['operation'], result['wall_time'], result['rpc_round_trips'], result['rpc_calls'],
+                     result['exchange_calls'],
+                     f"{result['peak_memory'] / 2**20:.1f} MiB" if result['peak_memory'] is not None else ""]
+                    for result in results])
+    print(table.draw())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,280 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import hashlib
+import random
+import threading
+import time
+
+from web3.providers.base import BaseProvider
+
+import inventory_keeper.members.bibox
+import inventory_keeper.members.gateio
+import inventory_keeper.members.okex
+from pyexchange.bibox import BiboxApi
+from pyexchange.gateio import GateIOApi
+from pyexchange.okex import OKEXApi
+
+BASE_BALANCE = 1000000.0
+
+
+class BalanceModel:
+    """Deterministic balances of all accounts, most of them within the `minAmount` - `maxAmount` range.
+
+    Members in the generated configs have their ranges set to 1 - 9, so balances between 2 and 8
+    do not need rebalancing. A fraction of balances, equal to `out_of_range`, is placed outside
+    of that range, so the benchmark exercises deposits and withdrawals as well.
+    """
+    def __init__(self, out_of_range: float, seed: int):
+        assert(isinstance(out_of_range, float))
+        assert(isinstance(seed, int))
+
+        self.out_of_range = out_of_range
+        self.seed = seed
+
+    def balance(self, *key) -> float:
+        digest = hashlib.sha256(repr((self.seed,) + key).encode('utf-8')).digest()
+        rng = random.Random(digest)
+        if rng.random() < self.out_of_range:
+            return rng.choice([rng.uniform(0, 0.5), rng.uniform(10, 12)])
+        else:
+            return rng.uniform(2, 8)
+
+
+class FakeChain:
+    """In-memory chain state served by `FakeProvider`."""
+    def __init__(self, balance_model: BalanceModel, base_address: str):
+        assert(isinstance(balance_model, BalanceModel))
+        assert(isinstance(base_address, str))
+
+        self.balance_model = balance_model
+        self.base_address = base_address.lower()
+        self.block_number = 1000000
+        self.nonces = collections.Counter()
+        self.receipts = {}
+        self._lock = threading.Lock()
+
+    def balance(self, token: str, owner: str, ledger: str = None) -> int:
+        if owner.lower() == self.base_address and ledger is None:
+            return int(BASE_BALANCE * 10**18)
+
+        return int(self.balance_model.balance(token.lower(), owner.lower(), ledger) * 10**18)
+
+    def send_transaction(self, transaction: dict) -> str:
+        with self._lock:
+            sender = transaction['from'].lower()
+            nonce = int(transaction['nonce'], 16) if 'nonce' in transaction else self.nonces[sender]
+            self.nonces[sender] = max(self.nonces[sender], nonce + 1)
+
+            # every transaction gets mined in a new block straight away
+            self.block_number += 1
+            transaction_hash = '0x' + hashlib.sha256(repr((sender, nonce)).encode('utf-8')).hexdigest()
+            self.receipts[transaction_hash] = {'transactionHash': transaction_hash,
+                                               'transactionIndex': '0x0',
+                                               'blockHash': '0x' + '11' * 32,
+                                               'blockNumber': hex(self.block_number),
+                                               'from': sender,
+                                               'to': transaction.get('to'),
+                                               'gasUsed': hex(50000),
+                                               'cumulativeGasUsed': hex(50000),
+                                               'contractAddress': None,
+                                               'status': '0x1',
+                                               'logs': []}
+
+            return transaction_hash
+
+
+class FakeProvider(BaseProvider):
+    """In-process JSON-RPC provider serving `FakeChain`, with an injected latency per round trip.
+
+    Supports JSON-RPC batch requests through `make_batch_request`, the same way as
+    `inventory_keeper.batch.batch_request` expects them. Counts round trips and individual calls.
+    """
+    def __init__(self, chain: FakeChain, latency: float):
+        assert(isinstance(chain, FakeChain))
+        assert(isinstance(latency, float))
+
+        super().__init__()
+        self.chain = chain
+        self.latency = latency
+        self.round_trips = 0
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.round_trips = 0
+            self.calls = collections.Counter()
+
+    def isConnected(self):
+        return True
+
+    def make_request(self, method, params):
+        self._round_trip([method])
+        return self._response(0, method, params)
+
+    def make_batch_request(self, payload: list) -> list:
+        self._round_trip([item['method'] for item in payload])
+        return [self._response(item['id'], item['method'], item['params']) for item in payload]
+
+    def _round_trip(self, methods: list):
+        with self._lock:
+            self.round_trips += 1
+            self.calls.update(methods)
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _response(self, request_id: int, method: str, params: list) -> dict:
+        try:
+            return {'jsonrpc': '2.0', 'id': request_id, 'result': self._handle(method, params)}
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': -32000, 'message': str(e)}}
+
+    def _handle(self, method: str, params: list):
+        chain = self.chain
+
+        if method == 'web3_clientVersion':
+            return 'FakeProvider/v1.0'
+        elif method == 'net_version':
+            return '1'
+        elif method == 'eth_syncing':
+            return False
+        elif method == 'eth_accounts':
+            return []
+        elif method == 'eth_blockNumber':
+            return hex(chain.block_number)
+        elif method == 'eth_gasPrice':
+            return hex(10**9)
+        elif method == 'eth_estimateGas':
+            return hex(100000)
+        elif method == 'eth_getBalance':
+            return hex(chain.balance('0x' + '00' * 20, params[0]))
+        elif method == 'eth_getTransactionCount':
+            return hex(chain.nonces[params[0].lower()])
+        elif method == 'eth_sendTransaction':
+            return chain.send_transaction(params[0])
+        elif method == 'eth_getTransactionReceipt':
+            return chain.receipts.get(params[0])
+        elif method == 'eth_getTransactionByHash':
+            receipt = chain.receipts.get(params[0])
+            return dict(receipt, hash=receipt['transactionHash'], value='0x0', input='0x') if receipt else None
+        elif method == 'eth_getBlockByNumber':
+            number = chain.block_number if params[0] == 'latest' else int(params[0], 16)
+            return {'number': hex(number),
+                    'hash': '0x' + hex(number)[2:].rjust(64, '0'),
+                    'parentHash': '0x' + hex(number - 1)[2:].rjust(64, '0'),
+                    'timestamp': hex(int(time.time())),
+                    'gasLimit': hex(8000000),
+                    'gasUsed': hex(0),
+                    'transactions': []}
+        elif method == 'eth_getLogs':
+            return []
+        elif method == 'eth_call':
+            return self._call(params[0])
+        else:
+            raise Exception(f"Method {method} not supported by FakeProvider")
+
+    def _call(self, transaction: dict) -> str:
+        data = transaction['data'][2:]
+        selector = data[0:8]
+
+        if selector == '70a08231':
+            # balanceOf(address)
+            result = self.chain.balance(transaction['to'], '0x' + data[8 + 24:72])
+        elif selector == 'f7888aec':
+            # balanceOf(address,address) of EtherDelta-like ledgers
+            result = self.chain.balance('0x' + data[8 + 24:72], '0x' + data[72 + 24:136], transaction['to'].lower())
+        elif selector == 'dd62ed3e':
+            # allowance(address,address), so approvals are never sent
+            result = 2**256 - 1
+        else:
+            result = 0
+
+        return '0x' + hex(result)[2:].rjust(64, '0')
+
+
+class FakeExchanges:
+    """Fake Bibox, OKEX and Gate.io APIs, returning balances from a `BalanceModel` after an injected latency.
+
+    `install()` makes the keeper create these instead of the real API clients.
+    """
+    def __init__(self, balance_model: BalanceModel, token_names: list, latency: float):
+        assert(isinstance(balance_model, BalanceModel))
+        assert(isinstance(token_names, list))
+        assert(isinstance(latency, float))
+
+        self.balance_model = balance_model
+        self.token_names = token_names
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.calls = collections.Counter()
+
+    def call(self, exchange: str, api_key: str) -> dict:
+        with self._lock:
+            self.calls[exchange] += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        return {token_name: self.balance_model.balance(exchange, api_key, token_name) for token_name in self.token_names}
+
+    def install(self):
+        exchanges = self
+
+        class FakeBiboxApi(BiboxApi):
+            def __init__(self, api_server: str, api_key: str, secret: str, timeout: float):
+                self.api_server = api_server
+                self.api_key = api_key
+                self.secret = secret
+                self.timeout = timeout
+
+            def coin_list(self, retry: bool = False):
+                return [{'symbol': token_name, 'totalBalance': str(balance)}
+                        for token_name, balance in exchanges.call('bibox', self.api_key).items()]
+
+        class FakeOKEXApi(OKEXApi):
+            def __init__(self, api_server: str, api_key: str, secret_key: str, timeout: float):
+                self.api_server = api_server
+                self.api_key = api_key
+                self.secret_key = secret_key
+                self.timeout = timeout
+
+            def get_balances(self) -> dict:
+                balances = exchanges.call('okex', self.api_key)
+                return {'free': {token_name.lower(): str(balance) for token_name, balance in balances.items()},
+                        'freezed': {token_name.lower(): '0' for token_name in balances}}
+
+        class FakeGateIOApi(GateIOApi):
+            def __init__(self, api_server: str, api_key: str, secret_key: str, timeout: float):
+                self.api_server = api_server
+                self.api_key = api_key
+                self.secret_key = secret_key
+                self.timeout = timeout
+
+            def get_balances(self) -> dict:
+                balances = exchanges.call('gateio', self.api_key)
+                return {'available': {token_name.upper(): str(balance) for token_name, balance in balances.items()}}
+
+        inventory_keeper.members.bibox.BiboxApi = FakeBiboxApi
+        inventory_keeper.members.okex.OKEXApi = FakeOKEXApi
+        inventory_keeper.members.gateio.GateIOApi = FakeGateIOApi
@@ -0,0 +1,83 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from inventory_keeper.batch import AllowanceQuery
+from inventory_keeper.files import write_atomically
+
+
+class ApprovalCache:
+    """Remembers allowances which have already been verified to be sufficient.
+
+    Verified allowances are stored in a JSON file, so they do not have to be read again
+    after a restart. If `filename` is `None`, they are only remembered in memory.
+
+    An allowance revoked by its owner after being verified will not be noticed until
+    the file gets removed.
+
+    Attributes:
+        filename: Filename of the approval cache file, or `None`.
+    """
+
+    logger = logging.getLogger('approval-cache')
+
+    def __init__(self, filename: Optional[str]):
+        assert(isinstance(filename, str) or (filename is None))
+
+        self.filename = filename
+        self._verified = set()
+        self._lock = threading.Lock()
+
+        if self.filename is not None and os.path.exists(self.filename):
+            try:
+                with open(self.filename) as file:
+                    self._verified = set(tuple(item) for item in json.load(file))
+
+                self.logger.info(f"Loaded {len(self._verified)} verified approvals from '{self.filename}'")
+            except Exception as e:
+                self.logger.warning(f"Failed to load approval cache from '{self.filename}', ignoring it: {e}")
+
+    def __contains__(self, query: AllowanceQuery) -> bool:
+        assert(isinstance(query, AllowanceQuery))
+
+        with self._lock:
+            return self._key(query) in self._verified
+
+    def add(self, query: AllowanceQuery):
+        assert(isinstance(query, AllowanceQuery))
+
+        with self._lock:
+            self._verified.add(self._key(query))
+
+    def save(self):
+        if self.filename is None:
+            return
+
+        with self._lock:
+            content = json.dumps(sorted(list(item) for item in self._verified), indent=2)
+
+        write_atomically(self.filename, content)
+
+    @staticmethod
+    def _key(query: AllowanceQuery) -> tuple:
+        # addresses are compared case-insensitively, as the file can be edited by hand
+        return tuple(address.lower() for address in query._key())
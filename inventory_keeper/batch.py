@@ -0,0 +1,377 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+import requests
+from web3 import Web3
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+RAW_ETH = Address('0x0000000000000000000000000000000000000000')
+
+ERC20_BALANCE_OF = '70a08231'
+LEDGER_BALANCE_OF = 'f7888aec'
+ERC20_ALLOWANCE = 'dd62ed3e'
+MULTICALL_AGGREGATE = '252dba42'
+MULTICALL_GET_ETH_BALANCE = '4d2301cc'
+
+
+def batch_request(web3: Web3, calls: list) -> list:
+    """Sends a list of JSON-RPC calls as a single JSON-RPC batch request.
+
+    Providers can handle batch requests themselves by implementing a `make_batch_request`
+    method. For other providers the batch gets posted directly to their `endpoint_uri`.
+
+    Args:
+        web3: An instance of `Web3`.
+        calls: List of `(method, params)` tuples.
+
+    Returns:
+        List of results, in the same order as `calls`.
+    """
+    assert(isinstance(web3, Web3))
+    assert(isinstance(calls, list))
+
+    provider = web3.providers[0]
+    payload = [{"jsonrpc": "2.0", "id": index, "method": method, "params": params}
+               for index, (method, params) in enumerate(calls)]
+
+    if hasattr(provider, 'make_batch_request'):
+        responses = provider.make_batch_request(payload)
+    elif hasattr(provider, 'endpoint_uri'):
+        response = requests.post(provider.endpoint_uri, json=payload, timeout=60)
+        response.raise_for_status()
+        responses = response.json()
+    else:
+        raise Exception(f"Provider {provider} does not support batch requests")
+
+    responses = sorted(responses, key=lambda response: response['id'])
+    if len(responses) != len(calls):
+        raise Exception(f"Expected {len(calls)} responses to a batch request, got {len(responses)}")
+
+    for response in responses:
+        if 'error' in response:
+            raise Exception(f"Batch request failed: {response['error']}")
+
+    return [response['result'] for response in responses]
+
+
+class BalanceQuery:
+    """Identifies a single on-chain balance.
+
+    If `ledger` is `None`, this is either the raw ETH balance of `owner` (if `token` is `RAW_ETH`)
+    or its ERC20 `token` balance. Otherwise it is the balance of `owner` held in a `ledger`
+    contract exposing a `balanceOf(token, user)` method, like EtherDelta does.
+    """
+    def __init__(self, token: Address, owner: Address, ledger: Optional[Address] = None):
+        assert(isinstance(token, Address))
+        assert(isinstance(owner, Address))
+        assert(isinstance(ledger, Address) or (ledger is None))
+
+        self.token = token
+        self.owner = owner
+        self.ledger = ledger
+
+    def _key(self) -> tuple:
+        return self.token.address, self.owner.address, self.ledger.address if self.ledger is not None else None
+
+    def __eq__(self, other):
+        assert(isinstance(other, BalanceQuery))
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"BalanceQuery(token={self.token}, owner={self.owner}, ledger={self.ledger})"
+
+
+class AllowanceQuery:
+    """Identifies an ERC20 allowance granted by `owner` to `spender`."""
+    def __init__(self, token: Address, owner: Address, spender: Address):
+        assert(isinstance(token, Address))
+        assert(isinstance(owner, Address))
+        assert(isinstance(spender, Address))
+
+        self.token = token
+        self.owner = owner
+        self.spender = spender
+
+    def _key(self) -> tuple:
+        return self.token.address, self.owner.address, self.spender.address
+
+    def __eq__(self, other):
+        assert(isinstance(other, AllowanceQuery))
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"AllowanceQuery(token={self.token}, owner={self.owner}, spender={self.spender})"
+
+
+class BalanceReader:
+    """Reads on-chain balances in batches.
+
+    If the address of a Multicall contract is known, all balances are read with a single
+    `aggregate` call to that contract. Otherwise they are read with a single JSON-RPC batch
+    request. Very long lists of balances are split into chunks of `max_batch_size`.
+
+    Balances can be prefetched for the duration of a cycle using `prefetched()`, in which
+    case `balance_of()` will return them without contacting the node. All reads made for
+    the duration of a cycle can also be pinned to a single block, so they are consistent
+    with each other even if new blocks arrive in the meantime. Only one thread can pin reads at
+    a time, others wait in `prefetched()` until it is done.
+
+    Contract calls which can not be expressed as balance queries can be pinned to the same
+    block by making them through `pinned_web3`. It is a separate `Web3` instance sharing
+    the provider with `web3`, whose default block follows the pinned block. It must not be
+    used for sending transactions.
+
+    Attributes:
+        web3: An instance of `Web3`.
+        pinned_web3: An instance of `Web3` whose calls are pinned to the current block.
+        multicall_address: Address of the Multicall contract, or `None` if not available.
+        max_batch_size: Maximum number of balances read in one request.
+    """
+
+    logger = logging.getLogger('balance-reader')
+
+    def __init__(self, web3: Web3, multicall_address: Optional[Address], max_batch_size: int = 500):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(multicall_address, Address) or (multicall_address is None))
+        assert(isinstance(max_batch_size, int))
+
+        self.web3 = web3
+        self.pinned_web3 = Web3(web3.providers)
+        self.multicall_address = multicall_address
+        self.max_batch_size = max_batch_size
+        self._prefetched = {}
+        self._block_number = None
+        self._lock = threading.Lock()
+        self._pin_lock = threading.RLock()
+
+    def balances(self, token_addresses: List[Address], accounts: List[Address]) -> List[List[Wad]]:
+        """Reads balances of multiple tokens for multiple accounts.
+
+        Returns:
+            Balance matrix, with one row per account and one column per token.
+        """
+        assert(isinstance(token_addresses, list))
+        assert(isinstance(accounts, list))
+
+        if len(token_addresses) == 0:
+            return [[] for _ in accounts]
+
+        queries = [BalanceQuery(token_address, account) for account in accounts for token_address in token_addresses]
+        result = self.read(queries)
+
+        return [result[index:index + len(token_addresses)] for index in range(0, len(result), len(token_addresses))]
+
+    def read(self, queries: List[BalanceQuery]) -> List[Wad]:
+        """Reads multiple balances, using as few requests as possible.
+
+        Returns:
+            List of balances, in the same order as `queries`.
+        """
+        assert(isinstance(queries, list))
+
+        result = []
+        for index in range(0, len(queries), self.max_batch_size):
+            chunk = queries[index:index + self.max_batch_size]
+            if self.multicall_address is not None:
+                result += self._read_multicall(chunk)
+            else:
+                result += self._read_batch(chunk)
+
+        return result
+
+    def allowances(self, queries: List[AllowanceQuery]) -> List[Wad]:
+        """Reads multiple ERC20 allowances, using as few requests as possible.
+
+        Returns:
+            List of allowances, in the same order as `queries`.
+        """
+        assert(isinstance(queries, list))
+
+        result = []
+        for index in range(0, len(queries), self.max_batch_size):
+            calls = [(query.token, ERC20_ALLOWANCE + self._encode_address(query.owner) + self._encode_address(query.spender))
+                     for query in queries[index:index + self.max_batch_size]]
+
+            if self.multicall_address is not None:
+                result += self._multicall(calls)
+            else:
+                result += self._call_batch(calls)
+
+        return result
+
+    def balance_of(self, query: BalanceQuery) -> Wad:
+        """Returns a balance, either a prefetched one or read from the node if it wasn't prefetched."""
+        assert(isinstance(query, BalanceQuery))
+
+        with self._lock:
+            if query in self._prefetched:
+                return self._prefetched[query]
+
+        return self.read([query])[0]
+
+    @contextmanager
+    def prefetched(self, queries: List[BalanceQuery], block_number: Optional[int] = None):
+        """Reads all `queries` upfront and serves them from memory until the context is left.
+
+        If `block_number` is specified, all balances read until the context is left (prefetched
+        or not) are read as of that block. The prefetched balances are discarded afterwards,
+        so transfers made later on always see current balances.
+        """
+        assert(isinstance(queries, list))
+        assert(isinstance(block_number, int) or (block_number is None))
+
+        # the prefetched balances and the pinned block are shared by all threads,
+        # so another thread must not replace them until this context is left
+        with self._pin_lock:
+            with self._lock:
+                self._block_number = block_number
+                self.pinned_web3.eth.defaultBlock = block_number if block_number is not None else 'latest'
+
+            queries = list(set(queries))
+            try:
+                balances = self.read(queries)
+                with self._lock:
+                    self._prefetched = dict(zip(queries, balances))
+
+                self.logger.debug(f"Prefetched {len(queries)} balances" +
+                                  (f" at block #{block_number}" if block_number is not None else ""))
+            except Exception as e:
+                self.logger.warning(f"Failed to prefetch balances, will read them one by one: {e}")
+
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._prefetched = {}
+                    self._block_number = None
+                    self.pinned_web3.eth.defaultBlock = 'latest'
+
+    def pinned_block(self) -> Optional[int]:
+        """Returns the block all reads are pinned to, or `None` if they are not pinned."""
+        with self._lock:
+            return self._block_number
+
+    def _block_identifier(self):
+        with self._lock:
+            return self._block_number if self._block_number is not None else 'latest'
+
+    def _read_batch(self, queries: List[BalanceQuery]) -> List[Wad]:
+        block_identifier = self._block_identifier()
+        if isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+
+        calls = []
+        for query in queries:
+            if query.ledger is None and query.token == RAW_ETH:
+                calls.append(("eth_getBalance", [query.owner.address, block_identifier]))
+            else:
+                calls.append(("eth_call", [{'to': self._call_target(query).address,
+                                            'data': '0x' + self._call_data(query)}, block_identifier]))
+
+        return [Wad(int(result, 16)) if result not in ['0x', None] else Wad(0)
+                for result in batch_request(self.web3, calls)]
+
+    def _call_batch(self, calls: list) -> List[Wad]:
+        block_identifier = self._block_identifier()
+        if isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+
+        calls = [("eth_call", [{'to': target.address, 'data': '0x' + data}, block_identifier]) for target, data in calls]
+
+        return [Wad(int(result, 16)) if result not in ['0x', None] else Wad(0)
+                for result in batch_request(self.web3, calls)]
+
+    def _read_multicall(self, queries: List[BalanceQuery]) -> List[Wad]:
+        calls = []
+        for query in queries:
+            if query.ledger is None and query.token == RAW_ETH:
+                calls.append((self.multicall_address, MULTICALL_GET_ETH_BALANCE + self._encode_address(query.owner)))
+            else:
+                calls.append((self._call_target(query), self._call_data(query)))
+
+        return self._multicall(calls)
+
+    def _multicall(self, calls: list) -> List[Wad]:
+        response = self.web3.eth.call({'to': self.multicall_address.address,
+                                       'data': '0x' + MULTICALL_AGGREGATE + self._encode_aggregate(calls)},
+                                      self._block_identifier())
+
+        return [Wad(int.from_bytes(data, 'big')) for data in self._decode_aggregate(response)]
+
+    def _call_target(self, query: BalanceQuery) -> Address:
+        return query.ledger if query.ledger is not None else query.token
+
+    def _call_data(self, query: BalanceQuery) -> str:
+        if query.ledger is not None:
+            return LEDGER_BALANCE_OF + self._encode_address(query.token) + self._encode_address(query.owner)
+        else:
+            return ERC20_BALANCE_OF + self._encode_address(query.owner)
+
+    @staticmethod
+    def _encode_address(address: Address) -> str:
+        return address.address[2:].lower().rjust(64, '0')
+
+    @staticmethod
+    def _encode_uint(value: int) -> str:
+        return hex(value)[2:].rjust(64, '0')
+
+    def _encode_aggregate(self, calls: list) -> str:
+        # ABI encoding of a single `(address,bytes)[]` argument
+        heads = []
+        tails = []
+        offset = 32 * len(calls)
+        for target, data in calls:
+            data_length = len(data) // 2
+            padded_data = data.ljust(((data_length + 31) // 32) * 64, '0')
+            tail = self._encode_address(target) + self._encode_uint(64) + self._encode_uint(data_length) + padded_data
+
+            heads.append(self._encode_uint(offset))
+            tails.append(tail)
+            offset += len(tail) // 2
+
+        return self._encode_uint(32) + self._encode_uint(len(calls)) + ''.join(heads) + ''.join(tails)
+
+    @staticmethod
+    def _decode_aggregate(response) -> List[bytes]:
+        # ABI decoding of `(uint256 blockNumber, bytes[] returnData)`
+        data = bytes.fromhex(response[2:]) if isinstance(response, str) else bytes(response)
+
+        def word(position: int) -> int:
+            return int.from_bytes(data[position:position + 32], 'big')
+
+        array_start = word(32)
+        count = word(array_start)
+        result = []
+        for index in range(count):
+            item_start = array_start + 32 + word(array_start + 32 + 32 * index)
+            item_length = word(item_start)
+            result.append(data[item_start + 32:item_start + 32 + item_length])
+
+        return result
@@ -0,0 +1,148 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open."""
+    pass
+
+
+class CircuitBreaker:
+    """Stops calling a failing backend after a number of consecutive failures.
+
+    Once `threshold` calls in a row have failed, the breaker opens and calls get rejected with
+    `CircuitOpenError` without reaching the backend. After `backoff` seconds a single call is let
+    through as a probe. If it succeeds the breaker closes again, if it fails the breaker stays open
+    and the time until the next probe gets doubled, up to `max_backoff` seconds.
+
+    Attributes:
+        name: Name of the backend, used in log messages.
+        threshold: Number of consecutive failures after which the breaker opens.
+        backoff: Time until the first probe (in seconds).
+        max_backoff: Maximum time between probes (in seconds).
+    """
+
+    logger = logging.getLogger('circuit-breaker')
+
+    def __init__(self, name: str, threshold: int = 3, backoff: float = 30.0, max_backoff: float = 600.0):
+        assert(isinstance(name, str))
+        assert(isinstance(threshold, int))
+        assert(isinstance(backoff, float))
+        assert(isinstance(max_backoff, float))
+
+        self.name = name
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._failures = 0
+        self._current_backoff = backoff
+        self._probe_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._probe_at is not None
+
+    def allow(self) -> bool:
+        """Returns `True` if a call can be made now, either because the breaker is closed or as a probe."""
+        with self._lock:
+            if self._probe_at is None:
+                return True
+
+            if self._probing or time.time() < self._probe_at:
+                return False
+
+            self._probing = True
+            return True
+
+    def succeeded(self):
+        with self._lock:
+            if self._probe_at is not None:
+                self.logger.info(f"{self.name} has recovered, closing the circuit breaker")
+
+            self._failures = 0
+            self._current_backoff = self.backoff
+            self._probe_at = None
+            self._probing = False
+
+    def failed(self):
+        with self._lock:
+            self._failures += 1
+            if self._probe_at is not None:
+                if self._probing:
+                    self._current_backoff = min(self._current_backoff * 2, self.max_backoff)
+                    self._probe_at = time.time() + self._current_backoff
+                    self._probing = False
+                    self.logger.warning(f"{self.name} is still failing, next probe in {self._current_backoff:.0f}s")
+            elif self._failures >= self.threshold:
+                self._probe_at = time.time() + self._current_backoff
+                self.logger.warning(f"{self.name} failed {self._failures} times in a row, opening the circuit"
+                                    f" breaker, next probe in {self._current_backoff:.0f}s")
+
+    def release(self):
+        """Records that a call let through by `allow()` has told nothing about the backend."""
+        with self._lock:
+            self._probing = False
+
+    def error(self) -> CircuitOpenError:
+        return CircuitOpenError(f"{self.name} is failing, circuit breaker is open")
+
+    def call(self, function):
+        """Calls `function` unless the breaker is open, recording the outcome."""
+        assert(callable(function))
+
+        if not self.allow():
+            raise self.error()
+
+        try:
+            result = function()
+        except CircuitOpenError:
+            # a breaker of some other backend this one depends on is open, so we learnt nothing
+            self.release()
+            raise
+        except Exception:
+            self.failed()
+            raise
+
+        self.succeeded()
+        return result
+
+
+class CircuitBreakers:
+    """Circuit breakers of a number of backends, all with the same settings, created on first use."""
+    def __init__(self, threshold: int = 3, backoff: float = 30.0, max_backoff: float = 600.0):
+        assert(isinstance(threshold, int))
+        assert(isinstance(backoff, float))
+        assert(isinstance(max_backoff, float))
+
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, name: str) -> CircuitBreaker:
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(name, self.threshold, self.backoff, self.max_backoff)
+
+            return self._breakers[key]
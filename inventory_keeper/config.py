@@ -23,15 +23,11 @@ from typing import Optional
 
 from web3 import Web3
 
-from inventory_keeper.type import OasisMarketMakerKeeper, RadarRelayMarketMakerKeeper, BiboxMarketMakerKeeper, \
-    EtherDeltaMarketMakerKeeper, OkexMarketMakerKeeper, GateIOMarketMakerKeeper
-from pyexchange.bibox import BiboxApi
-from pyexchange.gateio import GateIOApi
-from pyexchange.okex import OKEXApi
+from inventory_keeper.batch import BalanceReader
+from inventory_keeper.ratelimit import ExchangeScheduler
+from inventory_keeper.registry import member_types
 from pymaker import Address
-from pymaker.etherdelta import EtherDelta
 from pymaker.numeric import Wad
-from pymaker.oasis import MatchingMarket
 
 
 class OasisCache:
@@ -40,6 +36,7 @@ class OasisCache:
 
         self.web3 = web3
         self._cache = {}
+        self._order_indexes = {}
         self._lock = threading.Lock()
 
     def get_otc(self, oasis_address: Address):
@@ -47,26 +44,129 @@ class OasisCache:
 
         with self._lock:
             if oasis_address not in self._cache:
+                # imported here, so it only gets imported if there are Oasis members
+                from pymaker.oasis import MatchingMarket
+
                 self._cache[oasis_address] = MatchingMarket(web3=self.web3, address=oasis_address)
 
         return self._cache[oasis_address]
 
+    def get_order_index(self, oasis_address: Address):
+        assert(isinstance(oasis_address, Address))
+
+        otc = self.get_otc(oasis_address)
+
+        with self._lock:
+            if oasis_address not in self._order_indexes:
+                from inventory_keeper.orders import OasisOrderIndex
+
+                self._order_indexes[oasis_address] = OasisOrderIndex(web3=self.web3, otc=otc)
+
+        return self._order_indexes[oasis_address]
+
+
+class ExchangeCache:
+    """Shares exchange member implementations between members using the same API credentials.
+
+    Members sharing an implementation also share its API client and its balances, so these
+    balances get fetched only once per cycle no matter how many members use that account.
+    All exchange API calls made by these implementations go through `scheduler`.
+    """
+    def __init__(self, scheduler: ExchangeScheduler):
+        assert(isinstance(scheduler, ExchangeScheduler))
+
+        self.scheduler = scheduler
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get_implementation(self, key: tuple, create_func):
+        assert(isinstance(key, tuple))
+        assert(callable(create_func))
+
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = create_func()
+
+        return self._cache[key]
+
+    def retain(self, implementations: list) -> int:
+        """Drops all implementations which are not in `implementations`, returns the number of them."""
+        assert(isinstance(implementations, list))
+
+        with self._lock:
+            unused = [key for key, implementation in self._cache.items()
+                      if not any(implementation is other for other in implementations)]
+            for key in unused:
+                del self._cache[key]
+
+        return len(unused)
+
+    def invalidate_balances(self):
+        with self._lock:
+            implementations = list(self._cache.values())
+
+        for implementation in implementations:
+            implementation.balances.invalidate()
+
+
+def _slots(obj) -> dict:
+    return {slot: getattr(obj, slot) for slot in obj.__slots__}
+
 
 class Config:
+    """Compiled inventory configuration.
+
+    All member tokens are resolved to their `Token` objects and all amounts are converted
+    to `Wad`s when the config is loaded, so any errors in the config file are reported
+    at that moment and not in the middle of a cycle.
+    """
+
+    __slots__ = ('tokens', 'tokens_by_name', 'base_name', 'base_address', 'base_min_eth_balance', 'members')
+
     def __init__(self, data: dict):
         assert(isinstance(data, dict))
 
         self.tokens = [Token(key, Address(value) if value != "" else None) for key, value in data['tokens'].items()]
+        self.tokens_by_name = {token.name: token for token in self.tokens}
         self.base_name = data['base']['name']
         self.base_address = Address(data['base']['address'])
         self.base_min_eth_balance = Wad.from_number(data['base']['minEthBalance'])
-        self.members = [Member(item) for item in data['members']]
+        self.members = [Member(item, self.tokens_by_name) for item in data['members']]
+
+    def reuse_implementations(self, previous_config) -> int:
+        """Takes over member implementations from `previous_config`.
+
+        Implementations (and their contract objects, API clients and connections) are taken over
+        only by members whose `name`, `type` and `config` (with environment variables resolved)
+        did not change, so they do not have to be created again if only their token thresholds changed.
+
+        Returns:
+            The number of members which took over their implementations.
+        """
+        assert(isinstance(previous_config, Config))
+
+        previous_members = {member.name: member for member in previous_config.members}
+
+        result = 0
+        for member in self.members:
+            previous_member = previous_members.get(member.name)
+            if previous_member is not None \
+                    and previous_member.type == member.type \
+                    and member.resolved_config() is not None \
+                    and previous_member.resolved_config() == member.resolved_config() \
+                    and previous_member._type_object is not None:
+                member._type_object = previous_member._type_object
+                result += 1
+
+        return result
 
     def __repr__(self):
-        return pformat(vars(self))
+        return pformat(_slots(self))
 
 
 class Token:
+    __slots__ = ('name', 'address')
+
     def __init__(self, name: str, address: Optional[Address]):
         assert(isinstance(name, str))
         assert(isinstance(address, Address) or (address is None))
@@ -75,86 +175,76 @@ class Token:
         self.address = address
 
     def __repr__(self):
-        return pformat(vars(self))
+        return pformat(_slots(self))
 
 
 class Member:
-    def __init__(self, data: dict):
+    __slots__ = ('name', 'type', 'config', 'timeout', 'tokens', '_type_object')
+
+    def __init__(self, data: dict, tokens_by_name: dict):
         assert(isinstance(data, dict))
+        assert(isinstance(tokens_by_name, dict))
 
         self.name = data['name']
         self.type = data['type']
         self.config = data['config']
-        self.tokens = [MemberToken(key, value) for key, value in data['tokens'].items()]
+        self.timeout = float(data['timeout']) if 'timeout' in data else None
+        self.tokens = []
         self._type_object = None
 
-    def implementation(self, web3: Web3, oasis_cache: OasisCache):
+        for key, value in data['tokens'].items():
+            if key not in tokens_by_name:
+                raise Exception(f"Member '{self.name}' refers to unknown token '{key}'")
+
+            self.tokens.append(MemberToken(tokens_by_name[key], value))
+
+    def implementation(self, web3: Web3, oasis_cache: OasisCache, exchange_cache: ExchangeCache,
+                       balance_reader: BalanceReader):
         assert(isinstance(web3, Web3))
         assert(isinstance(oasis_cache, OasisCache))
+        assert(isinstance(exchange_cache, ExchangeCache))
+        assert(isinstance(balance_reader, BalanceReader))
 
-        if self._type_object is not None:
-            return self._type_object
-
-        if self.type == 'oasis-market-maker-keeper':
-            oasis_address = Address(self.config['oasisAddress'])
-            market_maker_address = Address(self.config['marketMakerAddress'])
-
-            self._type_object = OasisMarketMakerKeeper(web3=web3,
-                                                      otc=oasis_cache.get_otc(oasis_address),
-                                                      address=market_maker_address)
-        elif self.type == 'etherdelta-market-maker-keeper':
-            etherdelta_address = Address(self.config['etherDeltaAddress'])
-            market_maker_address = Address(self.config['marketMakerAddress'])
-
-            self._type_object = EtherDeltaMarketMakerKeeper(web3=web3,
-                                               etherdelta=EtherDelta(web3=web3, address=etherdelta_address),
-                                               address=market_maker_address)
-        elif self.type == 'radarrelay-market-maker-keeper':
-            market_maker_address = Address(self.config['marketMakerAddress'])
-            self._type_object = RadarRelayMarketMakerKeeper(web3=web3, address=market_maker_address)
-        elif self.type == 'bibox-market-maker-keeper':
-            bibox_api = BiboxApi(api_server="https://api.bibox.com",
-                                 api_key=self._environ(self.config['apiKey']),
-                                 secret=self._environ(self.config['secret']),
-                                 timeout=9.5)
-            self._type_object = BiboxMarketMakerKeeper(web3=web3, bibox_api=bibox_api)
-        elif self.type == 'okex-market-maker-keeper':
-            okex_api = OKEXApi(api_server="https://www.okex.com",
-                                 api_key=self._environ(self.config['apiKey']),
-                                 secret_key=self._environ(self.config['secretKey']),
-                                 timeout=15.5)
-            self._type_object = OkexMarketMakerKeeper(web3=web3, okex_api=okex_api)
-        elif self.type == 'gateio-market-maker-keeper':
-            gateio_api = GateIOApi(api_server="https://data.gate.io",
-                                  api_key=self._environ(self.config['apiKey']),
-                                  secret_key=self._environ(self.config['secretKey']),
-                                  timeout=9.5)
-            self._type_object = GateIOMarketMakerKeeper(web3=web3, gateio_api=gateio_api)
-        else:
-            raise Exception(f"Unknown member type: '{self.type}'")
+        if self._type_object is None:
+            factory = member_types.factory(self.type)
+            self._type_object = factory(self, web3, oasis_cache, exchange_cache, balance_reader)
 
         return self._type_object
 
+    def resolved_config(self) -> Optional[dict]:
+        """Returns `config` with references to environment variables resolved, `None` if some are not set."""
+        try:
+            return {key: self.environ(value) if isinstance(value, str) else value for key, value in self.config.items()}
+        except KeyError:
+            return None
+
     @staticmethod
-    def _environ(value: str):
+    def environ(value: str):
         if value.startswith('$'):
             return os.environ[value[1:]]
         else:
             return value
 
     def __repr__(self):
-        return pformat(vars(self))
+        return pformat(_slots(self))
 
 
 class MemberToken:
-    def __init__(self, token_name: str, data: dict):
-        assert(isinstance(token_name, str))
+    __slots__ = ('token', 'token_name', 'min_amount', 'avg_amount', 'max_amount')
+
+    def __init__(self, token: Token, data: dict):
+        assert(isinstance(token, Token))
         assert(isinstance(data, dict))
 
-        self.token_name = token_name
+        self.token = token
+        self.token_name = token.name
         self.min_amount = Wad.from_number(data['minAmount']) if 'minAmount' in data else None
         self.avg_amount = Wad.from_number(data['avgAmount']) if 'avgAmount' in data else None
         self.max_amount = Wad.from_number(data['maxAmount']) if 'maxAmount' in data else None
 
+        amounts = [amount for amount in [self.min_amount, self.avg_amount, self.max_amount] if amount is not None]
+        if amounts != sorted(amounts):
+            raise Exception(f"Amounts of '{self.token_name}' have to satisfy minAmount <= avgAmount <= maxAmount")
+
     def __repr__(self):
-        return pformat(vars(self))
+        return pformat(_slots(self))
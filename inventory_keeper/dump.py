@@ -0,0 +1,140 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import datetime
+import io
+import json
+from typing import Optional
+
+import pytz
+
+from inventory_keeper.snapshot import InventorySnapshot
+from pymaker.numeric import Wad
+
+DUMP_FORMATS = ['text', 'json', 'csv', 'ndjson']
+
+RECORD_FIELDS = ['account', 'type', 'token', 'balance', 'minAmount', 'avgAmount', 'maxAmount', 'error', 'stale', 'age']
+
+
+def _amount(amount: Optional[Wad]) -> Optional[str]:
+    # amounts are kept as strings, so they do not lose precision when parsed as floats
+    return str(amount) if amount is not None else None
+
+
+def format_age(seconds: float) -> str:
+    """Formats an age in seconds in a short human readable form, like `45s`, `12m` or `3h`."""
+    assert(isinstance(seconds, float) or isinstance(seconds, int))
+
+    if seconds < 60:
+        return f"{int(seconds)}s"
+    elif seconds < 3600:
+        return f"{int(seconds // 60)}m"
+    else:
+        return f"{int(seconds // 3600)}h"
+
+
+def _age(snapshot: InventorySnapshot, fetch_result) -> Optional[int]:
+    # stale balances are given with their age at the time the snapshot has been taken
+    return int(snapshot.timestamp - fetch_result.timestamp) if fetch_result.stale else None
+
+
+def inventory_records(snapshot: InventorySnapshot) -> list:
+    """Returns balances from the snapshot as a flat list of records, one per account and token."""
+    assert(isinstance(snapshot, InventorySnapshot))
+
+    config = snapshot.config
+    result = []
+    for token in config.tokens:
+        result.append({'account': config.base_name,
+                       'type': 'base',
+                       'token': token.name,
+                       'balance': _amount(snapshot.base_balances[token.name]),
+                       'minAmount': None,
+                       'avgAmount': None,
+                       'maxAmount': None,
+                       'error': None,
+                       'stale': False,
+                       'age': None})
+
+    for member, member_balances in zip(config.members, snapshot.members_balances):
+        for member_token, fetch_result in zip(member.tokens, member_balances):
+            result.append({'account': member.name,
+                           'type': member.type,
+                           'token': member_token.token_name,
+                           'balance': _amount(fetch_result.balance),
+                           'minAmount': _amount(member_token.min_amount),
+                           'avgAmount': _amount(member_token.avg_amount),
+                           'maxAmount': _amount(member_token.max_amount),
+                           'error': str(fetch_result.error) if fetch_result.error is not None else None,
+                           'stale': fetch_result.stale,
+                           'age': _age(snapshot, fetch_result)})
+
+    return result
+
+
+def format_json(snapshot: InventorySnapshot, metadata: bool = True) -> str:
+    """Formats the snapshot as a JSON document.
+
+    If `metadata` is `False`, the block number and the timestamp of the snapshot are left out.
+    """
+    assert(isinstance(snapshot, InventorySnapshot))
+    assert(isinstance(metadata, bool))
+
+    config = snapshot.config
+    members = []
+    for member, member_balances in zip(config.members, snapshot.members_balances):
+        members.append({'name': member.name,
+                        'type': member.type,
+                        'tokens': {member_token.token_name: {'balance': _amount(fetch_result.balance),
+                                                             'minAmount': _amount(member_token.min_amount),
+                                                             'avgAmount': _amount(member_token.avg_amount),
+                                                             'maxAmount': _amount(member_token.max_amount),
+                                                             'error': str(fetch_result.error)
+                                                             if fetch_result.error is not None else None,
+                                                             'stale': fetch_result.stale,
+                                                             'age': _age(snapshot, fetch_result)}
+                                   for member_token, fetch_result in zip(member.tokens, member_balances)}})
+
+    result = {}
+    if metadata:
+        generated_at = datetime.datetime.fromtimestamp(snapshot.timestamp, tz=pytz.UTC)
+        result['blockNumber'] = snapshot.block_number
+        result['generatedAt'] = generated_at.isoformat()
+
+    result['base'] = {'name': config.base_name,
+                      'balances': {token_name: _amount(balance) for token_name, balance in snapshot.base_balances.items()}}
+    result['members'] = members
+    result['totals'] = {token_name: _amount(balance) for token_name, balance in snapshot.total_balances().items()}
+
+    return json.dumps(result, indent=2)
+
+
+def format_csv(records: list) -> str:
+    assert(isinstance(records, list))
+
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=RECORD_FIELDS, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(records)
+    return output.getvalue()
+
+
+def format_ndjson(records: list) -> str:
+    assert(isinstance(records, list))
+
+    return ''.join(json.dumps(record) + '\n' for record in records)
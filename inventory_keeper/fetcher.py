@@ -0,0 +1,239 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import logging
+import threading
+import time
+from pprint import pformat
+from typing import Optional
+
+from web3 import Web3
+
+from inventory_keeper.batch import BalanceReader
+from inventory_keeper.breaker import CircuitBreaker, CircuitBreakers, CircuitOpenError
+from inventory_keeper.config import Config, OasisCache, ExchangeCache, Member, MemberToken
+from inventory_keeper.metrics import record_balance_fetch
+from inventory_keeper.type import MissingTokenError
+from pymaker.numeric import Wad
+
+
+class FetchResult:
+    """Balance of a member token, or the error which occurred while reading it.
+
+    If the balance could not be read but has been read successfully before, the result carries both
+    the error and the last known good balance, which is then stale. `timestamp` is the time the balance
+    has been read at.
+    """
+    def __init__(self, balance: Optional[Wad], error: Optional[Exception], timestamp: Optional[float] = None):
+        assert(isinstance(balance, Wad) or (balance is None))
+        assert(isinstance(error, Exception) or (error is None))
+        assert(isinstance(timestamp, float) or (timestamp is None))
+
+        self.balance = balance
+        self.error = error
+        self.timestamp = timestamp
+
+    @property
+    def stale(self) -> bool:
+        return self.error is not None and self.balance is not None
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
+class BalanceFetcher:
+    """Fetches balances of all tokens of all members.
+
+    With one thread, balances are read sequentially, one member and one token at a time,
+    and member deadlines are not enforced. With more threads, all member tokens are read at once
+    using a bounded pool of worker threads, and each member gets its own deadline (measured from
+    the start of the fetch). Balances not read before the deadline are reported as failed.
+
+    A read which is already in progress can not be interrupted, so a read which has timed out
+    keeps its worker thread until it returns on its own, and other reads queued behind it can miss
+    their deadlines as well. To keep that within a single fetch, each fetch gets a new pool, reads
+    of members whose deadline has already passed are not started at all, and reads finishing
+    after the deadline are discarded (they might have read balances at a different block by then).
+    The pool should be large enough for all reads of members which may stall at the same time.
+
+    Results are always returned in the order of members and member tokens in the config.
+
+    Each member has its own circuit breaker, so a member which keeps failing does not get called
+    on every cycle. The outcome is recorded once per member per fetch: the member has failed only
+    if none of its balances could be read, and a token missing from an otherwise successful response
+    does not count as a failure. Balances which can not be read are reported together with the last
+    balance which has been read successfully, marked as stale.
+
+    Attributes:
+        web3: An instance of `Web3`.
+        oasis_cache: Oasis cache used to create member implementations.
+        exchange_cache: Exchange cache used to create member implementations.
+        balance_reader: Balance reader used to create member implementations.
+        threads: Maximum number of balances being read at the same time.
+        timeout: Default member deadline (in seconds), used if member does not define its own one.
+        breakers: Circuit breakers of members.
+    """
+
+    logger = logging.getLogger('balance-fetcher')
+
+    def __init__(self, web3: Web3, oasis_cache: OasisCache, exchange_cache: ExchangeCache, balance_reader: BalanceReader,
+                 threads: int, timeout: float, breakers: CircuitBreakers):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(oasis_cache, OasisCache))
+        assert(isinstance(exchange_cache, ExchangeCache))
+        assert(isinstance(balance_reader, BalanceReader))
+        assert(isinstance(threads, int))
+        assert(isinstance(timeout, float) or isinstance(timeout, int))
+        assert(isinstance(breakers, CircuitBreakers))
+
+        self.web3 = web3
+        self.oasis_cache = oasis_cache
+        self.exchange_cache = exchange_cache
+        self.balance_reader = balance_reader
+        self.threads = threads
+        self.timeout = timeout
+        self.breakers = breakers
+        self._last_good = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, config: Config) -> list:
+        """Reads balances of all member tokens.
+
+        Returns:
+            A list with one entry per member, each entry being a list of `FetchResult` objects,
+            one per each member token.
+        """
+        assert(isinstance(config, Config))
+
+        # Member implementations are created lazily, so we make sure it happens in this thread
+        # and not concurrently in the worker threads.
+        implementations = [member.implementation(self.web3, self.oasis_cache, self.exchange_cache,
+                                                 self.balance_reader) for member in config.members]
+
+        if self.threads <= 1:
+            return [self.fetch_member(member, implementation, member.tokens)
+                    for member, implementation in zip(config.members, implementations)]
+
+        # reads which have timed out in one fetch must not hold the worker threads of the next one
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            return self._fetch_concurrently(executor, config, implementations)
+        finally:
+            executor.shutdown(wait=False)
+
+    def _fetch_concurrently(self, executor: concurrent.futures.ThreadPoolExecutor, config: Config,
+                            implementations: list) -> list:
+        started_at = time.time()
+        timeouts = [member.timeout if member.timeout is not None else self.timeout for member in config.members]
+        breakers = [self._breaker(member) for member in config.members]
+        allowed = [breaker.allow() for breaker in breakers]
+        futures = [[executor.submit(self._fetch, member, implementation, member_token, started_at + timeout)
+                    for member_token in member.tokens] if member_allowed else None
+                   for member, implementation, timeout, member_allowed
+                   in zip(config.members, implementations, timeouts, allowed)]
+
+        result = []
+        for member, timeout, breaker, member_futures in zip(config.members, timeouts, breakers, futures):
+            if member_futures is None:
+                result.append([self._failed(member, member_token, breaker.error()) for member_token in member.tokens])
+                continue
+
+            remaining = max(started_at + timeout - time.time(), 0)
+            concurrent.futures.wait(member_futures, timeout=remaining)
+
+            member_result = []
+            for member_token, future in zip(member.tokens, member_futures):
+                if future.done():
+                    member_result.append(future.result())
+                else:
+                    future.cancel()
+                    self.logger.warning(f"Timed out reading {member_token.token_name} balance of '{member.name}'")
+                    member_result.append(self._failed(member, member_token,
+                                                      TimeoutError(f"Balance not read within {timeout}s")))
+
+            self._record_outcome(breaker, member_result)
+            result.append(member_result)
+
+        return result
+
+    def fetch_member(self, member: Member, member_implementation, member_tokens: list) -> list:
+        """Reads balances of the given tokens of a member, unless the circuit breaker of the member is open.
+
+        Returns:
+            A list of `FetchResult` objects, one per each member token.
+        """
+        assert(isinstance(member_tokens, list))
+
+        breaker = self._breaker(member)
+        if not breaker.allow():
+            return [self._failed(member, member_token, breaker.error()) for member_token in member_tokens]
+
+        result = [self._fetch(member, member_implementation, member_token) for member_token in member_tokens]
+        self._record_outcome(breaker, result)
+        return result
+
+    def _breaker(self, member: Member) -> CircuitBreaker:
+        return self.breakers.get(('member', member.name), f"Member '{member.name}'")
+
+    @staticmethod
+    def _record_outcome(breaker: CircuitBreaker, results: list):
+        errors = [result.error for result in results if result.error is not None]
+        if len(errors) < len(results) or any(isinstance(error, MissingTokenError) for error in errors):
+            breaker.succeeded()
+        elif all(isinstance(error, CircuitOpenError) for error in errors):
+            # the exchange account of the member is failing, which its own breaker takes care of
+            breaker.release()
+        else:
+            breaker.failed()
+
+    def _fetch(self, member: Member, member_implementation, member_token: MemberToken,
+               deadline: Optional[float] = None) -> FetchResult:
+        token = member_token.token
+        started_at = time.time()
+        if deadline is not None and started_at > deadline:
+            return self._failed(member, member_token, TimeoutError("Balance read not started before the deadline"))
+
+        try:
+            balance = member_implementation.balance(token.name, token.address)
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError):
+                record_balance_fetch(member, member_token, time.time() - started_at, None)
+
+            return self._failed(member, member_token, e)
+
+        record_balance_fetch(member, member_token, time.time() - started_at, balance)
+
+        # the fetch has already reported this balance as timed out, and the block
+        # the balance has been read at might not be the pinned one anymore
+        if deadline is not None and time.time() > deadline:
+            return self._failed(member, member_token, TimeoutError("Balance read after the deadline"))
+
+        result = FetchResult(balance, None, started_at)
+        with self._lock:
+            self._last_good[(member.name, member_token.token_name)] = result
+
+        return result
+
+    def _failed(self, member: Member, member_token: MemberToken, error: Exception) -> FetchResult:
+        with self._lock:
+            last_good = self._last_good.get((member.name, member_token.token_name))
+
+        if last_good is None:
+            return FetchResult(None, error)
+        else:
+            return FetchResult(last_good.balance, error, last_good.timestamp)
@@ -0,0 +1,42 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+
+
+def write_atomically(filename: str, content: str):
+    """Writes `content` to a temporary file first, and then renames it to `filename`.
+
+    Readers of `filename` will always see either the previous or the new content, never a partially
+    written file. The temporary file is created in the same directory, as renaming is only atomic
+    within a single filesystem.
+    """
+    assert(isinstance(filename, str))
+    assert(isinstance(content, str))
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename) + '.')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+
+        os.chmod(temp_filename, 0o644)
+        os.replace(temp_filename, filename)
+    except:
+        os.unlink(temp_filename)
+        raise
@@ -0,0 +1,146 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import threading
+from typing import Optional
+
+from inventory_keeper.config import MemberToken
+from inventory_keeper.history import HistoryReader
+from pymaker.numeric import Wad
+
+# minimum number of balances needed to estimate a burn rate
+MIN_SAMPLES = 3
+
+
+class BurnRateForecaster:
+    """Estimates how fast members consume their tokens, and plans top-ups ahead of time.
+
+    The burn rate of each member token is the net decrease of its balance within the last `window`
+    seconds, divided by the time the observations span, or zero if the balance has grown. Transfers
+    sent by the keeper itself are reported through `transferred()` and left out of the balance, so
+    a top-up does not make a member look like it stopped consuming tokens and a withdrawal does not
+    make it look like it consumed them. Balances loaded from the history do not carry this information,
+    so transfers made before the keeper has been restarted count as if they were external.
+
+    A member gets topped up once it is projected to fall below `minAmount` within `lead_time`
+    seconds, which should be enough for a deposit to get confirmed. The top-up brings the balance
+    up to what the member is projected to consume over `horizon` seconds on top of `minAmount`,
+    but not less than `avgAmount` and not more than `maxAmount`.
+
+    Attributes:
+        window: Period balances are taken into account for (in seconds).
+        horizon: Period a top-up should last for (in seconds).
+        lead_time: Time before a member is projected to fall below `minAmount` it gets topped up (in seconds).
+    """
+
+    logger = logging.getLogger('burn-rate-forecaster')
+
+    def __init__(self, window: float, horizon: float, lead_time: float):
+        assert(isinstance(window, float))
+        assert(isinstance(horizon, float))
+        assert(isinstance(lead_time, float))
+
+        self.window = window
+        self.horizon = horizon
+        self.lead_time = lead_time
+        self._samples = collections.defaultdict(collections.deque)
+        self._transferred = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, member_name: str, token_name: str, timestamp: float, balance: Wad):
+        assert(isinstance(member_name, str))
+        assert(isinstance(token_name, str))
+        assert(isinstance(timestamp, float))
+        assert(isinstance(balance, Wad))
+
+        key = (member_name, token_name)
+        with self._lock:
+            transferred = self._transferred[key]
+
+        self._observe(key, timestamp, float(balance) - transferred)
+
+    def transferred(self, member_name: str, token_name: str, amount: Wad, incoming: bool):
+        """Reports a confirmed transfer sent by the keeper to (`incoming`) or from a member.
+
+        It has to be reported before any balance including that transfer gets observed.
+        """
+        assert(isinstance(member_name, str))
+        assert(isinstance(token_name, str))
+        assert(isinstance(amount, Wad))
+        assert(isinstance(incoming, bool))
+
+        with self._lock:
+            self._transferred[(member_name, token_name)] += float(amount) if incoming else -float(amount)
+
+    def load(self, reader: HistoryReader, now: float):
+        """Loads balances recorded within the last `window` seconds, so forecasts survive restarts."""
+        assert(isinstance(reader, HistoryReader))
+        assert(isinstance(now, float))
+
+        count = 0
+        for sample in reader.samples(reader.series_ids(), now - self.window, now):
+            self._observe(reader.series[sample.series_id], sample.timestamp, sample.balance)
+            count += 1
+
+        self.logger.info(f"Loaded {count} balances from the balance history")
+
+    def burn_rate(self, member_name: str, token_name: str) -> Optional[float]:
+        """Returns the estimated burn rate (in tokens per second), or `None` if there is not enough data."""
+        assert(isinstance(member_name, str))
+        assert(isinstance(token_name, str))
+
+        with self._lock:
+            samples = list(self._samples.get((member_name, token_name), []))
+
+        if len(samples) < MIN_SAMPLES or samples[-1][0] <= samples[0][0]:
+            return None
+
+        consumed = samples[0][1] - samples[-1][1]
+        return max(consumed, 0.0) / (samples[-1][0] - samples[0][0])
+
+    def top_up(self, member_name: str, member_token: MemberToken, balance: Wad) -> Optional[Wad]:
+        """Returns the amount the member should be topped up with now, or `None` if it is not needed yet."""
+        assert(isinstance(member_name, str))
+        assert(isinstance(member_token, MemberToken))
+        assert(isinstance(balance, Wad))
+
+        rate = self.burn_rate(member_name, member_token.token_name)
+        if rate is None or rate == 0:
+            return None
+
+        if float(balance - member_token.min_amount) / rate > self.lead_time:
+            return None
+
+        target = max(member_token.min_amount + Wad.from_number(rate * self.horizon), member_token.avg_amount)
+        if member_token.max_amount is not None:
+            target = min(target, member_token.max_amount)
+
+        self.logger.info(f"Member '{member_name}' consumes {rate * 3600:.6f} {member_token.token_name} per hour"
+                         f" and is projected to fall below minimum within {self.lead_time:.0f}s")
+        return target - balance if target > balance else None
+
+    def _observe(self, key: tuple, timestamp: float, balance: float):
+        with self._lock:
+            samples = self._samples[key]
+            if len(samples) > 0 and timestamp <= samples[-1][0]:
+                return
+
+            samples.append((timestamp, balance))
+            while samples[0][0] < timestamp - self.window:
+                samples.popleft()
@@ -0,0 +1,99 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from typing import Optional
+
+from inventory_keeper.reloadable_config import ReloadableConfig
+from pymaker.gas import GasPrice, DefaultGasPrice, FixedGasPrice, IncreasingGasPrice
+
+
+class GasPriceFile(GasPrice):
+    """Gas price strategy driven by a JSON configuration file.
+
+    The file may contain `gasPrice`, `gasPriceIncrease`, `gasPriceIncreaseEvery` and `gasPriceMax`
+    properties, with the same meaning as the corresponding command-line arguments. The file is read
+    again only if it has changed, and the strategy built from it is reused until that happens.
+
+    Attributes:
+        filename: Filename of the gas price configuration file.
+    """
+
+    logger = logging.getLogger('gas-price-file')
+
+    def __init__(self, filename: str):
+        assert(isinstance(filename, str))
+
+        self.reloadable_config = ReloadableConfig(filename)
+        self._config = None
+        self._strategy = None
+        self._lock = threading.Lock()
+
+    def get_gas_price(self, time_elapsed: int) -> Optional[int]:
+        assert(isinstance(time_elapsed, int))
+
+        try:
+            return self._get_strategy().get_gas_price(time_elapsed)
+        except Exception as e:
+            self.logger.warning(f"Gas price file invalid, using default gas price: {e}")
+            return None
+
+    def _get_strategy(self) -> GasPrice:
+        # transfers are sent from a number of threads, but the config reader is not thread-safe
+        with self._lock:
+            config = self.reloadable_config.get_config()
+            if config is not self._config:
+                self._strategy = self._create_strategy(config)
+                self._config = config
+
+            return self._strategy
+
+    @staticmethod
+    def _create_strategy(config: dict) -> GasPrice:
+        gas_price = config.get('gasPrice', None)
+        gas_price_increase = config.get('gasPriceIncrease', None)
+        gas_price_increase_every = config.get('gasPriceIncreaseEvery', 120)
+        gas_price_max = config.get('gasPriceMax', None)
+
+        if gas_price is not None:
+            if gas_price_increase and gas_price_increase_every:
+                return IncreasingGasPrice(initial_price=gas_price,
+                                          increase_by=gas_price_increase,
+                                          every_secs=gas_price_increase_every,
+                                          max_price=gas_price_max)
+            else:
+                return FixedGasPrice(gas_price)
+        else:
+            return DefaultGasPrice()
+
+
+class GasPriceFactory:
+    @staticmethod
+    def create_gas_price(arguments) -> GasPrice:
+        if arguments.gas_price_file:
+            return GasPriceFile(arguments.gas_price_file)
+        elif arguments.gas_price:
+            if arguments.gas_price_increase is not None:
+                return IncreasingGasPrice(initial_price=arguments.gas_price,
+                                          increase_by=arguments.gas_price_increase,
+                                          every_secs=arguments.gas_price_increase_every,
+                                          max_price=arguments.gas_price_max)
+            else:
+                return FixedGasPrice(arguments.gas_price)
+        else:
+            return DefaultGasPrice()
@@ -0,0 +1,247 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import Optional
+
+from inventory_keeper.files import write_atomically
+
+SERIES_FILE = 'series.json'
+SAMPLES_FILE = 'samples.dat'
+
+# timestamp, block number, series id, balance
+RECORD = struct.Struct('<dIId')
+
+# number of records unpacked at once while scanning the samples file
+CHUNK_RECORDS = 65536
+
+
+class Sample:
+    __slots__ = ('timestamp', 'block_number', 'series_id', 'balance')
+
+    def __init__(self, timestamp: float, block_number: int, series_id: int, balance: float):
+        self.timestamp = timestamp
+        self.block_number = block_number
+        self.series_id = series_id
+        self.balance = balance
+
+    def __repr__(self):
+        return f"Sample(timestamp={self.timestamp}, block_number={self.block_number}," \
+               f" series_id={self.series_id}, balance={self.balance})"
+
+
+class HistoryWriter:
+    """Appends balances from inventory snapshots to the balance history.
+
+    The history is kept in a directory with two files. `series.json` lists the (account, token)
+    pairs which have ever been recorded, the position of each pair in that list being its series id.
+    `samples.dat` is an append-only file of fixed-width records (`RECORD`), each of them holding
+    a single balance together with its timestamp, block number and series id. Records are appended
+    in the order of their timestamps, so the file can be searched by time without an index.
+
+    Balances are stored as floats, which is precise enough for statistics, but not for accounting.
+    Balances which could not be read are not recorded.
+
+    Attributes:
+        directory: Directory the balance history is kept in.
+    """
+
+    logger = logging.getLogger('history-writer')
+
+    def __init__(self, directory: str):
+        assert(isinstance(directory, str))
+
+        self.directory = directory
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._series = load_series(self.directory)
+        self._series_ids = {tuple(series): series_id for series_id, series in enumerate(self._series)}
+        self._last_timestamp = self._truncate_partial_record()
+
+    def record(self, snapshot):
+        """Appends balances from an `InventorySnapshot`.
+
+        The snapshot is not type-checked, so this module can be imported by the offline tools
+        without `pymaker` and `web3` installed.
+        """
+        config = snapshot.config
+        balances = [(config.base_name, token_name, balance) for token_name, balance in snapshot.base_balances.items()]
+        for member, member_balances in zip(config.members, snapshot.members_balances):
+            for member_token, fetch_result in zip(member.tokens, member_balances):
+                if fetch_result.error is None:
+                    balances.append((member.name, member_token.token_name, fetch_result.balance))
+
+        with self._lock:
+            series_count = len(self._series)
+            timestamp = max(snapshot.timestamp, self._last_timestamp)
+            data = b''.join(RECORD.pack(timestamp, snapshot.block_number, self._series_id(account, token_name),
+                                        float(balance))
+                            for account, token_name, balance in balances)
+
+            # new series are saved first, so the samples file never refers to unknown series
+            if len(self._series) > series_count:
+                write_atomically(os.path.join(self.directory, SERIES_FILE), json.dumps(self._series, indent=2))
+
+            with open(os.path.join(self.directory, SAMPLES_FILE), 'ab') as file:
+                file.write(data)
+
+            self._last_timestamp = timestamp
+
+        self.logger.debug(f"Recorded {len(balances)} balances from block #{snapshot.block_number}")
+
+    def _series_id(self, account: str, token_name: str) -> int:
+        key = (account, token_name)
+        if key not in self._series_ids:
+            self._series_ids[key] = len(self._series)
+            self._series.append([account, token_name])
+
+        return self._series_ids[key]
+
+    def _truncate_partial_record(self) -> float:
+        # a record can be left incomplete if the keeper gets killed while writing it
+        filename = os.path.join(self.directory, SAMPLES_FILE)
+        if not os.path.exists(filename):
+            return 0.0
+
+        size = os.path.getsize(filename)
+        if size % RECORD.size != 0:
+            self.logger.warning(f"Removing an incomplete record from the end of '{filename}'")
+            with open(filename, 'r+b') as file:
+                file.truncate(size - size % RECORD.size)
+
+        if size < RECORD.size:
+            return 0.0
+
+        with open(filename, 'rb') as file:
+            file.seek((size // RECORD.size - 1) * RECORD.size)
+            return RECORD.unpack(file.read(RECORD.size))[0]
+
+
+class HistoryReader:
+    """Reads the balance history written by `HistoryWriter`.
+
+    The samples file is memory-mapped and scanned in chunks, so queries over any number
+    of samples run in constant memory. Time ranges are found with a binary search.
+
+    Attributes:
+        directory: Directory the balance history is kept in.
+    """
+    def __init__(self, directory: str):
+        assert(isinstance(directory, str))
+
+        self.directory = directory
+        self.series = [tuple(series) for series in load_series(directory)]
+
+        filename = os.path.join(directory, SAMPLES_FILE)
+        self._count = os.path.getsize(filename) // RECORD.size if os.path.exists(filename) else 0
+        self._file = None
+        self._mmap = None
+        if self._count > 0:
+            self._file = open(filename, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), self._count * RECORD.size, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def series_ids(self, accounts: Optional[set] = None, tokens: Optional[set] = None) -> set:
+        """Returns ids of series matching the accounts and tokens (all of them if `None`)."""
+        return {series_id for series_id, (account, token_name) in enumerate(self.series)
+                if (accounts is None or account in accounts) and (tokens is None or token_name in tokens)}
+
+    def samples(self, series_ids: set, start: Optional[float] = None, end: Optional[float] = None):
+        """Yields `Sample`s of the given series with timestamps in the `[start, end)` range, oldest first."""
+        assert(isinstance(series_ids, set))
+
+        first = self._index(start) if start is not None else 0
+        last = self._index(end) if end is not None else self._count
+
+        for chunk_start in range(first, last, CHUNK_RECORDS):
+            chunk_end = min(chunk_start + CHUNK_RECORDS, last)
+            view = memoryview(self._mmap)[chunk_start * RECORD.size:chunk_end * RECORD.size]
+            try:
+                for timestamp, block_number, series_id, balance in RECORD.iter_unpack(view):
+                    if series_id in series_ids:
+                        yield Sample(timestamp, block_number, series_id, balance)
+            finally:
+                view.release()
+
+    def _index(self, timestamp: float) -> int:
+        # index of the first record with a timestamp not lower than `timestamp`
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if RECORD.unpack_from(self._mmap, middle * RECORD.size)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+
+class SeriesStats:
+    """Aggregates of samples of a single series."""
+    def __init__(self):
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.first = None
+        self.last = None
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def add(self, sample: Sample):
+        self.count += 1
+        self.total += sample.balance
+        self.minimum = sample.balance if self.minimum is None else min(self.minimum, sample.balance)
+        self.maximum = sample.balance if self.maximum is None else max(self.maximum, sample.balance)
+        if self.first is None:
+            self.first = sample.balance
+            self.first_timestamp = sample.timestamp
+
+        self.last = sample.balance
+        self.last_timestamp = sample.timestamp
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count > 0 else None
+
+
+def load_series(directory: str) -> list:
+    filename = os.path.join(directory, SERIES_FILE)
+    if not os.path.exists(filename):
+        return []
+
+    with open(filename) as file:
+        return json.load(file)
@@ -0,0 +1,139 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import collections
+import csv
+import datetime
+import sys
+
+import pytz
+from texttable import Texttable
+
+from inventory_keeper.history import HistoryReader, SeriesStats
+
+TIME_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S']
+
+
+def parse_time(value: str) -> float:
+    """Parses either a Unix timestamp or a UTC date and time in one of `TIME_FORMATS`."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format).replace(tzinfo=pytz.UTC).timestamp()
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError(f"Invalid time: '{value}'")
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, tz=pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class HistoryQuery:
+    """Queries the balance history recorded by the keeper with `--history-dir`."""
+
+    def __init__(self, args: list):
+        parser = argparse.ArgumentParser(prog='inventory-history')
+
+        parser.add_argument("command", type=str, choices=['series', 'samples', 'stats'],
+                            help="`series' lists recorded accounts and tokens, `samples' prints individual"
+                                 " balances as CSV, `stats' prints aggregates of balances")
+
+        parser.add_argument("--history-dir", type=str, required=True,
+                            help="Directory the balance history has been recorded to")
+
+        parser.add_argument("--account", type=str, action='append',
+                            help="Name of the member or of the base account to query (can be repeated, default: all)")
+
+        parser.add_argument("--token", type=str, action='append',
+                            help="Name of the token to query (can be repeated, default: all)")
+
+        parser.add_argument("--from", dest='start', type=parse_time,
+                            help="Start of the queried period, as a Unix timestamp or a UTC date and time")
+
+        parser.add_argument("--to", dest='end', type=parse_time,
+                            help="End of the queried period (exclusive), as a Unix timestamp or a UTC date and time")
+
+        parser.add_argument("--interval", type=float,
+                            help="If specified, `stats' are calculated separately for each interval"
+                                 " of that many seconds")
+
+        self.arguments = parser.parse_args(args)
+
+    def main(self):
+        with HistoryReader(self.arguments.history_dir) as reader:
+            series_ids = reader.series_ids(accounts=set(self.arguments.account) if self.arguments.account else None,
+                                           tokens=set(self.arguments.token) if self.arguments.token else None)
+
+            if self.arguments.command == 'series':
+                self.print_series(reader, series_ids)
+            elif self.arguments.command == 'samples':
+                self.print_samples(reader, series_ids)
+            else:
+                self.print_stats(reader, series_ids)
+
+    def print_series(self, reader: HistoryReader, series_ids: set):
+        table = Texttable(max_width=250)
+        table.set_deco(Texttable.HEADER)
+        table.add_rows([["Id", "Account", "Token"]] +
+                       [[series_id, reader.series[series_id][0], reader.series[series_id][1]]
+                        for series_id in sorted(series_ids)])
+        print(table.draw())
+
+    def print_samples(self, reader: HistoryReader, series_ids: set):
+        # samples get streamed, as there can be millions of them
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(['time', 'block', 'account', 'token', 'balance'])
+        for sample in reader.samples(series_ids, self.arguments.start, self.arguments.end):
+            account, token_name = reader.series[sample.series_id]
+            writer.writerow([format_time(sample.timestamp), sample.block_number, account, token_name,
+                             repr(sample.balance)])
+
+    def print_stats(self, reader: HistoryReader, series_ids: set):
+        interval = self.arguments.interval
+        stats = collections.OrderedDict()
+        for sample in reader.samples(series_ids, self.arguments.start, self.arguments.end):
+            period = int(sample.timestamp // interval * interval) if interval else None
+            key = (period, sample.series_id)
+            if key not in stats:
+                stats[key] = SeriesStats()
+
+            stats[key].add(sample)
+
+        table = Texttable(max_width=250)
+        table.set_deco(Texttable.HEADER)
+        table.set_cols_dtype(['t', 't', 't', 'i', 'f', 'f', 'f', 'f', 'f'])
+        table.set_cols_align(['l', 'l', 'l', 'r', 'r', 'r', 'r', 'r', 'r'])
+        table.add_rows([["Period", "Account", "Token", "Samples", "Min", "Mean", "Max", "First", "Last"]] +
+                       [[format_time(period) if period is not None
+                         else f"{format_time(series_stats.first_timestamp)} - {format_time(series_stats.last_timestamp)}",
+                         reader.series[series_id][0], reader.series[series_id][1], series_stats.count,
+                         series_stats.minimum, series_stats.mean, series_stats.maximum,
+                         series_stats.first, series_stats.last]
+                        for (period, series_id), series_stats in sorted(stats.items(),
+                                                                        key=lambda item: (item[0][1], item[0][0] or 0))])
+        print(table.draw())
+
+
+if __name__ == '__main__':
+    HistoryQuery(sys.argv[1:]).main()
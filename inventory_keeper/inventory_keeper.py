@@ -16,18 +16,43 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import concurrent.futures
 import datetime
 import logging
+import os
 import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
 
 import pytz
 from texttable import Texttable
-from web3 import Web3, HTTPProvider
-
-from inventory_keeper.config import Config, OasisCache
+from web3 import Web3
+
+from inventory_keeper.approval import ApprovalCache
+from inventory_keeper.batch import AllowanceQuery, BalanceReader
+from inventory_keeper.breaker import CircuitBreakers, CircuitOpenError
+from inventory_keeper.config import Config, OasisCache, ExchangeCache, Member, MemberToken
+from inventory_keeper.dump import DUMP_FORMATS, inventory_records, format_age, format_json, format_csv, \
+    format_ndjson
+from inventory_keeper.fetcher import BalanceFetcher
+from inventory_keeper.files import write_atomically
+from inventory_keeper.forecast import BurnRateForecaster
+from inventory_keeper.gas import GasPriceFactory
+from inventory_keeper.history import HistoryReader, HistoryWriter
+from inventory_keeper.metrics import start_metrics_server, cycle
+from inventory_keeper.planner import PlannedTransfer, Requirement, TransferPlanner
+from inventory_keeper.provider import PooledHTTPProvider, endpoint_uris
+from inventory_keeper.ratelimit import ExchangeScheduler, RateLimits
 from inventory_keeper.reloadable_config import ReloadableConfig
+from inventory_keeper.shard import ShardCoordinator, ShardRing
+from inventory_keeper.snapshot import InventorySnapshot
+from inventory_keeper.thresholds import threshold_deposit, threshold_withdrawal
+from inventory_keeper.transfer import PendingTransfer, TransferPipeline
 from inventory_keeper.type import BaseAccount
-from pymaker.approval import directly
+from inventory_keeper.watcher import BlockWatcher, ALL_TOKENS
+from pymaker import Address
 from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
 from pymaker.token import ERC20Token
@@ -42,14 +67,22 @@ class InventoryKeeper:
         parser = argparse.ArgumentParser(prog='inventory-keeper')
 
         parser.add_argument("--rpc-host", type=str, default="localhost",
-                            help="JSON-RPC host (default: `localhost')")
+                            help="JSON-RPC host, or comma-separated list of JSON-RPC hosts (`host', `host:port'"
+                                 " or full URLs) to spread requests across (default: `localhost')")
 
         parser.add_argument("--rpc-port", type=int, default=8545,
-                            help="JSON-RPC port (default: `8545')")
+                            help="JSON-RPC port used for hosts without an explicit port (default: `8545')")
 
         parser.add_argument("--config", type=str, required=True,
                             help="Inventory configuration file")
 
+        parser.add_argument("--multicall-address", type=str,
+                            help="Address of the Multicall contract used for reading balances"
+                                 " (if not specified, balances will be read using JSON-RPC batch requests)")
+
+        parser.add_argument("--approval-cache-file", type=str,
+                            help="File the keeper will remember already verified approvals in")
+
         parser.add_argument("--gas-price", type=int, default=0,
                             help="Gas price (in Wei)")
 
@@ -72,62 +105,326 @@ class InventoryKeeper:
         parser.add_argument("--manage-inventory-frequency", type=int, default=60,
                             help="Frequency of actively managing the inventory (in seconds, default: 60)")
 
+        parser.add_argument("--manage-inventory-on-block", dest='manage_inventory_on_block', action='store_true',
+                            help="If specified, on-chain members will be rebalanced on each new block, but only if"
+                                 " their balances have changed. Other members will still be rebalanced every"
+                                 " `--manage-inventory-frequency` seconds")
+
+        parser.add_argument("--forecast-top-ups", dest='forecast_top_ups', action='store_true',
+                            help="If specified, members will be topped up ahead of falling below `minAmount`,"
+                                 " based on how fast they have been consuming their tokens")
+
+        parser.add_argument("--forecast-window", type=float, default=21600.0,
+                            help="Period the consumption rate is estimated over (in seconds, default: 21600)")
+
+        parser.add_argument("--forecast-horizon", type=float, default=3600.0,
+                            help="Period a forecast top-up should last for (in seconds, default: 3600)")
+
+        parser.add_argument("--forecast-lead-time", type=float, default=300.0,
+                            help="Time before a member is projected to fall below `minAmount` it gets topped up"
+                                 " (in seconds, default: 300)")
+
         parser.add_argument("--inventory-dump-file", type=str,
                             help="File the keeper will periodically write the inventory dump to")
 
         parser.add_argument("--inventory-dump-frequency", type=int, default=30,
                             help="Frequency of writing the inventory dump file (in seconds, default: 30)")
 
+        parser.add_argument("--inventory-dump-format", type=str, choices=DUMP_FORMATS, default='text',
+                            help="Format of the inventory dump file (default: `text')")
+
+        parser.add_argument("--inventory-snapshot-ttl", type=float, default=15,
+                            help="Maximum age of balances read in a previous cycle which can be reused by"
+                                 " the inventory dump or rebalancing (in seconds, default: 15)")
+
+        parser.add_argument("--history-dir", type=str,
+                            help="Directory to record balances read in each cycle to, for `inventory-history'"
+                                 " to query them")
+
+        parser.add_argument("--balance-fetch-threads", type=int, default=1,
+                            help="Number of member balances being read at the same time (default: 1)")
+
+        parser.add_argument("--balance-fetch-timeout", type=float, default=30,
+                            help="Time limit for reading balances of a member if more than one balance"
+                                 " fetch thread is used (in seconds, default: 30)")
+
+        parser.add_argument("--circuit-breaker-threshold", type=int, default=3,
+                            help="Number of consecutive failures of a member or an exchange account after which"
+                                 " it stops being called (default: 3)")
+
+        parser.add_argument("--circuit-breaker-backoff", type=float, default=30.0,
+                            help="Time after which a failing member or exchange account gets called again"
+                                 " (in seconds, default: 30). Doubles each time it is still failing")
+
+        parser.add_argument("--circuit-breaker-max-backoff", type=float, default=600.0,
+                            help="Maximum time between calls to a failing member or exchange account"
+                                 " (in seconds, default: 600)")
+
+        parser.add_argument("--exchange-rate-limit", type=str, default="2/5",
+                            help="Maximum number of exchange API calls per second for each account, as comma-separated"
+                                 " `RATE[/BURST]' or `TYPE=RATE[/BURST]' entries (default: `2/5')")
+
+        parser.add_argument("--shards", type=str,
+                            help="Comma-separated names of all keeper processes sharing the config. If specified,"
+                                 " each of them manages only the members assigned to it by consistent hashing")
+
+        parser.add_argument("--shard", type=str,
+                            help="Name of this keeper process, one of `--shards'")
+
+        parser.add_argument("--shard-state-file", type=str,
+                            help="File shared by all keeper processes to coordinate nonces and deposits"
+                                 " from the base account")
+
+        parser.add_argument("--metrics-port", type=int,
+                            help="Port to serve Prometheus metrics on (requires the `prometheus_client` package)")
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
         self.arguments = parser.parse_args(args)
 
-        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}"))
-        self.oasis_cache = OasisCache(self.web3)
+        if self.arguments.shards:
+            if self.arguments.shard not in self.arguments.shards.split(','):
+                parser.error("--shard has to be one of --shards")
+            if self.arguments.shard_state_file is None:
+                parser.error("--shard-state-file is required if --shards is specified")
+
+        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(PooledHTTPProvider(endpoint_uris(self.arguments.rpc_host, self.arguments.rpc_port)))
         self.reloadable_config = ReloadableConfig(self.arguments.config)
+        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.approval_cache = ApprovalCache(self.arguments.approval_cache_file)
+        self.balance_reader = BalanceReader(web3=self.web3,
+                                            multicall_address=Address(self.arguments.multicall_address)
+                                            if self.arguments.multicall_address else None)
+        self.oasis_cache = OasisCache(self.balance_reader.pinned_web3)
+        self.breakers = CircuitBreakers(threshold=self.arguments.circuit_breaker_threshold,
+                                        backoff=self.arguments.circuit_breaker_backoff,
+                                        max_backoff=self.arguments.circuit_breaker_max_backoff)
+        self.exchange_cache = ExchangeCache(ExchangeScheduler(RateLimits(self.arguments.exchange_rate_limit),
+                                                              self.breakers))
+        self.shard_ring = ShardRing(self.arguments.shards.split(',')) if self.arguments.shards else None
+        self.shard_coordinator = ShardCoordinator(self.arguments.shard_state_file, self.arguments.shard) \
+            if self.arguments.shards else None
+        self.forecaster = BurnRateForecaster(window=self.arguments.forecast_window,
+                                             horizon=self.arguments.forecast_horizon,
+                                             lead_time=self.arguments.forecast_lead_time) \
+            if self.arguments.forecast_top_ups else None
+        self.transfer_pipeline = TransferPipeline(self.web3, coordinator=self.shard_coordinator,
+                                                  on_confirmed=self.transfer_confirmed if self.forecaster else None)
+        self.block_watcher = BlockWatcher(self.web3)
+        self.transfer_planner = TransferPlanner()
+        self.history_writer = HistoryWriter(self.arguments.history_dir) if self.arguments.history_dir else None
+        if self.forecaster is not None and self.history_writer is not None:
+            with HistoryReader(self.arguments.history_dir) as reader:
+                self.forecaster.load(reader, time.time())
+        self.balance_fetcher = BalanceFetcher(web3=self.web3,
+                                              oasis_cache=self.oasis_cache,
+                                              exchange_cache=self.exchange_cache,
+                                              balance_reader=self.balance_reader,
+                                              threads=self.arguments.balance_fetch_threads,
+                                              timeout=self.arguments.balance_fetch_timeout,
+                                              breakers=self.breakers)
         self._first_inventory_dump = True
+        self._last_inventory_dump = None
         self._last_config_dict = None
         self._last_config = None
+        self._last_snapshot = None
+        self._last_watched_config = None
+        self._snapshot_lock = threading.Lock()
 
         logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s',
                             level=(logging.DEBUG if self.arguments.debug else logging.INFO))
 
     def main(self):
+        if self.arguments.metrics_port:
+            start_metrics_server(self.arguments.metrics_port)
+
+        manage_inventory_frequency = self.arguments.manage_inventory_frequency
+        inventory_dump_frequency = self.arguments.inventory_dump_frequency
+
         with Lifecycle(self.web3) as lifecycle:
             lifecycle.on_startup(self.approve)
             if self.arguments.manage_inventory:
-                lifecycle.every(self.arguments.manage_inventory_frequency, self.rebalance_members)
+                if self.arguments.manage_inventory_on_block:
+                    lifecycle.on_block(self.measured('rebalance-on-block', float('inf'),
+                                                     self.rebalance_changed_members))
+                    lifecycle.every(manage_inventory_frequency, self.measured('rebalance-polled', manage_inventory_frequency,
+                                                                              self.rebalance_polled_members))
+                else:
+                    lifecycle.every(manage_inventory_frequency, self.measured('rebalance', manage_inventory_frequency,
+                                                                              self.rebalance_members))
             if self.arguments.inventory_dump_file:
-                lifecycle.every(self.arguments.inventory_dump_frequency, self.dump_inventory)
+                lifecycle.every(inventory_dump_frequency, self.measured('dump', inventory_dump_frequency,
+                                                                        self.dump_inventory))
+            lifecycle.on_shutdown(self.transfer_pipeline.wait)
+
+    @staticmethod
+    def measured(name: str, frequency: float, callback):
+        def measured_callback():
+            with cycle(name, frequency):
+                callback()
+
+        return measured_callback
 
     def get_config(self):
         current_config = self.reloadable_config.get_config()
-        if current_config != self._last_config_dict:
-            self._last_config = Config(current_config)
+        if current_config is not self._last_config_dict:
+            config = Config(self.shard_config(current_config))
+            if self._last_config is not None:
+                reused = config.reuse_implementations(self._last_config)
+                self.logger.info(f"Kept implementations of {reused} out of {len(config.members)} members"
+                                 f" after configuration reload")
+
+                # exchange clients no longer used by any member (or using old credentials) get dropped
+                evicted = self.exchange_cache.retain([self.member_implementation(member) for member in config.members])
+                if evicted > 0:
+                    self.logger.info(f"Dropped {evicted} exchange clients no longer used by any member")
+
+            self._last_config = config
             self._last_config_dict = current_config
 
         return self._last_config
 
+    def shard_config(self, config: dict) -> dict:
+        """Leaves only the members assigned to this shard in the config, if sharding is enabled."""
+        if self.shard_ring is None:
+            return config
+
+        members = [member for member in config['members'] if self.shard_ring.shard(member['name']) == self.arguments.shard]
+        self.logger.info(f"Shard '{self.arguments.shard}' manages {len(members)} out of {len(config['members'])} members")
+
+        return dict(config, members=members)
+
+    def base_account(self, config: Config) -> BaseAccount:
+        return BaseAccount(web3=self.web3,
+                           address=config.base_address,
+                           balance_reader=self.balance_reader,
+                           min_eth_balance=config.base_min_eth_balance,
+                           transfer_pipeline=self.transfer_pipeline)
+
+    def member_implementation(self, member: Member):
+        return member.implementation(self.web3, self.oasis_cache, self.exchange_cache, self.balance_reader)
+
     def approve(self):
+        """Makes sure the base account is allowed to withdraw tokens from all members.
+
+        All allowances are read at once and only the missing approvals get sent, concurrently
+        for different members. Allowances which have been verified are remembered in the approval
+        cache, so they are not read again after a restart.
+        """
         config = self.get_config()
-        base = BaseAccount(web3=self.web3, address=config.base_address, min_eth_balance=config.base_min_eth_balance)
+        base = self.base_account(config)
 
+        queries = {}
         for member in config.members:
-            member_implementation = member.implementation(self.web3, self.oasis_cache)
+            member_implementation = self.member_implementation(member)
             if not hasattr(member_implementation, 'address'):
                 continue
 
             for member_token in member.tokens:
-                token = next(filter(lambda token: token.name == member_token.token_name, config.tokens))
-                if token.name == "ETH":
+                token = member_token.token
+                if token.name == "ETH" or token.address is None:
+                    continue
+
+                query = AllowanceQuery(token.address, member_implementation.address, base.address)
+                if query not in self.approval_cache:
+                    queries[query] = (member.name, token.name)
+
+        if len(queries) == 0:
+            return
+
+        missing = {}
+        for query, allowance in zip(queries.keys(), self.balance_reader.allowances(list(queries.keys()))):
+            if allowance < Wad(2**128-1):
+                missing.setdefault(query.owner.address, []).append(query)
+            else:
+                self.approval_cache.add(query)
+
+        self.logger.info(f"Verified {len(queries)} allowances, {sum(map(len, missing.values()))} approvals missing")
+
+        # approvals of a single member are sent one after another, so they do not compete for the same nonce
+        def approve_member(member_queries: list):
+            for query in member_queries:
+                member_name, token_name = queries[query]
+                self.logger.info(f"Approving {config.base_name} to access {token_name} of '{member_name}'")
+
+                try:
+                    receipt = ERC20Token(web3=self.web3, address=query.token) \
+                        .approve(query.spender) \
+                        .transact(from_address=query.owner, gas_price=self.gas_price)
+                except Exception as e:
+                    self.logger.warning(f"Failed to approve {token_name} of '{member_name}': {e}")
                     continue
 
-                self.web3.eth.defaultAccount = member_implementation.address.address
-                erc20token = ERC20Token(web3=self.web3, address=token.address)
-                directly()(erc20token, base.address, config.base_name)
+                if receipt is not None and receipt.successful:
+                    self.approval_cache.add(query)
+                else:
+                    self.logger.warning(f"Failed to approve {token_name} of '{member_name}'")
 
-        self.web3.eth.defaultAccount = None
+        if len(missing) > 0:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(missing), 16)) as executor:
+                list(executor.map(approve_member, missing.values()))
+
+        self.approval_cache.save()
+
+    def member_balance_queries(self, config: Config) -> list:
+        result = []
+        for member in config.members:
+            member_implementation = self.member_implementation(member)
+            for member_token in member.tokens:
+                result += member_implementation.balance_queries(member_token.token.address)
+
+        return result
+
+    def inventory_snapshot(self) -> InventorySnapshot:
+        """Returns balances of the base account and all members.
+
+        Balances are read again only if the previous snapshot is older than `--inventory-snapshot-ttl`,
+        has been taken for a different config, or has been invalidated by a transfer.
+        """
+        with self._snapshot_lock:
+            config = self.get_config()
+            if self._last_snapshot is None \
+                    or self._last_snapshot.config is not config \
+                    or self._last_snapshot.age() > self.arguments.inventory_snapshot_ttl:
+                self._last_snapshot = self.take_inventory_snapshot(config)
+                self.record_history(self._last_snapshot)
+            else:
+                self.logger.debug(f"Reusing inventory snapshot taken at block #{self._last_snapshot.block_number}")
+
+            return self._last_snapshot
+
+    def invalidate_inventory_snapshot(self):
+        with self._snapshot_lock:
+            self._last_snapshot = None
+
+    def take_inventory_snapshot(self, config: Config) -> InventorySnapshot:
+        base = self.base_account(config)
+        block_number = self.web3.eth.blockNumber
+        timestamp = time.time()
+
+        # exchange balances are fetched at most once per snapshot
+        self.exchange_cache.invalidate_balances()
+
+        base_queries = [query for token in config.tokens for query in base.balance_queries(token.address)]
+        with self.balance_reader.prefetched(base_queries + self.member_balance_queries(config), block_number):
+            base_balances = {token.name: base.balance(token.name, token.address) for token in config.tokens}
+            members_balances = self.balance_fetcher.fetch(config)
+
+        return InventorySnapshot(config=config,
+                                 block_number=block_number,
+                                 timestamp=timestamp,
+                                 base_balances=base_balances,
+                                 members_balances=members_balances)
+
+    def record_history(self, snapshot: InventorySnapshot):
+        if self.history_writer is None:
+            return
+
+        try:
+            self.history_writer.record(snapshot)
+        except Exception as e:
+            self.logger.warning(f"Failed to record balances to '{self.arguments.history_dir}': {e}")
 
     def add_first_column(self, table, name: str):
         result = []
@@ -172,51 +469,74 @@ class InventoryKeeper:
         table.add_rows([["Total balance"]] + table_data)
         return table.draw()
 
-    def print_inventory(self):
-        config = self.get_config()
-        base = BaseAccount(web3=self.web3, address=config.base_address, min_eth_balance=config.base_min_eth_balance)
+    def print_inventory(self, snapshot: InventorySnapshot = None, footer: bool = True):
+        if snapshot is None:
+            snapshot = self.inventory_snapshot()
+
+        config = snapshot.config
 
         longest_token_name = max(map(lambda token: len(token.name), config.tokens))
 
         def format_amount(amount: Wad, token_name: str):
             return str(amount) + " " + token_name.ljust(longest_token_name, ".")
 
-        base_data = map(lambda token: [format_amount(base.balance(token.name, token.address), token.name)], config.tokens)
+        base_data = map(lambda token: [format_amount(snapshot.base_balances[token.name], token.name)], config.tokens)
         base_data = self.add_first_column(base_data, config.base_name)
 
-        total_balances = {}
-        for token in config.tokens:
-            total_balances[token.name] = base.balance(token.name, token.address)
-
         members_data = []
-        for member in config.members:
+        for member, member_balances in zip(config.members, snapshot.members_balances):
             table = []
-            member_implementation = member.implementation(self.web3, self.oasis_cache)
-            for member_token in member.tokens:
-                token = next(filter(lambda token: token.name == member_token.token_name, config.tokens))
-                try:
-                    balance = member_implementation.balance(token.name, token.address)
-                except:
-                    balance = None
+            for member_token, fetch_result in zip(member.tokens, member_balances):
+                token = member_token.token
+                balance = fetch_result.balance
+
+                if fetch_result.stale:
+                    formatted_balance = format_amount(balance, token.name) + \
+                                        f"\n(stale, {format_age(snapshot.timestamp - fetch_result.timestamp)} old)"
+                else:
+                    formatted_balance = format_amount(balance, token.name) if balance is not None else '?'
 
                 table.append([
-                    format_amount(balance, token.name) if balance is not None else '?',
+                    formatted_balance,
                     format_amount(member_token.min_amount, token.name) if member_token.min_amount else "",
                     format_amount(member_token.max_amount, token.name) if member_token.max_amount else ""
                 ])
 
-                if balance is not None:
-                    total_balances[token.name] = total_balances[token.name] + balance
-
             members_data = members_data + self.add_first_column(table, member.name)
             members_data.append(["","","",""])
 
-        totals_data = list(map(lambda token: [format_amount(total_balances[token.name] if token.name in total_balances else Wad(0), token.name)], config.tokens))
+        total_balances = snapshot.total_balances()
+        totals_data = list(map(lambda token: [format_amount(total_balances[token.name], token.name)], config.tokens))
+
+        result = self.print_base_table(base_data) + "\n\n" + \
+                 self.print_members_table(members_data) + "\n\n" + \
+                 self.print_totals_table(totals_data)
 
-        return self.print_base_table(base_data) + "\n\n" + \
-               self.print_members_table(members_data) + "\n\n" + \
-               self.print_totals_table(totals_data) + "\n\n" + \
-               "Generated at: " + datetime.datetime.now(tz=pytz.UTC).strftime('%Y.%m.%d %H:%M:%S %Z')
+        if footer:
+            generated_at = datetime.datetime.fromtimestamp(snapshot.timestamp, tz=pytz.UTC)
+            result += "\n\n" + \
+                      "Generated at: " + generated_at.strftime('%Y.%m.%d %H:%M:%S %Z') + \
+                      " (block #" + str(snapshot.block_number) + ")"
+
+        return result
+
+    def format_inventory(self, snapshot: InventorySnapshot) -> tuple:
+        """Returns the inventory dump in the format chosen with `--inventory-dump-format`.
+
+        Returns:
+            A tuple of the inventory dump and of the same dump without the time and the block number
+            it has been generated at, which can be used to tell if the balances have changed.
+        """
+        if self.arguments.inventory_dump_format == 'json':
+            return format_json(snapshot), format_json(snapshot, metadata=False)
+        elif self.arguments.inventory_dump_format == 'csv':
+            content = format_csv(inventory_records(snapshot))
+            return content, content
+        elif self.arguments.inventory_dump_format == 'ndjson':
+            content = format_ndjson(inventory_records(snapshot))
+            return content, content
+        else:
+            return self.print_inventory(snapshot), self.print_inventory(snapshot, footer=False)
 
     def dump_inventory(self):
         # The first time we write the inventory dump to a file we log a message
@@ -226,63 +546,275 @@ class InventoryKeeper:
             self.logger.info(f"Use 'watch cat {self.arguments.inventory_dump_file}' to monitor that file")
             self._first_inventory_dump = False
 
-        inventory = self.print_inventory()
-        with open(self.arguments.inventory_dump_file, 'w') as file:
-            file.write(inventory)
+        inventory, inventory_without_metadata = self.format_inventory(self.inventory_snapshot())
+
+        # We do not touch the file if balances did not change, so the ones watching it
+        # do not get notified for nothing.
+        if inventory_without_metadata == self._last_inventory_dump \
+                and os.path.exists(self.arguments.inventory_dump_file):
+            self.logger.debug(f"Inventory did not change, not writing '{self.arguments.inventory_dump_file}'")
+            return
+
+        write_atomically(self.arguments.inventory_dump_file, inventory)
+        self._last_inventory_dump = inventory_without_metadata
 
         self.logger.debug(f"Written current inventory dump to '{self.arguments.inventory_dump_file}'")
 
     def rebalance_members(self):
+        snapshot = self.inventory_snapshot()
+        config = snapshot.config
+        base = self.base_account(config)
+
+        requirements = []
+        for member, member_balances in zip(config.members, snapshot.members_balances):
+            member_implementation = self.member_implementation(member)
+            for member_token, fetch_result in zip(member.tokens, member_balances):
+                if fetch_result.error is not None:
+                    self.log_fetch_error(member, fetch_result.error)
+                    continue
+
+                requirements.append(self.member_token_requirement(member, member_implementation, member_token,
+                                                                  fetch_result.balance, snapshot.block_number,
+                                                                  snapshot.timestamp))
+
+        self.rebalance(base, requirements)
+
+    def log_fetch_error(self, member: Member, error: Exception):
+        # members with an open circuit breaker have already been reported when it opened
+        if isinstance(error, CircuitOpenError):
+            self.logger.debug(f"Not rebalancing {member.name}: {error}")
+        else:
+            self.logger.warning(f"Failed to read balance of {member.name}: {error}")
+
+    def rebalance_changed_members(self):
+        """Rebalances members whose balances might have changed in blocks mined since the last call."""
         config = self.get_config()
-        base = BaseAccount(web3=self.web3, address=config.base_address, min_eth_balance=config.base_min_eth_balance)
 
+        watched_members = []
         for member in config.members:
-            member_implementation = member.implementation(self.web3, self.oasis_cache)
-            for member_token in member.tokens:
-                token = next(filter(lambda token: token.name == member_token.token_name, config.tokens))
-                try:
-                    current_balance = member_implementation.balance(token.name, token.address)
-                except Exception as e:
-                    self.logger.warning(f"Failed to read balance of {member.name}: {e}")
-                    continue
-
-                # deposit if balance too low
-                if member_token.min_amount is not None and member_token.avg_amount is not None:
-                    if current_balance < member_token.min_amount:
-                        self.logger.info(f"Member '{member.name}' has {token.name} balance {current_balance}"
-                                         f" {token.name} below minimum ({member_token.min_amount} {token.name}).")
-
-                        try:
-                            result = member_implementation.deposit(base=base,
-                                                                   token_name=token.name,
-                                                                   token_address=token.address,
-                                                                   amount=member_token.avg_amount-current_balance)
-
-                            if result:
-                                self.logger.info(f"Successfully deposited {token.name} to '{member.name}'")
-                            else:
-                                self.logger.warning(f"Failed to deposit {token.name} to '{member.name}'")
-                        except Exception as e:
-                            self.logger.warning(f"Failed to deposit {token.name} to '{member.name}': {e}")
-
-                # withdraw if balance too high
-                if member_token.max_amount is not None and member_token.avg_amount is not None:
-                    if current_balance > member_token.max_amount:
-                        self.logger.info(f"Member '{member.name}' has {token.name} balance {current_balance}"
-                                         f" {token.name} above maximum ({member_token.max_amount} {token.name}).")
-
-                        try:
-                            result = member_implementation.withdraw(base=base,
-                                                                   token_name=token.name,
-                                                                   token_address=token.address,
-                                                                   amount=current_balance-member_token.avg_amount)
-
-                            if result:
-                                self.logger.info(f"Successfully withdrawn excess {token.name} from '{member.name}'")
-                            else:
-                                self.logger.warning(f"Failed to withdraw excess {token.name} from '{member.name}'")
-                        except Exception as e:
-                            self.logger.warning(f"Failed to withdraw excess {token.name} from '{member.name}': {e}")
+            addresses = [address.address.lower() for address in self.member_implementation(member).watched_addresses()]
+            if len(addresses) > 0:
+                watched_members.append((member, addresses))
+
+        block_number, changes = self.block_watcher.changes(addresses={address for member, addresses in watched_members
+                                                                      for address in addresses},
+                                                           token_addresses=[token.address for token in config.tokens
+                                                                            if token.address is not None])
+
+        # on startup, after a config reload, or if some blocks have been skipped, we read all balances
+        if changes is None or config is not self._last_watched_config:
+            affected = [(member, member.tokens) for member, addresses in watched_members]
+        else:
+            affected = []
+            for member, addresses in watched_members:
+                changed_tokens = set()
+                for address in addresses:
+                    changed_tokens.update(changes.get(address, set()))
+
+                # member tokens with transfers in flight are evaluated on each block until they settle
+                member_tokens = [member_token for member_token in member.tokens
+                                 if ALL_TOKENS in changed_tokens
+                                 or (member_token.token.address is not None
+                                     and member_token.token.address.address.lower() in changed_tokens)
+                                 or self.transfer_pipeline.in_flight(member.name, member_token.token.name,
+                                                                     block_number) != Wad(0)]
+                if len(member_tokens) > 0:
+                    affected.append((member, member_tokens))
+
+        self._last_watched_config = config
+        self.rebalance_member_tokens(config, affected, block_number)
+
+    def rebalance_polled_members(self):
+        """Rebalances members whose balances can not be followed by watching new blocks."""
+        config = self.get_config()
+        affected = [(member, member.tokens) for member in config.members
+                    if len(self.member_implementation(member).watched_addresses()) == 0]
+
+        self.exchange_cache.invalidate_balances()
+        self.rebalance_member_tokens(config, affected, self.web3.eth.blockNumber)
+
+    def rebalance_member_tokens(self, config: Config, affected: list, block_number: int):
+        """Reads and rebalances only the given member tokens, as a list of `(member, member_tokens)` tuples."""
+        if len(affected) == 0:
+            return
+
+        base = self.base_account(config)
+
+        queries = [query for token in config.tokens for query in base.balance_queries(token.address)]
+        for member, member_tokens in affected:
+            member_implementation = self.member_implementation(member)
+            for member_token in member_tokens:
+                queries += member_implementation.balance_queries(member_token.token.address)
+
+        requirements = []
+        with self.balance_reader.prefetched(queries, block_number):
+            for member, member_tokens in affected:
+                member_implementation = self.member_implementation(member)
+                fetch_results = self.balance_fetcher.fetch_member(member, member_implementation, member_tokens)
+                for member_token, fetch_result in zip(member_tokens, fetch_results):
+                    if fetch_result.error is not None:
+                        self.log_fetch_error(member, fetch_result.error)
+                        continue
+
+                    requirements.append(self.member_token_requirement(member, member_implementation, member_token,
+                                                                      fetch_result.balance, block_number,
+                                                                      fetch_result.timestamp))
+
+        self.rebalance(base, requirements)
+
+    def member_token_requirement(self, member: Member, member_implementation, member_token: MemberToken,
+                                 balance: Wad, block_number: int, timestamp: float) -> Optional[Requirement]:
+        """Returns the surplus or the deficit of a member token, or `None` if it does not need rebalancing."""
+        token = member_token.token
+
+        # the balance might already include a transfer we have not seen the receipt of,
+        # so we wait for it before sending another one
+        if self.transfer_pipeline.unconfirmed(member.name, token.name):
+            self.logger.debug(f"Waiting for {token.name} transfers of '{member.name}' to get confirmed")
+            return None
+
+        # transfers sent earlier might have not been reflected in the balance yet
+        in_flight = self.transfer_pipeline.in_flight(member.name, token.name, block_number)
+        current_balance = balance + in_flight
+        if in_flight != Wad(0):
+            self.logger.debug(f"Member '{member.name}' has {in_flight} {token.name} in flight")
+
+        # deposit if balance too low, or if it is projected to get too low soon
+        if member_token.min_amount is not None and member_token.avg_amount is not None:
+            deposit_amount = threshold_deposit(current_balance, member_token.min_amount, member_token.avg_amount)
+            if deposit_amount is not None:
+                self.logger.info(f"Member '{member.name}' has {token.name} balance {current_balance}"
+                                 f" {token.name} below minimum ({member_token.min_amount} {token.name}).")
+
+            if self.forecaster is not None:
+                self.forecaster.observe(member.name, token.name, timestamp, current_balance)
+                top_up = self.forecaster.top_up(member.name, member_token, current_balance)
+                if top_up is not None and (deposit_amount is None or top_up > deposit_amount):
+                    deposit_amount = top_up
+
+            if deposit_amount is not None:
+                return Requirement(member, member_implementation, member_token, deposit_amount,
+                                   deficit=True, urgent=current_balance < member_token.min_amount)
+
+        # withdraw if balance too high
+        withdrawal_amount = threshold_withdrawal(current_balance, member_token.max_amount, member_token.avg_amount)
+        if withdrawal_amount is not None:
+            self.logger.info(f"Member '{member.name}' has {token.name} balance {current_balance}"
+                             f" {token.name} above maximum ({member_token.max_amount} {token.name}).")
+
+            return Requirement(member, member_implementation, member_token, withdrawal_amount, deficit=False)
+
+        return None
+
+    def rebalance(self, base: BaseAccount, requirements: list):
+        """Plans and sends all transfers needed to cover the requirements found in a single cycle."""
+        requirements = [requirement for requirement in requirements if requirement is not None]
+        if len(requirements) == 0:
+            return
+
+        # balances are going to change, so the snapshot can not be reused anymore
+        self.invalidate_inventory_snapshot()
+
+        # transfers are sized against balances of the base account read at the latest block, so deposits
+        # confirmed in that block or before are not counted as pending anymore
+        tokens = {requirement.member_token.token.name: requirement.member_token.token
+                  for requirement in requirements if requirement.deficit}
+        base_queries = [query for token in tokens.values() for query in base.balance_queries(token.address)]
+        with self.balance_reader.prefetched(base_queries, self.web3.eth.blockNumber):
+            base_available = {token.name: base.available_balance(token.name, token.address)
+                              for token in tokens.values()}
+
+            for planned_transfer in self.transfer_planner.plan(requirements, base_available):
+                self.send_planned_transfer(base, planned_transfer)
+
+    def transfer_confirmed(self, pending_transfer: PendingTransfer):
+        # transfers sent by the keeper are not consumption, so the forecaster leaves them out
+        if pending_transfer.deposit:
+            self.forecaster.transferred(pending_transfer.member_name, pending_transfer.token_name,
+                                        pending_transfer.amount, incoming=True)
+        else:
+            self.forecaster.transferred(pending_transfer.member_name, pending_transfer.token_name,
+                                        pending_transfer.amount, incoming=False)
+            if pending_transfer.to_member_name is not None:
+                self.forecaster.transferred(pending_transfer.to_member_name, pending_transfer.token_name,
+                                            pending_transfer.amount, incoming=True)
+
+    @contextmanager
+    def deposit_lock(self):
+        if self.shard_coordinator is None:
+            yield
+        else:
+            with self.shard_coordinator.locked():
+                yield
+
+    def send_planned_transfer(self, base: BaseAccount, planned_transfer: PlannedTransfer):
+        source, destination = planned_transfer.source, planned_transfer.destination
+        token = (source or destination).member_token.token
+
+        if source is None:
+            try:
+                # with other shards depositing from the same base account, checking its available balance
+                # and reserving the deposit has to happen atomically
+                with self.deposit_lock():
+                    transfer = destination.implementation.deposit(base=base,
+                                                                  token_name=token.name,
+                                                                  token_address=token.address,
+                                                                  amount=planned_transfer.amount)
+
+                    self.transfer_pipeline.submit(from_address=base.address,
+                                                  member_name=destination.member.name,
+                                                  token_name=token.name,
+                                                  token_address=token.address,
+                                                  deposit=True,
+                                                  transfer=transfer,
+                                                  gas_price=self.gas_price)
+
+                self.logger.info(f"Sent deposit of {transfer.amount} {token.name} to '{destination.member.name}'")
+            except Exception as e:
+                self.logger.warning(f"Failed to deposit {token.name} to '{destination.member.name}': {e}")
+
+        elif destination is None:
+            try:
+                transfer = source.implementation.withdraw(base=base,
+                                                          token_name=token.name,
+                                                          token_address=token.address,
+                                                          amount=planned_transfer.amount)
+
+                self.transfer_pipeline.submit(from_address=base.address,
+                                              member_name=source.member.name,
+                                              token_name=token.name,
+                                              token_address=token.address,
+                                              deposit=False,
+                                              transfer=transfer,
+                                              gas_price=self.gas_price)
+
+                self.logger.info(f"Sent withdrawal of excess {transfer.amount} {token.name}"
+                                 f" from '{source.member.name}'")
+            except Exception as e:
+                self.logger.warning(f"Failed to withdraw excess {token.name} from '{source.member.name}': {e}")
+
+        else:
+            try:
+                transfer = source.implementation.withdraw_to(base=base,
+                                                             destination=destination.implementation.deposit_address(token.address),
+                                                             token_name=token.name,
+                                                             token_address=token.address,
+                                                             amount=planned_transfer.amount)
+
+                self.transfer_pipeline.submit(from_address=base.address,
+                                              member_name=source.member.name,
+                                              token_name=token.name,
+                                              token_address=token.address,
+                                              deposit=False,
+                                              transfer=transfer,
+                                              to_member_name=destination.member.name,
+                                              gas_price=self.gas_price)
+
+                self.logger.info(f"Sent {transfer.amount} {token.name} from '{source.member.name}'"
+                                 f" straight to '{destination.member.name}'")
+            except Exception as e:
+                self.logger.warning(f"Failed to move {token.name} from '{source.member.name}'"
+                                    f" to '{destination.member.name}': {e}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from web3 import Web3
+
+from inventory_keeper.batch import RAW_ETH, BalanceQuery, BalanceReader
+from inventory_keeper.config import Member, OasisCache, ExchangeCache
+from inventory_keeper.transfer import Transfer
+from inventory_keeper.type import BaseAccount
+from pymaker import Address, eth_transfer
+from pymaker.etherdelta import EtherDelta
+from pymaker.numeric import Wad
+from pymaker.token import ERC20Token
+
+
+class EtherDeltaMarketMakerKeeper:
+    def __init__(self, web3: Web3, etherdelta: EtherDelta, address: Address, balance_reader: BalanceReader):
+        assert(isinstance(balance_reader, BalanceReader))
+
+        self.web3 = web3
+        self.etherdelta = etherdelta
+        self.address = address
+        self.balance_reader = balance_reader
+
+    def balance_queries(self, token_address: Address) -> list:
+        assert(isinstance(token_address, Address) or (token_address is None))
+
+        if token_address is None:
+            return []
+
+        # EtherDelta keeps raw ETH balances under the `0x00..00` token address as well
+        return [BalanceQuery(token_address, self.address),
+                BalanceQuery(token_address, self.address, self.etherdelta.address)]
+
+    def watched_addresses(self) -> list:
+        # trades on EtherDelta only update its internal ledger and do not emit `Transfer` events,
+        # so balances of EtherDelta members can not be followed and have to be polled
+        return []
+
+    def balance(self, token_name: str, token_address: Address) -> Wad:
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+
+        return sum(map(self.balance_reader.balance_of, self.balance_queries(token_address)), Wad(0))
+
+    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> Transfer:
+        assert(isinstance(base, BaseAccount))
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(amount, Wad))
+
+        final_amount = min(amount, base.available_balance(token_name, token_address))
+
+        if token_address == RAW_ETH:
+            if final_amount > Wad(0):
+                return Transfer(eth_transfer(web3=self.web3, to=self.address, amount=final_amount), final_amount)
+            else:
+                raise Exception("No ETH left in the base account")
+        else:
+            if final_amount > Wad(0):
+                return Transfer(ERC20Token(web3=self.web3, address=token_address).transfer(self.address, final_amount),
+                                final_amount)
+            else:
+                raise Exception(f"No {token_name} left in the base account")
+
+    def deposit_address(self, token_address: Address) -> Address:
+        assert(isinstance(token_address, Address) or (token_address is None))
+
+        # deposits are sent to the market maker account, not to EtherDelta itself
+        return self.address
+
+    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> Transfer:
+        assert(isinstance(base, BaseAccount))
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(amount, Wad))
+
+        raise Exception(f"Withdrawals from EtherDelta not supported")
+
+
+def create_member(member: Member, web3: Web3, oasis_cache: OasisCache, exchange_cache: ExchangeCache,
+                  balance_reader: BalanceReader):
+    etherdelta_address = Address(member.config['etherDeltaAddress'])
+    market_maker_address = Address(member.config['marketMakerAddress'])
+
+    return EtherDeltaMarketMakerKeeper(web3=web3,
+                                       etherdelta=EtherDelta(web3=web3, address=etherdelta_address),
+                                       address=market_maker_address,
+                                       balance_reader=balance_reader)
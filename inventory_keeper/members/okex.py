@@ -0,0 +1,102 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from web3 import Web3
+
+from inventory_keeper.batch import BalanceReader
+from inventory_keeper.config import Member, OasisCache, ExchangeCache
+from inventory_keeper.metrics import exchange_request
+from inventory_keeper.ratelimit import ExchangeScheduler
+from inventory_keeper.transfer import Transfer
+from inventory_keeper.type import BaseAccount, ExchangeBalances, MissingTokenError
+from pyexchange.okex import OKEXApi
+from pymaker import Address
+from pymaker.numeric import Wad
+
+
+class OkexMarketMakerKeeper:
+    # tokens can not be deposited to exchange accounts, so the planner leaves them out
+    supports_deposits = False
+
+    def __init__(self, web3: Web3, okex_api: OKEXApi, scheduler: ExchangeScheduler):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(okex_api, OKEXApi))
+        assert(isinstance(scheduler, ExchangeScheduler))
+
+        self.web3 = web3
+        self.okex_api = okex_api
+        self.scheduler = scheduler
+        self.balances = ExchangeBalances(self._fetch_balances)
+
+    def balance_queries(self, token_address: Address) -> list:
+        assert(isinstance(token_address, Address) or (token_address is None))
+
+        return []
+
+    def watched_addresses(self) -> list:
+        return []
+
+    def _fetch_balances(self):
+        def fetch():
+            with exchange_request('okex-market-maker-keeper'):
+                return self.okex_api.get_balances()
+
+        return self.scheduler.call('okex-market-maker-keeper', self.okex_api.api_key, 'get_balances', fetch)
+
+    def balance(self, token_name: str, token_address: Address) -> Wad:
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+
+        balances = self.balances.get()
+
+        try:
+            return Wad.from_number(balances['free'][token_name.lower()]) + \
+                   Wad.from_number(balances['freezed'][token_name.lower()])
+        except KeyError:
+            raise MissingTokenError(f"No {token_name} balance in the OKEX account")
+
+    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> Transfer:
+        assert(isinstance(base, BaseAccount))
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(amount, Wad))
+
+        raise Exception(f"Deposits to OKEX not supported")
+
+    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> Transfer:
+        assert(isinstance(base, BaseAccount))
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(amount, Wad))
+
+        raise Exception(f"Withdrawals from OKEX not supported")
+
+
+def create_member(member: Member, web3: Web3, oasis_cache: OasisCache, exchange_cache: ExchangeCache,
+                  balance_reader: BalanceReader):
+    api_key = member.environ(member.config['apiKey'])
+    secret_key = member.environ(member.config['secretKey'])
+
+    def create():
+        okex_api = OKEXApi(api_server="https://www.okex.com",
+                           api_key=api_key,
+                           secret_key=secret_key,
+                           timeout=15.5)
+        return OkexMarketMakerKeeper(web3=web3, okex_api=okex_api, scheduler=exchange_cache.scheduler)
+
+    # members of the same type using the same credentials share a single implementation
+    return exchange_cache.get_implementation((member.type, api_key, secret_key), create)
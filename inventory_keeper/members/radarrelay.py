@@ -0,0 +1,85 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from web3 import Web3
+
+from inventory_keeper.batch import RAW_ETH, BalanceReader
+from inventory_keeper.config import Member, OasisCache, ExchangeCache
+from inventory_keeper.transfer import Transfer
+from inventory_keeper.type import BaseAccount, EthereumAccount
+from pymaker import Address, eth_transfer
+from pymaker.numeric import Wad
+from pymaker.token import ERC20Token
+
+
+class RadarRelayMarketMakerKeeper(EthereumAccount):
+    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> Transfer:
+        assert(isinstance(base, BaseAccount))
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(amount, Wad))
+
+        final_amount = min(amount, base.available_balance(token_name, token_address))
+
+        if token_address == RAW_ETH:
+            if final_amount > Wad(0):
+                return Transfer(eth_transfer(web3=self.web3, to=self.address, amount=final_amount), final_amount)
+            else:
+                raise Exception("No ETH left in the base account")
+        else:
+            if final_amount > Wad(0):
+                return Transfer(ERC20Token(web3=self.web3, address=token_address).transfer(self.address, final_amount),
+                                final_amount)
+            else:
+                raise Exception(f"No {token_name} left in the base account")
+
+    def deposit_address(self, token_address: Address) -> Address:
+        assert(isinstance(token_address, Address) or (token_address is None))
+
+        return self.address
+
+    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> Transfer:
+        assert(isinstance(base, BaseAccount))
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(amount, Wad))
+
+        return self.withdraw_to(base, base.address, token_name, token_address, amount)
+
+    def withdraw_to(self, base: BaseAccount, destination: Address, token_name: str, token_address: Address,
+                    amount: Wad) -> Transfer:
+        """Moves tokens straight to `destination`, using the allowance given to the base account."""
+        assert(isinstance(base, BaseAccount))
+        assert(isinstance(destination, Address))
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(amount, Wad))
+
+        if token_address == RAW_ETH:
+            raise Exception(f"ETH withdrawals from RadarRelay are not supported")
+        else:
+            erc20_token = ERC20Token(web3=self.web3, address=token_address)
+            return Transfer(erc20_token.transfer_from(self.address, destination, amount), amount)
+
+
+def create_member(member: Member, web3: Web3, oasis_cache: OasisCache, exchange_cache: ExchangeCache,
+                  balance_reader: BalanceReader):
+    market_maker_address = Address(member.config['marketMakerAddress'])
+
+    return RadarRelayMarketMakerKeeper(web3=web3,
+                                       address=market_maker_address,
+                                       balance_reader=balance_reader)
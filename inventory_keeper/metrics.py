@@ -0,0 +1,151 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from pymaker.numeric import Wad
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, start_http_server
+except ImportError:
+    start_http_server = None
+
+
+class _NullMetric:
+    """Stands in for metrics if the `prometheus_client` package is not installed."""
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, amount):
+        pass
+
+
+if start_http_server is not None:
+    LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    TRANSFER_BUCKETS = (5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 3600.0)
+
+    BALANCE_FETCH_SECONDS = Histogram('inventory_keeper_balance_fetch_seconds',
+                                      'Time taken to read a member token balance',
+                                      ['member', 'type', 'token'], buckets=LATENCY_BUCKETS)
+    BALANCE_FETCH_FAILURES = Counter('inventory_keeper_balance_fetch_failures_total',
+                                     'Number of member token balances which could not be read',
+                                     ['member', 'type', 'token'])
+    MEMBER_BALANCE = Gauge('inventory_keeper_member_balance',
+                           'Most recently read member token balance',
+                           ['member', 'type', 'token'])
+    MEMBER_BALANCE_TO_MIN = Gauge('inventory_keeper_member_balance_to_min_ratio',
+                                  'Most recently read member token balance divided by its `minAmount`',
+                                  ['member', 'type', 'token'])
+    MEMBER_BALANCE_TO_MAX = Gauge('inventory_keeper_member_balance_to_max_ratio',
+                                  'Most recently read member token balance divided by its `maxAmount`',
+                                  ['member', 'type', 'token'])
+    EXCHANGE_REQUEST_SECONDS = Histogram('inventory_keeper_exchange_request_seconds',
+                                         'Time taken by an exchange API request, including failed attempts',
+                                         ['type'], buckets=LATENCY_BUCKETS)
+    EXCHANGE_REQUEST_FAILURES = Counter('inventory_keeper_exchange_request_failures_total',
+                                        'Number of failed exchange API request attempts',
+                                        ['type'])
+    TRANSFER_SECONDS = Histogram('inventory_keeper_transfer_seconds',
+                                 'Time from sending a transfer until receiving its receipt',
+                                 ['member', 'token', 'direction'], buckets=TRANSFER_BUCKETS)
+    TRANSFERS = Counter('inventory_keeper_transfers_total',
+                        'Number of transfers sent',
+                        ['member', 'token', 'direction', 'result'])
+    CYCLE_SECONDS = Histogram('inventory_keeper_cycle_seconds',
+                              'Time taken by a single cycle of the keeper',
+                              ['cycle'], buckets=LATENCY_BUCKETS)
+    CYCLE_OVERRUNS = Counter('inventory_keeper_cycle_overruns_total',
+                             'Number of cycles which took longer than their frequency',
+                             ['cycle'])
+else:
+    BALANCE_FETCH_SECONDS = BALANCE_FETCH_FAILURES = _NullMetric()
+    MEMBER_BALANCE = MEMBER_BALANCE_TO_MIN = MEMBER_BALANCE_TO_MAX = _NullMetric()
+    EXCHANGE_REQUEST_SECONDS = EXCHANGE_REQUEST_FAILURES = _NullMetric()
+    TRANSFER_SECONDS = TRANSFERS = _NullMetric()
+    CYCLE_SECONDS = CYCLE_OVERRUNS = _NullMetric()
+
+
+def start_metrics_server(port: int):
+    """Starts serving metrics over HTTP on `port`."""
+    assert(isinstance(port, int))
+
+    if start_http_server is None:
+        raise Exception("The `prometheus_client` package has to be installed in order to serve metrics")
+
+    start_http_server(port)
+    logging.getLogger('metrics').info(f"Serving metrics on port {port}")
+
+
+def record_balance_fetch(member, member_token, duration: float, balance: Optional[Wad]):
+    """Records the time taken to read a member token balance, and the balance itself.
+
+    `balance` is `None` if the balance could not be read.
+    """
+    labels = (member.name, member.type, member_token.token_name)
+
+    BALANCE_FETCH_SECONDS.labels(*labels).observe(duration)
+    if balance is None:
+        BALANCE_FETCH_FAILURES.labels(*labels).inc()
+        return
+
+    MEMBER_BALANCE.labels(*labels).set(float(balance))
+    if member_token.min_amount is not None and member_token.min_amount > Wad(0):
+        MEMBER_BALANCE_TO_MIN.labels(*labels).set(float(balance) / float(member_token.min_amount))
+    if member_token.max_amount is not None and member_token.max_amount > Wad(0):
+        MEMBER_BALANCE_TO_MAX.labels(*labels).set(float(balance) / float(member_token.max_amount))
+
+
+def record_transfer(member_name: str, token_name: str, deposit: bool, duration: float, successful: bool):
+    direction = 'deposit' if deposit else 'withdrawal'
+
+    TRANSFER_SECONDS.labels(member_name, token_name, direction).observe(duration)
+    TRANSFERS.labels(member_name, token_name, direction, 'success' if successful else 'failure').inc()
+
+
+@contextmanager
+def exchange_request(type_name: str):
+    """Measures a single exchange API request attempt, so retried requests are counted separately."""
+    started_at = time.time()
+    try:
+        yield
+    except:
+        EXCHANGE_REQUEST_FAILURES.labels(type_name).inc()
+        raise
+    finally:
+        EXCHANGE_REQUEST_SECONDS.labels(type_name).observe(time.time() - started_at)
+
+
+@contextmanager
+def cycle(name: str, frequency: float):
+    """Measures a single cycle, counting it as an overrun if it took longer than `frequency` seconds."""
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - started_at
+        CYCLE_SECONDS.labels(name).observe(duration)
+        if duration > frequency:
+            CYCLE_OVERRUNS.labels(name).inc()
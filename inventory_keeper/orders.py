@@ -0,0 +1,167 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+
+from web3 import Web3
+
+from inventory_keeper.batch import batch_request
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.oasis import MatchingMarket
+
+LOG_MAKE = '0x773ff502687307abfa024ac9f62f9752a0d210dac2ffd9a29e38e12e2ea82c82'
+LOG_TAKE = '0x3383e3357c77fd2e3a4b30deea81179bc70a795d053d14d5b7f2f01d0fd4596f'
+LOG_KILL = '0x9577941d28fff863bfbee4694a6a4a56fb09e169619189d2eaa750b5b4819995'
+OFFERS = '8a72ea6a'
+
+
+def _hex(value) -> str:
+    if isinstance(value, str):
+        return value if value.startswith('0x') else '0x' + value
+    else:
+        return '0x' + bytes(value).hex()
+
+
+class OasisOrderIndex:
+    """Incrementally maintained index of open orders of a set of makers on a single OasisDEX market.
+
+    The first time the index is used, open orders of all known makers are read with a full scan
+    of the order book. From then on, the index follows `LogMake`, `LogTake` and `LogKill` events
+    of these makers emitted since the last processed block, and re-reads only the orders mentioned
+    in these events. Balances locked in open orders are then served from memory.
+
+    If the index falls more than `max_block_gap` blocks behind, it does a full scan again instead
+    of following the events.
+
+    Attributes:
+        web3: An instance of `Web3`. If its default block is a block number, the index gets
+            updated up to that block. Otherwise it gets updated up to the most recent block.
+        otc: The OasisDEX market.
+        max_block_gap: Maximum number of blocks processed by following the events.
+    """
+
+    logger = logging.getLogger('oasis-order-index')
+
+    def __init__(self, web3: Web3, otc: MatchingMarket, max_block_gap: int = 5000):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(otc, MatchingMarket))
+        assert(isinstance(max_block_gap, int))
+
+        self.web3 = web3
+        self.otc = otc
+        self.max_block_gap = max_block_gap
+        self._makers = set()
+        self._unscanned_makers = set()
+        self._orders = {}
+        self._last_block = None
+        self._lock = threading.Lock()
+
+    def add_maker(self, maker: Address):
+        assert(isinstance(maker, Address))
+
+        with self._lock:
+            if maker not in self._makers:
+                self._makers.add(maker)
+                self._unscanned_makers.add(maker)
+
+    def locked_balance(self, maker: Address, pay_token: Address) -> Wad:
+        """Returns the total amount of `pay_token` locked in open orders of `maker`."""
+        assert(isinstance(maker, Address))
+        assert(isinstance(pay_token, Address))
+
+        self.add_maker(maker)
+
+        with self._lock:
+            self._update()
+
+            return sum((pay_amount for order_maker, order_pay_token, pay_amount in self._orders.values()
+                        if order_maker == maker and order_pay_token == pay_token), Wad(0))
+
+    def _update(self):
+        block_number = self.web3.eth.defaultBlock
+        if not isinstance(block_number, int):
+            block_number = self.web3.eth.blockNumber
+
+        if self._last_block is None or block_number - self._last_block > self.max_block_gap:
+            self._full_scan(block_number)
+        else:
+            if block_number > self._last_block:
+                self._follow_events(self._last_block + 1, block_number)
+
+            # makers added since the last update have not been followed yet, so we read
+            # their orders directly
+            for maker in self._unscanned_makers:
+                for order in self.otc.get_orders_by_maker(maker):
+                    self._orders[order.order_id] = (order.maker, order.pay_token, order.pay_amount)
+
+        self._unscanned_makers = set()
+        self._last_block = max(block_number, self._last_block or 0)
+
+    def _full_scan(self, block_number: int):
+        self._orders = {}
+        for order in self.otc.get_orders():
+            if order.maker in self._makers:
+                self._orders[order.order_id] = (order.maker, order.pay_token, order.pay_amount)
+
+        self.logger.info(f"Scanned Oasis order book at {self.otc.address} as of block #{block_number},"
+                         f" found {len(self._orders)} open orders of {len(self._makers)} makers")
+
+    def _follow_events(self, from_block: int, to_block: int):
+        maker_topics = ['0x' + maker.address[2:].lower().rjust(64, '0')
+                        for maker in self._makers - self._unscanned_makers]
+        if len(maker_topics) == 0:
+            return
+
+        order_ids = set()
+        for signature, maker_position in [(LOG_MAKE, 3), (LOG_TAKE, 2), (LOG_KILL, 3)]:
+            topics = [signature, None, None, None]
+            topics[maker_position] = maker_topics
+
+            logs = self.web3.eth.getLogs({'fromBlock': from_block,
+                                          'toBlock': to_block,
+                                          'address': self.otc.address.address,
+                                          'topics': topics[:maker_position + 1]})
+
+            for log in logs:
+                if signature == LOG_TAKE:
+                    # `LogTake` does not index the order id, it is the first word of its data
+                    order_ids.add(int(_hex(log['data'])[2:66], 16))
+                else:
+                    order_ids.add(int(_hex(log['topics'][1]), 16))
+
+        if len(order_ids) > 0:
+            self._read_orders(sorted(order_ids), to_block)
+            self.logger.debug(f"Updated {len(order_ids)} Oasis orders in blocks #{from_block}-#{to_block}")
+
+    def _read_orders(self, order_ids: list, block_number: int):
+        calls = [("eth_call", [{'to': self.otc.address.address,
+                                'data': '0x' + OFFERS + hex(order_id)[2:].rjust(64, '0')}, hex(block_number)])
+                 for order_id in order_ids]
+
+        for order_id, result in zip(order_ids, batch_request(self.web3, calls)):
+            # `offers(uint256)` returns `(pay_amt, pay_gem, buy_amt, buy_gem, owner, timestamp)`
+            data = result[2:]
+            pay_amount = Wad(int(data[0:64], 16)) if len(data) >= 64 else Wad(0)
+            pay_token = Address('0x' + data[64 + 24:128]) if len(data) >= 128 else None
+            owner = Address('0x' + data[256 + 24:320]) if len(data) >= 320 else None
+
+            if pay_amount > Wad(0) and owner is not None and owner in self._makers:
+                self._orders[order_id] = (owner, pay_token, pay_amount)
+            else:
+                self._orders.pop(order_id, None)
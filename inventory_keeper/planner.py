@@ -0,0 +1,160 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from pprint import pformat
+from typing import Optional
+
+from inventory_keeper.batch import RAW_ETH
+from inventory_keeper.config import Member, MemberToken
+from pymaker.numeric import Wad
+
+
+class Requirement:
+    """A surplus or a deficit of a member token, found in a single cycle.
+
+    Attributes:
+        member: The member.
+        implementation: Implementation of the member.
+        member_token: The member token.
+        amount: Amount to be deposited (deficit) or withdrawn (surplus), always positive.
+        deficit: `True` for deficits, `False` for surpluses.
+        urgent: `True` for deficits of members which are already below `minAmount`.
+    """
+    def __init__(self, member: Member, implementation, member_token: MemberToken, amount: Wad, deficit: bool,
+                 urgent: bool = False):
+        assert(isinstance(member, Member))
+        assert(isinstance(member_token, MemberToken))
+        assert(isinstance(amount, Wad))
+        assert(isinstance(deficit, bool))
+        assert(isinstance(urgent, bool))
+
+        self.member = member
+        self.implementation = implementation
+        self.member_token = member_token
+        self.amount = amount
+        self.deficit = deficit
+        self.urgent = urgent
+
+    def can_send_directly(self) -> bool:
+        token_address = self.member_token.token.address
+        return hasattr(self.implementation, 'withdraw_to') and token_address is not None and token_address != RAW_ETH
+
+    def can_receive_directly(self) -> bool:
+        return hasattr(self.implementation, 'deposit_address')
+
+    def can_be_deposited_to(self) -> bool:
+        return getattr(self.implementation, 'supports_deposits', True)
+
+    def __repr__(self):
+        return f"Requirement('{self.member.name}', '{self.member_token.token_name}', {self.amount}," \
+               f" deficit={self.deficit})"
+
+
+class PlannedTransfer:
+    """A transfer of `amount` from `source` to `destination`, `None` standing for the base account."""
+    def __init__(self, source: Optional[Requirement], destination: Optional[Requirement], amount: Wad):
+        assert(isinstance(source, Requirement) or (source is None))
+        assert(isinstance(destination, Requirement) or (destination is None))
+        assert(isinstance(amount, Wad))
+
+        self.source = source
+        self.destination = destination
+        self.amount = amount
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
+class TransferPlanner:
+    """Plans all transfers of a single cycle at once, netting surpluses against deficits.
+
+    For each token, deficits are matched with surpluses of other members first. If the member
+    with a surplus lets the base account move its tokens (`withdraw_to`) and the member with
+    a deficit accepts plain token transfers (`deposit_address`), the tokens get moved directly
+    between them, in one transaction instead of a withdrawal and a deposit. Deficits of members
+    which are already below `minAmount` get matched first, then the largest ones.
+
+    Deficits of members which do not support deposits (`supports_deposits = False`) are left out,
+    so they do not use up the balance of the base account other members could be topped up with.
+
+    The plan lists withdrawals to the base account first, then direct moves, then deposits
+    from the base account. Deposits are limited to what is available in the base account
+    now (which, for ETH, excludes `minEthBalance`), urgent ones first. Deposits which could not
+    be covered are left out and planned again in the next cycle, once the withdrawals from this
+    one have been confirmed.
+    """
+
+    logger = logging.getLogger('transfer-planner')
+
+    def plan(self, requirements: list, base_available: dict) -> list:
+        """Returns a list of `PlannedTransfer`s.
+
+        Args:
+            requirements: Surpluses and deficits of all member tokens, as `Requirement`s.
+            base_available: Balances available in the base account, as a `dict` keyed by token name.
+        """
+        assert(isinstance(requirements, list))
+        assert(isinstance(base_available, dict))
+
+        surpluses = [requirement for requirement in requirements if not requirement.deficit]
+        deficits = [requirement for requirement in requirements if requirement.deficit]
+
+        for requirement in deficits:
+            if not requirement.can_be_deposited_to():
+                self.logger.info(f"Member '{requirement.member.name}' does not support deposits, not depositing"
+                                 f" {requirement.amount} {requirement.member_token.token_name} to it")
+
+        deficits = list(filter(Requirement.can_be_deposited_to, deficits))
+
+        withdrawals, moves, deposits = [], [], []
+        for token_name in sorted(set(requirement.member_token.token_name for requirement in surpluses + deficits)):
+            token_surpluses = sorted([requirement for requirement in surpluses
+                                      if requirement.member_token.token_name == token_name],
+                                     key=lambda requirement: requirement.amount, reverse=True)
+            token_deficits = sorted([requirement for requirement in deficits
+                                     if requirement.member_token.token_name == token_name],
+                                    key=lambda requirement: (requirement.urgent, requirement.amount), reverse=True)
+
+            remaining = {id(requirement): requirement.amount for requirement in token_surpluses + token_deficits}
+            for deficit in filter(Requirement.can_receive_directly, token_deficits):
+                for surplus in filter(Requirement.can_send_directly, token_surpluses):
+                    amount = min(remaining[id(deficit)], remaining[id(surplus)])
+                    if surplus.member is deficit.member or amount <= Wad(0):
+                        continue
+
+                    moves.append(PlannedTransfer(surplus, deficit, amount))
+                    remaining[id(deficit)] -= amount
+                    remaining[id(surplus)] -= amount
+
+            for surplus in token_surpluses:
+                if remaining[id(surplus)] > Wad(0):
+                    withdrawals.append(PlannedTransfer(surplus, None, remaining[id(surplus)]))
+
+            available = base_available.get(token_name, Wad(0))
+            for deficit in token_deficits:
+                amount = min(remaining[id(deficit)], available)
+                if amount > Wad(0):
+                    deposits.append(PlannedTransfer(None, deficit, amount))
+                    available -= amount
+
+                if amount < remaining[id(deficit)]:
+                    self.logger.info(f"Not enough {token_name} left in the base account to deposit"
+                                     f" {remaining[id(deficit)] - max(amount, Wad(0))} {token_name}"
+                                     f" to '{deficit.member.name}' in this cycle")
+
+        return withdrawals + moves + deposits
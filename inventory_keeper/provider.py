@@ -0,0 +1,349 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3.providers.base import BaseProvider
+
+# Methods which depend on the state of a particular node (its accounts, its transaction pool,
+# its filters), so they always go to the same node.
+PINNED_METHODS = {'eth_accounts', 'eth_coinbase', 'eth_sign', 'eth_sendTransaction', 'eth_sendRawTransaction',
+                  'eth_getTransactionCount', 'eth_newFilter', 'eth_newBlockFilter', 'eth_newPendingTransactionFilter',
+                  'eth_getFilterChanges', 'eth_getFilterLogs', 'eth_uninstallFilter'}
+
+# Methods with a block identifier as their last parameter.
+BLOCK_METHODS = {'eth_call', 'eth_getBalance', 'eth_getCode', 'eth_getStorageAt'}
+
+# Fragments of JSON-RPC error messages returned by nodes which do not have the requested block (yet).
+BLOCK_UNAVAILABLE_ERRORS = ['header not found', 'missing trie node', 'unknown block', 'block not found']
+
+
+class Endpoint:
+    def __init__(self, uri: str, pool_size: int):
+        assert(isinstance(uri, str))
+        assert(isinstance(pool_size, int))
+
+        self.uri = uri
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.latency = None
+        self.in_flight = 0
+        self.block_number = None
+        self.healthy = True
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def score(self) -> float:
+        # endpoints without any latency observed yet get tried first
+        return (self.latency or 0.0) * (1 + self.in_flight)
+
+    def __repr__(self):
+        return f"Endpoint('{self.uri}')"
+
+
+class PooledHTTPProvider(BaseProvider):
+    """JSON-RPC provider spreading requests across multiple nodes.
+
+    Each node is accessed through its own pool of persistent (keep-alive) HTTP connections.
+    Read requests are sent to one of the healthy nodes, preferring the ones with the lowest
+    observed latency. Requests which depend on the state of a particular node, like sending
+    transactions or polling filters, always go to the same node. Reads made as of a particular
+    block only go to nodes which are known to have that block, if there are any.
+
+    Nodes which fail to respond are excluded for `retry_after` seconds (doubled with each
+    consecutive failure), and the request gets retried on another node. Read requests are
+    retried on any failure, and reads made as of a particular block are also retried if the node
+    responds it does not have that block, in which case it is not used for that block again until
+    it reports a newer one. Other requests are only retried if the node could not be connected
+    to at all, so a transaction never gets sent twice. All nodes are health-checked every
+    `health_check_interval` seconds, and nodes lagging more than `max_block_lag` blocks behind
+    the best one are excluded until they catch up.
+
+    Attributes:
+        endpoint_uris: List of JSON-RPC endpoint URIs.
+        timeout: Timeout of a single request (in seconds).
+        pool_size: Maximum number of connections kept open to each node.
+        retry_after: Time a failed node is excluded for (in seconds).
+        health_check_interval: Frequency of health checks (in seconds).
+        max_block_lag: Maximum number of blocks a node can lag behind the best one.
+    """
+
+    logger = logging.getLogger('pooled-http-provider')
+
+    def __init__(self, endpoint_uris: List[str], timeout: float = 10.0, pool_size: int = 16,
+                 retry_after: float = 5.0, health_check_interval: float = 15.0, max_block_lag: int = 3):
+        assert(isinstance(endpoint_uris, list))
+        assert(len(endpoint_uris) > 0)
+
+        super().__init__()
+        self.endpoint_uris = endpoint_uris
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.retry_after = retry_after
+        self.health_check_interval = health_check_interval
+        self.max_block_lag = max_block_lag
+        self.endpoints = [Endpoint(uri, pool_size) for uri in endpoint_uris]
+        self._pinned = self.endpoints[0]
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if len(self.endpoints) > 1:
+            threading.Thread(target=self._health_check_loop, daemon=True).start()
+
+    @property
+    def endpoint_uri(self) -> str:
+        return self._pinned.uri
+
+    def isConnected(self) -> bool:
+        try:
+            return 'error' not in self.make_request('web3_clientVersion', [])
+        except Exception:
+            return False
+
+    def make_request(self, method, params):
+        payload = {"jsonrpc": "2.0", "id": next(self._request_ids), "method": method, "params": params}
+
+        if method in PINNED_METHODS or method.startswith('personal_'):
+            return self._send_pinned(payload)
+        else:
+            response = self._send_read(payload, self._required_block(method, params))
+            if method == 'eth_blockNumber' and 'result' in response:
+                self._observe_block(self._last_endpoint(), int(response['result'], 16))
+
+            return response
+
+    def make_batch_request(self, payload: list) -> list:
+        assert(isinstance(payload, list))
+
+        if any(item['method'] in PINNED_METHODS or item['method'].startswith('personal_') for item in payload):
+            return self._send_pinned(payload)
+        else:
+            required_blocks = [self._required_block(item['method'], item['params']) for item in payload]
+            required_blocks = [block for block in required_blocks if block is not None]
+            return self._send_read(payload, max(required_blocks) if len(required_blocks) > 0 else None)
+
+    def _send_read(self, payload, required_block: Optional[int]):
+        tried = set()
+        last_error = None
+        last_response = None
+        for _ in range(len(self.endpoints)):
+            endpoint = self._choose(required_block, tried)
+            if endpoint is None:
+                break
+
+            tried.add(endpoint)
+            try:
+                response = self._post(endpoint, payload)
+            except Exception as e:
+                last_error = e
+                continue
+
+            if required_block is None or not self._block_unavailable(response):
+                return response
+
+            self._lagging(endpoint, required_block)
+            last_response = response
+
+        # if no node has the block, the caller gets the error returned by the last one
+        if last_response is not None:
+            return last_response
+
+        raise last_error if last_error is not None else Exception("No JSON-RPC endpoints available")
+
+    def _send_pinned(self, payload):
+        tried = set()
+        while True:
+            with self._lock:
+                endpoint = self._pinned
+
+            tried.add(endpoint)
+            try:
+                return self._post(endpoint, payload)
+            except requests.exceptions.ConnectionError:
+                # the request did not reach the node, so it is safe to send it to another one
+                replacement = self._choose(None, tried)
+                if replacement is None:
+                    raise
+
+                with self._lock:
+                    if self._pinned is endpoint:
+                        self.logger.warning(f"Switching transactions and filters from {endpoint.uri}"
+                                            f" to {replacement.uri}")
+                        self._pinned = replacement
+
+    def _choose(self, required_block: Optional[int], excluded: set) -> Optional[Endpoint]:
+        now = time.time()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in excluded and endpoint.healthy and endpoint.retry_at <= now]
+
+            if required_block is not None:
+                synced = [endpoint for endpoint in candidates
+                          if endpoint.block_number is not None and endpoint.block_number >= required_block]
+                if len(synced) > 0:
+                    candidates = synced
+
+            if len(candidates) == 0:
+                # if all nodes have failed recently, we try the one which has failed first
+                candidates = sorted([endpoint for endpoint in self.endpoints if endpoint not in excluded],
+                                    key=lambda endpoint: endpoint.retry_at)[:1]
+
+            if len(candidates) == 0:
+                return None
+
+            # out of two random nodes, the one with a lower latency gets chosen, which spreads
+            # the load while still preferring faster nodes
+            return min(random.sample(candidates, min(2, len(candidates))), key=lambda endpoint: endpoint.score())
+
+    def _post(self, endpoint: Endpoint, payload):
+        with self._lock:
+            endpoint.in_flight += 1
+
+        started_at = time.time()
+        try:
+            response = endpoint.session.post(endpoint.uri, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            self._failed(endpoint, e)
+            raise
+        finally:
+            with self._lock:
+                endpoint.in_flight -= 1
+
+        self._succeeded(endpoint, time.time() - started_at)
+        self._local.last_endpoint = endpoint
+        return result
+
+    def _succeeded(self, endpoint: Endpoint, latency: float):
+        with self._lock:
+            endpoint.latency = latency if endpoint.latency is None else 0.8 * endpoint.latency + 0.2 * latency
+            if endpoint.failures > 0:
+                self.logger.info(f"JSON-RPC endpoint {endpoint.uri} is available again")
+
+            endpoint.failures = 0
+            endpoint.retry_at = 0.0
+
+    def _failed(self, endpoint: Endpoint, error: Exception):
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.retry_at = time.time() + self.retry_after * 2 ** min(endpoint.failures - 1, 6)
+
+        self.logger.warning(f"JSON-RPC endpoint {endpoint.uri} failed, excluding it for"
+                            f" {endpoint.retry_at - time.time():.1f}s: {error}")
+
+    def _lagging(self, endpoint: Endpoint, required_block: int):
+        with self._lock:
+            if endpoint.block_number is None or endpoint.block_number >= required_block:
+                endpoint.block_number = required_block - 1
+
+        self.logger.warning(f"JSON-RPC endpoint {endpoint.uri} does not have block #{required_block},"
+                            f" trying another one")
+
+    def _observe_block(self, endpoint: Optional[Endpoint], block_number: int):
+        if endpoint is None:
+            return
+
+        with self._lock:
+            endpoint.block_number = max(block_number, endpoint.block_number or 0)
+
+    def _last_endpoint(self) -> Optional[Endpoint]:
+        return getattr(self._local, 'last_endpoint', None)
+
+    @staticmethod
+    def _block_unavailable(response) -> bool:
+        responses = response if isinstance(response, list) else [response]
+        return any(isinstance(item, dict) and 'error' in item
+                   and any(error in str(item['error']).lower() for error in BLOCK_UNAVAILABLE_ERRORS)
+                   for item in responses)
+
+    @staticmethod
+    def _required_block(method: str, params: list) -> Optional[int]:
+        if method in BLOCK_METHODS and len(params) > 0:
+            block_identifier = params[-1]
+        elif method == 'eth_getBlockByNumber' and len(params) > 0:
+            block_identifier = params[0]
+        elif method == 'eth_getLogs' and len(params) > 0 and isinstance(params[0], dict):
+            block_identifier = params[0].get('toBlock')
+        else:
+            return None
+
+        if isinstance(block_identifier, int):
+            return block_identifier
+        elif isinstance(block_identifier, str) and block_identifier.startswith('0x'):
+            return int(block_identifier, 16)
+        else:
+            return None
+
+    def _health_check_loop(self):
+        while True:
+            time.sleep(self.health_check_interval)
+            try:
+                self._health_check()
+            except Exception as e:
+                self.logger.warning(f"Health check of JSON-RPC endpoints failed: {e}")
+
+    def _health_check(self):
+        for endpoint in self.endpoints:
+            try:
+                response = self._post(endpoint, {"jsonrpc": "2.0", "id": next(self._request_ids),
+                                                 "method": "eth_blockNumber", "params": []})
+                self._observe_block(endpoint, int(response['result'], 16))
+            except Exception:
+                pass
+
+        with self._lock:
+            block_numbers = [endpoint.block_number for endpoint in self.endpoints if endpoint.block_number is not None]
+            best_block = max(block_numbers) if len(block_numbers) > 0 else None
+
+            for endpoint in self.endpoints:
+                healthy = endpoint.retry_at <= time.time() and endpoint.block_number is not None \
+                          and best_block - endpoint.block_number <= self.max_block_lag
+
+                if healthy != endpoint.healthy:
+                    if healthy:
+                        self.logger.info(f"JSON-RPC endpoint {endpoint.uri} is healthy again")
+                    else:
+                        self.logger.warning(f"JSON-RPC endpoint {endpoint.uri} is unhealthy"
+                                            f" (at block #{endpoint.block_number}, best block #{best_block})")
+
+                endpoint.healthy = healthy
+
+
+def endpoint_uris(rpc_host: str, rpc_port: int) -> List[str]:
+    """Turns a comma-separated list of hosts, `host:port` pairs or URLs into a list of endpoint URIs."""
+    assert(isinstance(rpc_host, str))
+    assert(isinstance(rpc_port, int))
+
+    def endpoint_uri(host: str) -> str:
+        if '://' in host:
+            return host
+        elif ':' in host:
+            return f"http://{host}"
+        else:
+            return f"http://{host}:{rpc_port}"
+
+    return [endpoint_uri(host.strip()) for host in rpc_host.split(',') if host.strip() != '']
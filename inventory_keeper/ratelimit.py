@@ -0,0 +1,207 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from inventory_keeper.breaker import CircuitBreakers
+
+ALL_EXCHANGES = '*'
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `burst` calls."""
+    def __init__(self, rate: float, burst: int):
+        assert(isinstance(rate, float))
+        assert(isinstance(burst, int))
+        assert(rate > 0)
+        assert(burst > 0)
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # no tokens are added while paused
+                refill_from = max(self._updated_at, min(now, self._paused_until))
+                self._tokens = min(float(self.burst), self._tokens + (now - refill_from) * self.rate)
+                self._updated_at = now
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for `seconds`, and drains the bucket so calls resume one by one."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+class RateLimits:
+    """Budgets of exchange API calls, parsed from the `--exchange-rate-limit` argument.
+
+    The argument is a comma-separated list of entries, each of them being either `RATE`
+    or `TYPE=RATE`, optionally followed by `/BURST`. Entries without a member type apply
+    to all exchanges which do not have an entry of their own, e.g. `2/5,okex-market-maker-keeper=5/10`.
+    """
+    def __init__(self, value: str):
+        assert(isinstance(value, str))
+
+        self._budgets = {ALL_EXCHANGES: (2.0, 5)}
+        for entry in filter(None, map(str.strip, value.split(','))):
+            exchange, _, budget = entry.rpartition('=')
+            rate, _, burst = budget.partition('/')
+            self._budgets[exchange or ALL_EXCHANGES] = (float(rate), int(burst) if burst else max(1, int(float(rate))))
+
+    def budget(self, exchange: str) -> tuple:
+        assert(isinstance(exchange, str))
+
+        return self._budgets.get(exchange, self._budgets[ALL_EXCHANGES])
+
+
+class ExchangeScheduler:
+    """Schedules all exchange API calls, so they stay within the rate limits of exchanges.
+
+    Each exchange account (identified by the member type and the API key) has its own token bucket,
+    so all members using the same account share one budget. Identical calls made while one of them
+    is already in progress do not get sent again, they wait for the result of the first one instead.
+
+    Each account also has its own circuit breaker. Once calls to an account keep failing, they get rejected
+    straight away with `CircuitOpenError`, apart from occasional probes, until the exchange recovers.
+
+    A call which fails gets retried up to `tries` times, each attempt taking a token from the bucket.
+    If the exchange responds with HTTP 429 (Too Many Requests), the bucket of that account gets paused
+    for the number of seconds from the `Retry-After` header if it is available, or for `retry_after`
+    seconds otherwise, so all calls to that account back off and not only the rejected one.
+
+    Attributes:
+        rate_limits: Budgets of exchange API calls.
+        breakers: Circuit breakers of exchange accounts.
+        tries: Maximum number of attempts of each call.
+        retry_after: Pause after a rejected call if the exchange does not say how long to wait (in seconds).
+    """
+
+    logger = logging.getLogger('exchange-scheduler')
+
+    def __init__(self, rate_limits: RateLimits, breakers: CircuitBreakers, tries: int = 5, retry_after: float = 5.0):
+        assert(isinstance(rate_limits, RateLimits))
+        assert(isinstance(breakers, CircuitBreakers))
+        assert(isinstance(tries, int))
+        assert(isinstance(retry_after, float))
+
+        self.rate_limits = rate_limits
+        self.breakers = breakers
+        self.tries = tries
+        self.retry_after = retry_after
+        self._buckets = {}
+        self._in_progress = {}
+        self._lock = threading.Lock()
+
+    def call(self, exchange: str, account: str, request: str, function):
+        """Calls `function` within the budget of the `account` on the `exchange`.
+
+        Concurrent calls with the same `exchange`, `account` and `request` are coalesced into one.
+        """
+        assert(isinstance(exchange, str))
+        assert(isinstance(account, str))
+        assert(isinstance(request, str))
+        assert(callable(function))
+
+        key = (exchange, account, request)
+        with self._lock:
+            future = self._in_progress.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_progress[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            breaker = self.breakers.get(('exchange', exchange, account), f"{exchange} account '{account[:6]}...'")
+            future.set_result(breaker.call(lambda: self._call_with_retries(exchange, account, request, function)))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_progress[key]
+
+        return future.result()
+
+    def _call_with_retries(self, exchange: str, account: str, request: str, function):
+        bucket = self._bucket(exchange, account)
+        delay = 0.5
+        for attempt in range(1, self.tries + 1):
+            bucket.acquire()
+            try:
+                return function()
+            except Exception as e:
+                if attempt == self.tries:
+                    raise
+
+                if self._rate_limited(e):
+                    pause = self._retry_after(e) or self.retry_after
+                    self.logger.warning(f"Rate limit of {exchange} exceeded on '{request}', pausing all calls"
+                                        f" to that account for {pause:.1f}s")
+                    bucket.pause(pause)
+                else:
+                    self.logger.warning(f"Call to {exchange} '{request}' failed, retrying in {delay:.1f}s: {e}")
+                    time.sleep(delay)
+                    delay *= 1.5
+
+    def _bucket(self, exchange: str, account: str) -> TokenBucket:
+        with self._lock:
+            if (exchange, account) not in self._buckets:
+                rate, burst = self.rate_limits.budget(exchange)
+                self._buckets[(exchange, account)] = TokenBucket(rate, burst)
+
+            return self._buckets[(exchange, account)]
+
+    @staticmethod
+    def _rate_limited(error: Exception) -> bool:
+        response = getattr(error, 'response', None)
+        if response is not None and getattr(response, 'status_code', None) == 429:
+            return True
+
+        # API clients from `pyexchange` only include the status code in the message
+        return re.search(r'\b429\b', str(error)) is not None
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        try:
+            return float(headers['Retry-After'])
+        except (KeyError, ValueError):
+            return None
@@ -0,0 +1,99 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import importlib
+import logging
+import threading
+
+BUILTIN_MEMBER_TYPES = {
+    'oasis-market-maker-keeper': 'inventory_keeper.members.oasis:create_member',
+    'etherdelta-market-maker-keeper': 'inventory_keeper.members.etherdelta:create_member',
+    'radarrelay-market-maker-keeper': 'inventory_keeper.members.radarrelay:create_member',
+    'bibox-market-maker-keeper': 'inventory_keeper.members.bibox:create_member',
+    'okex-market-maker-keeper': 'inventory_keeper.members.okex:create_member',
+    'gateio-market-maker-keeper': 'inventory_keeper.members.gateio:create_member'
+}
+
+ENTRY_POINT_GROUP = 'inventory_keeper.member_types'
+
+
+class MemberTypeRegistry:
+    """Resolves member types to functions creating their implementations.
+
+    Modules implementing member types are only imported when a member of that type gets
+    created for the first time, so the dependencies of member types which are not used
+    (exchange API clients, contract wrappers) never get imported.
+
+    Types other than the built-in ones are looked up in the `inventory_keeper.member_types`
+    entry point group, with entry point names being the member types. Each entry point has
+    to refer to a function with the same signature as `create_member` functions of the
+    built-in types, i.e. `(member, web3, oasis_cache, exchange_cache, balance_reader)`.
+    """
+
+    logger = logging.getLogger('member-type-registry')
+
+    def __init__(self):
+        self._factories = {}
+        self._lock = threading.Lock()
+
+    def register(self, type_name: str, factory):
+        assert(isinstance(type_name, str))
+        assert(callable(factory))
+
+        with self._lock:
+            self._factories[type_name] = factory
+
+    def factory(self, type_name: str):
+        assert(isinstance(type_name, str))
+
+        with self._lock:
+            if type_name not in self._factories:
+                self._factories[type_name] = self._load(type_name)
+
+            return self._factories[type_name]
+
+    def _load(self, type_name: str):
+        if type_name in BUILTIN_MEMBER_TYPES:
+            module_name, function_name = BUILTIN_MEMBER_TYPES[type_name].split(':')
+            return getattr(importlib.import_module(module_name), function_name)
+
+        entry_point = self._entry_point(type_name)
+        if entry_point is None:
+            raise Exception(f"Unknown member type: '{type_name}'")
+
+        self.logger.info(f"Loading member type '{type_name}' from entry point '{entry_point}'")
+        return entry_point.load()
+
+    @staticmethod
+    def _entry_point(type_name: str):
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            # Python versions older than 3.8
+            import pkg_resources
+            return next(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP, name=type_name), None)
+
+        all_entry_points = entry_points()
+        if hasattr(all_entry_points, 'select'):
+            group = all_entry_points.select(group=ENTRY_POINT_GROUP)
+        else:
+            group = all_entry_points.get(ENTRY_POINT_GROUP, [])
+
+        return next((entry_point for entry_point in group if entry_point.name == type_name), None)
+
+
+member_types = MemberTypeRegistry()
@@ -17,16 +17,28 @@
 
 import json
 import logging
+import os
 import zlib
 
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
 
 class ReloadableConfig:
     """Reloadable JSON config file reader, capable of using jsonnet expressions.
 
-    This reader will always read most up-to-date version of the config file from disk
+    This reader will always return most up-to-date version of the config file from disk
     on each call to `get_config()`. In addition to that, whenever the config file changes,
     a log event is emitted.
 
+    The file is only read and parsed again if it has changed since the last call, i.e. if its
+    inode, size or modification time are different. If the `inotify_simple` package is available,
+    any inotify event concerning the file also causes it to be read again, which covers changes
+    made within the modification time resolution of the filesystem. Otherwise the previously
+    parsed object is returned.
+
     Attributes:
         filename: Filename of the configuration file.
     """
@@ -38,6 +50,9 @@ class ReloadableConfig:
 
         self.filename = filename
         self._checksum = None
+        self._file_stat = None
+        self._config = None
+        self._inotify = self._create_inotify()
 
     def get_config(self):
         """Reads the JSON config file from disk and returns it as a Python object.
@@ -45,6 +60,10 @@ class ReloadableConfig:
         Returns:
             Current configuration as a `dict` or `list` object.
         """
+        file_stat = self._stat()
+        if self._config is not None and file_stat == self._file_stat and not self._inotify_events():
+            return self._config
+
         with open(self.filename) as data_file:
             content_file = data_file.read()
             result = json.loads(content_file)
@@ -59,4 +78,35 @@ class ReloadableConfig:
                 self.logger.debug(f"Reloaded config file is: " + json.dumps(result, indent=4))
             self._checksum = checksum
 
-            return result
+            # If the content did not change we keep returning the same object,
+            # so the callers can cheaply tell it did not change
+            if self._config is None or result != self._config:
+                self._config = result
+            self._file_stat = file_stat
+
+            return self._config
+
+    def _stat(self) -> tuple:
+        file_stat = os.stat(self.filename)
+        return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+    def _create_inotify(self):
+        if INotify is None:
+            return None
+
+        try:
+            # We watch the directory, as editors often replace the file instead of writing to it
+            inotify = INotify()
+            inotify.add_watch(os.path.dirname(os.path.abspath(self.filename)),
+                              flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE | flags.ATTRIB)
+            return inotify
+        except OSError as e:
+            self.logger.warning(f"Failed to watch '{self.filename}' with inotify, will rely on file stats only: {e}")
+            return None
+
+    def _inotify_events(self) -> bool:
+        if self._inotify is None:
+            return False
+
+        basename = os.path.basename(self.filename)
+        return any(event.name == basename for event in self._inotify.read(timeout=0))
@@ -0,0 +1,257 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from inventory_keeper.files import write_atomically
+from pymaker import Address
+from pymaker.numeric import Wad
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha256(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class ShardRing:
+    """Assigns members to shards by consistent hashing of member names.
+
+    Each shard is placed on the ring `replicas` times, so members get spread evenly, and adding
+    or removing a shard only moves the members of that shard. All processes given the same list
+    of shards assign members in the same way, regardless of the order of that list.
+
+    Attributes:
+        shards: Names of all shards.
+        replicas: Number of points each shard has on the ring.
+    """
+    def __init__(self, shards: list, replicas: int = 100):
+        assert(isinstance(shards, list))
+        assert(len(shards) > 0)
+        assert(isinstance(replicas, int))
+
+        self.shards = shards
+        self.replicas = replicas
+        self._points = sorted((_hash(f"{shard}#{replica}"), shard) for shard in shards for replica in range(replicas))
+        self._hashes = [point for point, shard in self._points]
+
+    def shard(self, member_name: str) -> str:
+        assert(isinstance(member_name, str))
+
+        index = bisect.bisect(self._hashes, _hash(member_name)) % len(self._points)
+        return self._points[index][1]
+
+
+class ShardCoordinator:
+    """Coordinates nonces and deposits from the base account between keeper processes.
+
+    The state is kept in a JSON file, and all access to it is serialized with an exclusive
+    `flock` on a separate lock file next to it, so it works for processes on the same host
+    (or on hosts sharing a filesystem which supports `flock`). For each sender it holds the next
+    nonce, the nonces of transactions which have provably never been sent and can be used again,
+    and the deposits which have been sent (reservations), so no process deposits tokens already
+    being deposited by another one.
+
+    A confirmed deposit stays reserved for processes reading the base account balance at blocks
+    older than the one it has been confirmed in, as that balance does not reflect it yet. It gets
+    dropped once all processes have read balances at that block or later. Reservations of deposits
+    which might have been sent but never got a receipt, and of processes which died, expire after
+    `reservation_ttl`.
+
+    `locked()` can be nested, and the state is only written back when the outermost block exits.
+
+    Attributes:
+        filename: Filename of the shared state file.
+        shard: Name of this shard.
+        reservation_ttl: Time after which reservations expire (in seconds).
+    """
+
+    logger = logging.getLogger('shard-coordinator')
+
+    def __init__(self, filename: str, shard: str, reservation_ttl: float = 3600.0):
+        assert(isinstance(filename, str))
+        assert(isinstance(shard, str))
+        assert(isinstance(reservation_ttl, float))
+
+        self.filename = filename
+        self.shard = shard
+        self.reservation_ttl = reservation_ttl
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+        self._state = None
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            outermost = self._depth == 0
+            if outermost:
+                self._lock_file = open(self.filename + '.lock', 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                self._state = self._load()
+
+            self._depth += 1
+            try:
+                yield self._state
+            finally:
+                self._depth -= 1
+                if outermost:
+                    try:
+                        write_atomically(self.filename, json.dumps(self._state, indent=2))
+                    finally:
+                        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                        self._lock_file.close()
+                        self._lock_file = None
+                        self._state = None
+
+    def next_nonce(self, sender: Address, transaction_count) -> int:
+        """Returns the next nonce for `sender`, `transaction_count(block)` being a function reading it from the node."""
+        assert(isinstance(sender, Address))
+        assert(callable(transaction_count))
+
+        key = sender.address.lower()
+        with self.locked() as state:
+            free = state['free'].get(key, [])
+            if len(free) > 0:
+                confirmed = transaction_count('latest')
+                free = sorted(nonce for nonce in free if nonce >= confirmed)
+
+            if len(free) > 0:
+                nonce = free.pop(0)
+            else:
+                nonce = max(state['nonces'].get(key, 0), transaction_count('pending'))
+                state['nonces'][key] = nonce + 1
+
+            state['free'][key] = free
+            return nonce
+
+    def release_nonce(self, sender: Address, nonce: int):
+        """Marks a nonce of a transaction which failed, so it gets used again."""
+        assert(isinstance(sender, Address))
+        assert(isinstance(nonce, int))
+
+        with self.locked() as state:
+            state['free'].setdefault(sender.address.lower(), []).append(nonce)
+
+    def rewind_nonce(self, sender: Address, nonce: int) -> bool:
+        """Takes back a nonce of a transaction which has never been sent, if it was the last one handed out.
+
+        Returns:
+            `True` if the nonce is going to be handed out again next, `False` if later nonces have been
+            handed out already, in which case the caller has to fill the gap it leaves.
+        """
+        assert(isinstance(sender, Address))
+        assert(isinstance(nonce, int))
+
+        key = sender.address.lower()
+        with self.locked() as state:
+            if state['nonces'].get(key) != nonce + 1:
+                return False
+
+            state['nonces'][key] = nonce
+            return True
+
+    def reserve(self, sender: Address, token_address: Address, amount: Wad, nonce: int):
+        assert(isinstance(sender, Address))
+        assert(isinstance(token_address, Address))
+        assert(isinstance(amount, Wad))
+        assert(isinstance(nonce, int))
+
+        with self.locked() as state:
+            state['reservations'].append({'shard': self.shard,
+                                          'sender': sender.address.lower(),
+                                          'token': token_address.address.lower(),
+                                          'amount': str(amount.value),
+                                          'nonce': nonce,
+                                          'expires': time.time() + self.reservation_ttl})
+
+    def confirm(self, sender: Address, nonce: int, block_number: int):
+        """Marks a reserved deposit as confirmed in `block_number`."""
+        assert(isinstance(sender, Address))
+        assert(isinstance(nonce, int))
+        assert(isinstance(block_number, int))
+
+        with self.locked() as state:
+            for reservation in state['reservations']:
+                if reservation['sender'] == sender.address.lower() and reservation['nonce'] == nonce:
+                    reservation['block'] = block_number
+
+    def release(self, sender: Address, nonce: int):
+        assert(isinstance(sender, Address))
+        assert(isinstance(nonce, int))
+
+        with self.locked() as state:
+            state['reservations'] = [reservation for reservation in state['reservations']
+                                     if not (reservation['sender'] == sender.address.lower()
+                                             and reservation['nonce'] == nonce)]
+
+    def reserved(self, token_address: Address, block_number: Optional[int]) -> Wad:
+        """Returns the amount of a token being deposited to members by all shards.
+
+        `block_number` is the block the balance of the base account has been read at. Deposits confirmed
+        at or before that block are already reflected in it, so they are left out. If it is not known,
+        all deposits which have not been dropped yet are included.
+        """
+        assert(isinstance(token_address, Address))
+        assert(isinstance(block_number, int) or (block_number is None))
+
+        with self.locked() as state:
+            if block_number is not None:
+                state['blocks'][self.shard] = {'block': block_number, 'updated': time.time()}
+
+            # deposits confirmed at or before the block all shards have already reached are no longer needed
+            oldest_block = min(entry['block'] for entry in state['blocks'].values()) if state['blocks'] else None
+            state['reservations'] = [reservation for reservation in state['reservations']
+                                     if reservation.get('block') is None
+                                     or oldest_block is None
+                                     or reservation['block'] > oldest_block]
+
+            return sum((Wad(int(reservation['amount'])) for reservation in state['reservations']
+                        if reservation['token'] == token_address.address.lower()
+                        and (reservation.get('block') is None
+                             or block_number is None
+                             or reservation['block'] > block_number)), Wad(0))
+
+    def _load(self) -> dict:
+        state = {'nonces': {}, 'free': {}, 'reservations': [], 'blocks': {}}
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as file:
+                    state.update(json.load(file))
+            except Exception as e:
+                self.logger.warning(f"Failed to read shard state from '{self.filename}', starting afresh: {e}")
+
+        now = time.time()
+        expired = [reservation for reservation in state['reservations'] if reservation['expires'] < now]
+        for reservation in expired:
+            self.logger.warning(f"Reservation of shard '{reservation['shard']}' for nonce #{reservation['nonce']}"
+                                f" has expired")
+
+        state['reservations'] = [reservation for reservation in state['reservations'] if reservation['expires'] >= now]
+
+        # shards which have not read any balances for a long time (most likely have been stopped)
+        # do not hold confirmed reservations back anymore
+        state['blocks'] = {shard: entry for shard, entry in state['blocks'].items()
+                           if entry['updated'] + self.reservation_ttl >= now}
+        return state
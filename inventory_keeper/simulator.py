@@ -0,0 +1,363 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+
+from texttable import Texttable
+
+from inventory_keeper.history import HistoryReader
+from inventory_keeper.history_query import parse_time
+from inventory_keeper.thresholds import threshold_deposit, threshold_withdrawal
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RESULT_FIELDS = ['deposits', 'withdrawals', 'transfers', 'gas', 'time_below_min', 'idle_capital', 'shortfall']
+
+# combinations which run the member dry must never be recommended, whatever else they do well
+DEFAULT_SORT = ['shortfall', 'time_below_min', 'transfers']
+
+
+class Trace:
+    """Balance changes of a single member token, not caused by the keeper.
+
+    Attributes:
+        timestamps: Timestamps of consecutive balance samples.
+        flows: Change of the balance between each sample and the next one (the last one is always zero).
+    """
+    def __init__(self, timestamps: list, flows: list):
+        assert(isinstance(timestamps, list))
+        assert(isinstance(flows, list))
+        assert(len(timestamps) == len(flows))
+
+        self.timestamps = timestamps
+        self.flows = flows
+
+    def durations(self) -> list:
+        return [following - current for current, following in zip(self.timestamps, self.timestamps[1:])] + [0.0]
+
+    @staticmethod
+    def from_history(reader: HistoryReader, account: str, token_name: str, start: float = None, end: float = None):
+        """Takes balance changes from the balance history.
+
+        All changes are treated as external ones, including the ones caused by transfers sent by the keeper
+        while the history was being recorded. Jumps of the balance caused by these transfers should be left
+        out of the queried period, or the history should be recorded with `--manage-inventory` disabled.
+        """
+        assert(isinstance(reader, HistoryReader))
+
+        timestamps, balances = [], []
+        for sample in reader.samples(reader.series_ids({account}, {token_name}), start, end):
+            timestamps.append(sample.timestamp)
+            balances.append(sample.balance)
+
+        if len(balances) < 2:
+            raise Exception(f"Not enough {token_name} balances of '{account}' recorded in the balance history")
+
+        flows = [following - current for current, following in zip(balances, balances[1:])] + [0.0]
+        return Trace(timestamps, flows)
+
+    @staticmethod
+    def synthetic(days: float, interval: float, burn_rate: float, volatility: float, seed: int):
+        """Generates a random walk, consuming `burn_rate` tokens per hour on average."""
+        rng = random.Random(seed)
+        steps = int(days * 86400 / interval)
+        drift = burn_rate * interval / 3600
+        spread = volatility * interval / 3600
+
+        timestamps = [index * interval for index in range(steps)]
+        flows = [rng.gauss(-drift, spread) for _ in range(steps - 1)] + [0.0]
+        return Trace(timestamps, flows)
+
+
+def simulate(trace: Trace, min_amount: float, avg_amount: float, max_amount: float, confirmation_delay: int,
+             gas_per_transfer: float) -> dict:
+    """Replays the trace against an in-memory member account, using the same rules as the keeper.
+
+    In each sample the balance is rebalanced with `threshold_deposit` and `threshold_withdrawal`.
+    A transfer lands `confirmation_delay` samples after being sent, and no other transfer of that member
+    token is sent until then, as the keeper waits for transfers to get confirmed. The member starts
+    with `avg_amount` and its balance can never go below zero. Consumption which could not happen
+    because of that is reported as the shortfall.
+    """
+    assert(confirmation_delay >= 1)
+
+    balance = avg_amount
+    pending_amount, lands_at = 0.0, None
+    result = dict.fromkeys(RESULT_FIELDS, 0.0)
+
+    for index, (flow, duration) in enumerate(zip(trace.flows, trace.durations())):
+        if lands_at is not None and lands_at <= index:
+            balance += pending_amount
+            pending_amount, lands_at = 0.0, None
+
+        if lands_at is None:
+            deposit = threshold_deposit(balance, min_amount, avg_amount)
+            withdrawal = threshold_withdrawal(balance, max_amount, avg_amount) if deposit is None else None
+            if deposit is not None:
+                pending_amount, lands_at = deposit, index + confirmation_delay
+                result['deposits'] += 1
+            elif withdrawal is not None:
+                pending_amount, lands_at = -withdrawal, index + confirmation_delay
+                result['withdrawals'] += 1
+
+        if balance < min_amount:
+            result['time_below_min'] += duration
+
+        result['idle_capital'] += max(balance - min_amount, 0.0) * duration
+
+        balance += flow
+        if balance < 0:
+            result['shortfall'] -= balance
+            balance = 0.0
+
+    return _finish(result, trace, gas_per_transfer)
+
+
+def simulate_vectorised(trace: Trace, min_amounts, avg_amounts, max_amounts, confirmation_delay: int,
+                        gas_per_transfer: float) -> list:
+    """Does the same as `simulate`, for many threshold combinations at once.
+
+    Combinations are simulated side by side as `numpy` arrays, with a single pass over the trace.
+    """
+    assert(numpy is not None)
+    assert(confirmation_delay >= 1)
+
+    min_amounts = numpy.asarray(min_amounts, dtype=float)
+    avg_amounts = numpy.asarray(avg_amounts, dtype=float)
+    max_amounts = numpy.asarray(max_amounts, dtype=float)
+
+    balance = avg_amounts.copy()
+    pending_amount = numpy.zeros_like(balance)
+    lands_at = numpy.full(balance.shape, -1, dtype=numpy.int64)
+    deposits = numpy.zeros_like(balance)
+    withdrawals = numpy.zeros_like(balance)
+    time_below_min = numpy.zeros_like(balance)
+    idle_capital = numpy.zeros_like(balance)
+    shortfall = numpy.zeros_like(balance)
+
+    for index, (flow, duration) in enumerate(zip(trace.flows, trace.durations())):
+        landed = (lands_at >= 0) & (lands_at <= index)
+        balance += numpy.where(landed, pending_amount, 0.0)
+        pending_amount[landed] = 0.0
+        lands_at[landed] = -1
+
+        idle = lands_at < 0
+        deposit = idle & (balance < min_amounts)
+        withdrawal = idle & ~deposit & (balance > max_amounts)
+        pending_amount = numpy.where(deposit, avg_amounts - balance,
+                                     numpy.where(withdrawal, avg_amounts - balance, pending_amount))
+        lands_at[deposit | withdrawal] = index + confirmation_delay
+        deposits += deposit
+        withdrawals += withdrawal
+
+        time_below_min += numpy.where(balance < min_amounts, duration, 0.0)
+        idle_capital += numpy.maximum(balance - min_amounts, 0.0) * duration
+
+        balance += flow
+        shortfall += numpy.maximum(-balance, 0.0)
+        numpy.maximum(balance, 0.0, out=balance)
+
+    return [_finish({'deposits': float(deposits[index]),
+                     'withdrawals': float(withdrawals[index]),
+                     'time_below_min': float(time_below_min[index]),
+                     'idle_capital': float(idle_capital[index]),
+                     'shortfall': float(shortfall[index])}, trace, gas_per_transfer)
+            for index in range(len(balance))]
+
+
+def _finish(result: dict, trace: Trace, gas_per_transfer: float) -> dict:
+    period = trace.timestamps[-1] - trace.timestamps[0]
+
+    result['transfers'] = result['deposits'] + result['withdrawals']
+    result['gas'] = result['transfers'] * gas_per_transfer
+    result['idle_capital'] = result['idle_capital'] / period if period > 0 else 0.0
+    return result
+
+
+def rank(results: list, sort_fields: list) -> list:
+    """Sorts simulation results, best first, by the values of `sort_fields` in the given order."""
+    assert(isinstance(results, list))
+    assert(isinstance(sort_fields, list))
+
+    return sorted(results, key=lambda result: [result[field] for field in sort_fields])
+
+
+def parse_values(value: str) -> list:
+    """Parses a comma-separated list of numbers, each item being either a number or a `start:stop:step` range."""
+    result = []
+    for item in value.split(','):
+        try:
+            if ':' in item:
+                start, stop, step = map(float, item.split(':'))
+            else:
+                result.append(float(item))
+                continue
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid value or range: '{item}'")
+
+        if step <= 0:
+            raise argparse.ArgumentTypeError(f"Step of range '{item}' has to be positive")
+        if stop < start:
+            raise argparse.ArgumentTypeError(f"Range '{item}' has to end after it starts")
+
+        count = int(round((stop - start) / step)) + 1
+        result += [start + index * step for index in range(count)]
+
+    return result
+
+
+class Simulator:
+    """Replays balance traces with many combinations of `minAmount`, `avgAmount` and `maxAmount`."""
+
+    def __init__(self, args: list):
+        parser = argparse.ArgumentParser(prog='inventory-simulator')
+
+        parser.add_argument("--history-dir", type=str,
+                            help="Directory the balance history has been recorded to (if not specified,"
+                                 " a synthetic trace will be used)")
+
+        parser.add_argument("--account", type=str,
+                            help="Name of the member to replay the balances of")
+
+        parser.add_argument("--token", type=str,
+                            help="Name of the token to replay the balances of")
+
+        parser.add_argument("--from", dest='start', type=parse_time,
+                            help="Start of the replayed period, as a Unix timestamp or a UTC date and time")
+
+        parser.add_argument("--to", dest='end', type=parse_time,
+                            help="End of the replayed period (exclusive), as a Unix timestamp or a UTC date and time")
+
+        parser.add_argument("--synthetic-days", type=float, default=30.0,
+                            help="Length of the synthetic trace (in days, default: 30)")
+
+        parser.add_argument("--synthetic-interval", type=float, default=60.0,
+                            help="Interval between samples of the synthetic trace (in seconds, default: 60)")
+
+        parser.add_argument("--synthetic-burn-rate", type=float, default=1.0,
+                            help="Average consumption in the synthetic trace (in tokens per hour, default: 1)")
+
+        parser.add_argument("--synthetic-volatility", type=float, default=5.0,
+                            help="Standard deviation of balance changes in the synthetic trace"
+                                 " (in tokens per hour, default: 5)")
+
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Seed of the synthetic trace (default: 0)")
+
+        parser.add_argument("--min-amounts", type=parse_values, required=True,
+                            help="Values of `minAmount` to try, as comma-separated numbers or `start:stop:step' ranges")
+
+        parser.add_argument("--avg-amounts", type=parse_values, required=True,
+                            help="Values of `avgAmount` to try, as comma-separated numbers or `start:stop:step' ranges")
+
+        parser.add_argument("--max-amounts", type=parse_values, required=True,
+                            help="Values of `maxAmount` to try, as comma-separated numbers or `start:stop:step' ranges")
+
+        parser.add_argument("--confirmation-delay", type=int, default=1,
+                            help="Number of samples it takes for a transfer to get confirmed (default: 1)")
+
+        parser.add_argument("--gas-per-transfer", type=float, default=60000.0,
+                            help="Gas used by a single transfer (default: 60000)")
+
+        parser.add_argument("--sort", type=str, choices=RESULT_FIELDS, action='append',
+                            help="Field to sort the results by (can be repeated, default: `shortfall',"
+                                 " `time_below_min' and `transfers')")
+
+        parser.add_argument("--limit", type=int, default=20,
+                            help="Number of best combinations to print (default: 20)")
+
+        parser.add_argument("--no-numpy", dest='numpy', action='store_false',
+                            help="Do not use `numpy`, even if it is installed")
+
+        parser.add_argument("--json", dest='json', action='store_true',
+                            help="Print results as JSON instead of a table")
+
+        self.arguments = parser.parse_args(args)
+
+        self.combinations = [(min_amount, avg_amount, max_amount)
+                             for min_amount, avg_amount, max_amount in itertools.product(self.arguments.min_amounts,
+                                                                                         self.arguments.avg_amounts,
+                                                                                         self.arguments.max_amounts)
+                             if min_amount <= avg_amount <= max_amount]
+        if len(self.combinations) == 0:
+            parser.error("No combination of the given amounts satisfies minAmount <= avgAmount <= maxAmount")
+
+    def main(self):
+        trace = self.trace()
+        combinations = self.combinations
+
+        started_at = time.perf_counter()
+        if numpy is not None and self.arguments.numpy:
+            results = simulate_vectorised(trace, *zip(*combinations),
+                                          confirmation_delay=self.arguments.confirmation_delay,
+                                          gas_per_transfer=self.arguments.gas_per_transfer)
+        else:
+            results = [simulate(trace, min_amount, avg_amount, max_amount,
+                                confirmation_delay=self.arguments.confirmation_delay,
+                                gas_per_transfer=self.arguments.gas_per_transfer)
+                       for min_amount, avg_amount, max_amount in combinations]
+
+        elapsed = time.perf_counter() - started_at
+        print(f"Simulated {len(combinations)} combinations over {len(trace.flows)} samples in {elapsed:.2f}s",
+              file=sys.stderr)
+
+        results = [dict(result, minAmount=min_amount, avgAmount=avg_amount, maxAmount=max_amount)
+                   for (min_amount, avg_amount, max_amount), result in zip(combinations, results)]
+
+        results = rank(results, self.arguments.sort or DEFAULT_SORT)[:self.arguments.limit]
+
+        if self.arguments.json:
+            print(json.dumps(results, indent=2))
+            return
+
+        table = Texttable(max_width=250)
+        table.set_deco(Texttable.HEADER)
+        table.set_cols_dtype(['f', 'f', 'f', 'i', 'i', 'i', 'i', 'f', 'f', 'f'])
+        table.set_cols_align(['r'] * 10)
+        table.add_rows([["minAmount", "avgAmount", "maxAmount", "Deposits", "Withdrawals", "Transfers", "Gas",
+                         "Time below min (s)", "Idle capital", "Shortfall"]] +
+                       [[result['minAmount'], result['avgAmount'], result['maxAmount'], result['deposits'],
+                         result['withdrawals'], result['transfers'], result['gas'], result['time_below_min'],
+                         result['idle_capital'], result['shortfall']] for result in results])
+        print(table.draw())
+
+    def trace(self) -> Trace:
+        if self.arguments.history_dir is None:
+            return Trace.synthetic(days=self.arguments.synthetic_days,
+                                   interval=self.arguments.synthetic_interval,
+                                   burn_rate=self.arguments.synthetic_burn_rate,
+                                   volatility=self.arguments.synthetic_volatility,
+                                   seed=self.arguments.seed)
+
+        if self.arguments.account is None or self.arguments.token is None:
+            raise Exception("`--account` and `--token` have to be specified to replay the balance history")
+
+        with HistoryReader(self.arguments.history_dir) as reader:
+            return Trace.from_history(reader, self.arguments.account, self.arguments.token,
+                                      self.arguments.start, self.arguments.end)
+
+
+if __name__ == '__main__':
+    Simulator(sys.argv[1:]).main()
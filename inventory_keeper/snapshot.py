@@ -0,0 +1,69 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from inventory_keeper.config import Config
+from pymaker.numeric import Wad
+
+
+class InventorySnapshot:
+    """Balances of the base account and of all members, read once in a single cycle.
+
+    Attributes:
+        config: Config the snapshot has been taken for.
+        block_number: Number of the most recent block at the time the snapshot has been taken.
+        timestamp: Unix timestamp of the moment the snapshot has been taken.
+        base_balances: Balances of the base account, as a `dict` keyed by token name.
+        members_balances: A list with one entry per member, each entry being a list of
+            `FetchResult` objects, one per each member token.
+    """
+    def __init__(self, config: Config, block_number: int, timestamp: float, base_balances: dict, members_balances: list):
+        assert(isinstance(config, Config))
+        assert(isinstance(block_number, int))
+        assert(isinstance(timestamp, float))
+        assert(isinstance(base_balances, dict))
+        assert(isinstance(members_balances, list))
+
+        self.config = config
+        self.block_number = block_number
+        self.timestamp = timestamp
+        self.base_balances = base_balances
+        self.members_balances = members_balances
+
+    def age(self) -> float:
+        return time.time() - self.timestamp
+
+    def total_balances(self) -> dict:
+        """Returns balances summed up across the base account and all members, keyed by token name.
+
+        Members whose balance could not be read are left out of the total, unless their last known
+        good (stale) balance is available.
+        """
+        result = {token.name: Wad(0) for token in self.config.tokens}
+        for token_name, balance in self.base_balances.items():
+            result[token_name] += balance
+
+        for member, member_balances in zip(self.config.members, self.members_balances):
+            for member_token, fetch_result in zip(member.tokens, member_balances):
+                if fetch_result.balance is not None:
+                    result[member_token.token_name] += fetch_result.balance
+
+        return result
+
+    def __repr__(self):
+        return f"InventorySnapshot(block_number={self.block_number}, timestamp={self.timestamp})"
@@ -0,0 +1,41 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Rebalancing rules shared by the keeper and the simulator. They work with `Wad`s as well as with
+# floats, so the simulator can replay them without depending on `pymaker`.
+
+
+def threshold_deposit(balance, min_amount, avg_amount):
+    """Returns the amount to deposit to a member, or `None` if its balance is not below `minAmount`."""
+    if min_amount is None or avg_amount is None:
+        return None
+
+    if balance < min_amount:
+        return avg_amount - balance
+    else:
+        return None
+
+
+def threshold_withdrawal(balance, max_amount, avg_amount):
+    """Returns the amount to withdraw from a member, or `None` if its balance is not above `maxAmount`."""
+    if max_amount is None or avg_amount is None:
+        return None
+
+    if balance > max_amount:
+        return balance - avg_amount
+    else:
+        return None
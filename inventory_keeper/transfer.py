@@ -0,0 +1,329 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import logging
+import threading
+import time
+from pprint import pformat
+from typing import Callable, Optional
+
+from web3 import Web3
+
+from inventory_keeper.metrics import record_transfer
+from inventory_keeper.shard import ShardCoordinator
+from pymaker import Address, Transact, eth_transfer
+from pymaker.numeric import Wad
+
+
+class Transfer:
+    """A transfer of `amount` of a token between the base account and a member, not sent yet."""
+    def __init__(self, transact: Transact, amount: Wad):
+        assert(isinstance(transact, Transact))
+        assert(isinstance(amount, Wad))
+
+        self.transact = transact
+        self.amount = amount
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
+class PendingTransfer:
+    def __init__(self, member_name: str, token_name: str, token_address: Optional[Address], amount: Wad,
+                 deposit: bool, to_member_name: Optional[str] = None):
+        assert(isinstance(member_name, str))
+        assert(isinstance(token_name, str))
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(amount, Wad))
+        assert(isinstance(deposit, bool))
+        assert(isinstance(to_member_name, str) or (to_member_name is None))
+        assert(not (deposit and to_member_name is not None))
+
+        self.member_name = member_name
+        self.to_member_name = to_member_name
+        self.token_name = token_name
+        self.token_address = token_address
+        self.amount = amount
+        self.deposit = deposit
+        self.nonce = None
+        self.block_number = None
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
+class TransferPipeline:
+    """Sends transfers without waiting for their receipts.
+
+    Each transfer gets a nonce assigned locally from a sequential counter kept per sender,
+    so a number of transfers can be waiting for confirmation at the same time. Receipts are
+    awaited in background threads. If a transfer fails before being sent while transfers with
+    later nonces have been sent already, its nonce gets used by a zero-value transfer to the sender
+    itself, as otherwise the later transfers would never get mined.
+
+    The pipeline remembers amounts of all transfers which have been sent but not yet reflected
+    in balances read at a given block, so the next cycle can take them into account instead
+    of sending the same transfer again.
+
+    If `coordinator` is specified, nonces and amounts being deposited are shared with other
+    keeper processes through it, instead of being kept in memory.
+
+    Attributes:
+        web3: An instance of `Web3`.
+        max_pending: Maximum number of transfers waiting for their receipts at the same time.
+        coordinator: Optional `ShardCoordinator`.
+        on_confirmed: Optional function called with each `PendingTransfer` which got confirmed, before
+            `unconfirmed()` stops reporting it.
+    """
+
+    logger = logging.getLogger('transfer-pipeline')
+
+    def __init__(self, web3: Web3, max_pending: int = 16, coordinator: Optional[ShardCoordinator] = None,
+                 on_confirmed: Optional[Callable] = None):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(max_pending, int))
+        assert(isinstance(coordinator, ShardCoordinator) or (coordinator is None))
+        assert(callable(on_confirmed) or (on_confirmed is None))
+
+        self.web3 = web3
+        self.max_pending = max_pending
+        self.coordinator = coordinator
+        self.on_confirmed = on_confirmed
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_pending)
+        self._nonces = {}
+        self._gaps = {}
+        self._pending = []
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def submit(self, from_address: Address, member_name: str, token_name: str, token_address: Optional[Address],
+               deposit: bool, transfer: Transfer, to_member_name: Optional[str] = None,
+               **kwargs) -> concurrent.futures.Future:
+        """Sends a transfer from `from_address` and tracks its receipt in the background.
+
+        If `to_member_name` is specified, the transfer is a withdrawal from `member_name` which goes
+        straight to `to_member_name` instead of the base account. Any extra keyword arguments are passed
+        to `Transact.transact()`.
+
+        Returns:
+            Future which will resolve to the transaction receipt, or `None` if it failed.
+        """
+        assert(isinstance(from_address, Address))
+        assert(isinstance(transfer, Transfer))
+
+        pending_transfer = PendingTransfer(member_name, token_name, token_address, transfer.amount, deposit,
+                                           to_member_name)
+
+        if self.coordinator is not None:
+            # the coordinator lock is always taken before the pipeline lock, never the other way round
+            def transaction_count(block):
+                return self.web3.eth.getTransactionCount(from_address.address, block)
+
+            pending_transfer.nonce = self.coordinator.next_nonce(from_address, transaction_count)
+            if deposit and token_address is not None:
+                self.coordinator.reserve(from_address, token_address, transfer.amount, pending_transfer.nonce)
+
+            with self._lock:
+                self._pending.append(pending_transfer)
+        else:
+            with self._lock:
+                pending_transfer.nonce = self._next_nonce(from_address)
+                self._pending.append(pending_transfer)
+
+        future = self._executor.submit(self._execute, from_address, pending_transfer, transfer, kwargs)
+
+        with self._lock:
+            self._futures = [future for future in self._futures if not future.done()] + [future]
+
+        return future
+
+    def in_flight(self, member_name: str, token_name: str, block_number: int) -> Wad:
+        """Returns the amount of `token_name` on its way to a member, not yet reflected in its balance.
+
+        Transfers which have not been confirmed yet, or have been confirmed in a block newer than
+        `block_number` (the block the member balance has been read at), are on their way.
+        Withdrawals which are on their way from that member are subtracted, so the result
+        may be negative. Transfers confirmed at or before `block_number` are forgotten.
+        """
+        assert(isinstance(member_name, str))
+        assert(isinstance(token_name, str))
+        assert(isinstance(block_number, int))
+
+        with self._lock:
+            self._pending = [pending_transfer for pending_transfer in self._pending
+                             if pending_transfer.block_number is None or pending_transfer.block_number > block_number]
+
+            result = Wad(0)
+            for pending_transfer in self._pending:
+                if pending_transfer.token_name != token_name:
+                    continue
+
+                if pending_transfer.member_name == member_name:
+                    if pending_transfer.deposit:
+                        result = result + pending_transfer.amount
+                    else:
+                        result = result - pending_transfer.amount
+                elif pending_transfer.to_member_name == member_name:
+                    result = result + pending_transfer.amount
+
+            return result
+
+    def unconfirmed(self, member_name: str, token_name: str) -> bool:
+        """Returns `True` if some transfers of `token_name` to or from a member have not been confirmed yet."""
+        assert(isinstance(member_name, str))
+        assert(isinstance(token_name, str))
+
+        with self._lock:
+            return any(member_name in (pending_transfer.member_name, pending_transfer.to_member_name)
+                       and pending_transfer.token_name == token_name
+                       and pending_transfer.block_number is None for pending_transfer in self._pending)
+
+    def pending_outgoing(self, token_address: Optional[Address], block_number: Optional[int]) -> Wad:
+        """Returns the amount of a token being deposited to members, which is still held by the sender.
+
+        `block_number` is the block the balance of the sender has been read at, or `None` if it is not known,
+        in which case deposits which have been confirmed already might still be included.
+        """
+        assert(isinstance(token_address, Address) or (token_address is None))
+        assert(isinstance(block_number, int) or (block_number is None))
+
+        if token_address is None:
+            return Wad(0)
+
+        if self.coordinator is not None:
+            return self.coordinator.reserved(token_address, block_number)
+
+        with self._lock:
+            return sum((pending_transfer.amount for pending_transfer in self._pending
+                        if pending_transfer.deposit
+                        and (pending_transfer.block_number is None
+                             or (block_number is not None and pending_transfer.block_number > block_number))
+                        and pending_transfer.token_address == token_address), Wad(0))
+
+    def wait(self):
+        """Waits until all transfers sent so far get their receipts."""
+        with self._lock:
+            futures = list(self._futures)
+
+        concurrent.futures.wait(futures)
+
+    def _next_nonce(self, from_address: Address) -> int:
+        # gaps which could not be filled are used first, so transfers waiting behind them can get mined
+        if len(self._gaps.get(from_address, [])) > 0:
+            return self._gaps[from_address].pop(0)
+
+        if from_address not in self._nonces:
+            self._nonces[from_address] = self.web3.eth.getTransactionCount(from_address.address, 'pending')
+
+        nonce = self._nonces[from_address]
+        self._nonces[from_address] = nonce + 1
+        return nonce
+
+    def _never_sent(self, from_address: Address, nonce: int) -> bool:
+        # nonce requests go to the same node transactions are sent to, so if a transaction with
+        # this nonce has been sent, it is included in the count of pending transactions
+        try:
+            return self.web3.eth.getTransactionCount(from_address.address, 'pending') <= nonce
+        except Exception as e:
+            self.logger.warning(f"Failed to check if transaction with nonce #{nonce} has been sent,"
+                                f" not using that nonce again: {e}")
+            return False
+
+    def _fill_gap(self, from_address: Address, nonce: int, kwargs: dict) -> bool:
+        self.logger.info(f"Filling the gap left by nonce #{nonce} with a zero-value transfer")
+
+        try:
+            transact = eth_transfer(web3=self.web3, to=from_address, amount=Wad(0))
+            transact.nonce = nonce
+            receipt = transact.transact(from_address=from_address, **kwargs)
+        except Exception as e:
+            self.logger.warning(f"Failed to fill the gap left by nonce #{nonce}: {e}")
+            receipt = None
+
+        return receipt is not None
+
+    def _execute(self, from_address: Address, pending_transfer: PendingTransfer, transfer: Transfer, kwargs: dict):
+        action = "deposit" if pending_transfer.deposit else "withdraw"
+        direction = "to" if pending_transfer.deposit else "from"
+        destination = f" to '{pending_transfer.to_member_name}'" if pending_transfer.to_member_name else ""
+
+        started_at = time.time()
+        try:
+            # If the gas price strategy raises the gas price while waiting for the receipt,
+            # the transaction gets replaced using the same nonce, so it does not get duplicated.
+            transfer.transact.nonce = pending_transfer.nonce
+            receipt = transfer.transact.transact(from_address=from_address, **kwargs)
+        except Exception as e:
+            self.logger.warning(f"Failed to {action} {pending_transfer.token_name} {direction}"
+                                f" '{pending_transfer.member_name}'{destination}: {e}")
+            receipt = None
+
+        # a transaction we have not got the receipt of might still get mined, so its nonce
+        # and its reservation are only given up if it has provably never been sent
+        never_sent = receipt is None and self._never_sent(from_address, pending_transfer.nonce)
+        gap = False
+
+        with self._lock:
+            if receipt is not None and receipt.successful:
+                pending_transfer.block_number = receipt.block_number
+                if self.on_confirmed is not None:
+                    self.on_confirmed(pending_transfer)
+            else:
+                self._pending.remove(pending_transfer)
+
+                if self.coordinator is None:
+                    if never_sent and self._nonces.get(from_address, 0) > pending_transfer.nonce + 1:
+                        gap = True
+                    else:
+                        # The nonce might have not been used, so we read it again from the node
+                        # instead of leaving a gap in the sequence.
+                        self._nonces.pop(from_address, None)
+
+        if self.coordinator is not None:
+            if pending_transfer.deposit and pending_transfer.token_address is not None:
+                if receipt is not None and receipt.successful:
+                    self.coordinator.confirm(from_address, pending_transfer.nonce, receipt.block_number)
+                elif receipt is not None or never_sent:
+                    self.coordinator.release(from_address, pending_transfer.nonce)
+
+            if never_sent:
+                gap = not self.coordinator.rewind_nonce(from_address, pending_transfer.nonce)
+
+        # if the gap can not be filled now, the nonce gets used by the next transfer
+        if gap and not self._fill_gap(from_address, pending_transfer.nonce, kwargs):
+            if self.coordinator is not None:
+                self.coordinator.release_nonce(from_address, pending_transfer.nonce)
+            else:
+                with self._lock:
+                    self._gaps.setdefault(from_address, []).append(pending_transfer.nonce)
+
+        record_transfer(pending_transfer.member_name, pending_transfer.token_name, pending_transfer.deposit,
+                        time.time() - started_at, receipt is not None and receipt.successful)
+        if pending_transfer.to_member_name is not None:
+            record_transfer(pending_transfer.to_member_name, pending_transfer.token_name, True,
+                            time.time() - started_at, receipt is not None and receipt.successful)
+
+        if receipt is not None and receipt.successful:
+            self.logger.info(f"Successfully {'deposited' if pending_transfer.deposit else 'withdrawn'}"
+                             f" {pending_transfer.amount} {pending_transfer.token_name} {direction}"
+                             f" '{pending_transfer.member_name}'{destination}")
+        elif receipt is not None:
+            self.logger.warning(f"Failed to {action} {pending_transfer.token_name} {direction}"
+                                f" '{pending_transfer.member_name}'{destination}")
+
+        return receipt
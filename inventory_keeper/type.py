@@ -15,327 +15,102 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import logging
+import threading
 
-from retry import retry
 from web3 import Web3
 
-from pyexchange.bibox import BiboxApi
-from pyexchange.gateio import GateIOApi
-from pyexchange.okex import OKEXApi
-from pymaker import Address, eth_transfer
-from pymaker.etherdelta import EtherDelta
+from inventory_keeper.batch import RAW_ETH, BalanceQuery, BalanceReader
+from inventory_keeper.transfer import TransferPipeline
+from pymaker import Address
 from pymaker.numeric import Wad
-from pymaker.oasis import MatchingMarket
-from pymaker.token import ERC20Token
-from pymaker.util import eth_balance
 
-RAW_ETH = Address('0x0000000000000000000000000000000000000000')
 
+class MissingTokenError(Exception):
+    """Raised if a member has been read successfully, but the response has no balance of a token."""
+    pass
 
-def consistent_read(func):
-    while True:
-        balance_1 = func()
-        balance_2 = func()
-        if balance_1 == balance_2:
-            return balance_1
 
+class ExchangeBalances:
+    """Balances of a single exchange account, fetched at most once per cycle.
 
-class EthereumAccount:
-    def __init__(self, web3: Web3, address: Address):
-        self.web3 = web3
-        self.address = address
+    Exchange APIs return balances of all tokens in one response, so the response is kept
+    until `invalidate()` is called and all per-token lookups are served from it. A failed
+    fetch is remembered as well, so the remaining tokens do not retry it again in the same cycle.
+    """
+    def __init__(self, fetch_func):
+        assert(callable(fetch_func))
 
-    def balance(self, token_name: str, token_address: Address) -> Wad:
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
+        self.fetch_func = fetch_func
+        self._balances = None
+        self._error = None
+        self._lock = threading.Lock()
 
-        if token_address is None:
-            return Wad(0)
-        elif token_address == RAW_ETH:
-            return eth_balance(self.web3, self.address)
-        else:
-            return ERC20Token(web3=self.web3, address=token_address).balance_of(self.address)
+    def get(self):
+        with self._lock:
+            if self._balances is None and self._error is None:
+                try:
+                    self._balances = self.fetch_func()
+                except Exception as e:
+                    self._error = e
 
+            if self._error is not None:
+                raise self._error
 
-class BaseAccount(EthereumAccount):
-    def __init__(self, web3: Web3, address: Address, min_eth_balance: Wad):
-        assert(isinstance(min_eth_balance, Wad))
+            return self._balances
 
-        super(BaseAccount, self).__init__(web3, address)
-        self.min_eth_balance = min_eth_balance
+    def invalidate(self):
+        with self._lock:
+            self._balances = None
+            self._error = None
 
 
-class OasisMarketMakerKeeper:
-    def __init__(self, web3: Web3, otc: MatchingMarket, address: Address):
+class EthereumAccount:
+    def __init__(self, web3: Web3, address: Address, balance_reader: BalanceReader):
+        assert(isinstance(balance_reader, BalanceReader))
+
         self.web3 = web3
-        self.otc = otc
         self.address = address
+        self.balance_reader = balance_reader
 
-    def _oasis_balance(self, token: Address):
-        assert(isinstance(token, Address))
-
-        # In order to calculate Oasis market maker keeper balance, we have add the balance
-        # locked in keeper's open orders...
-        our_orders = self.otc.get_orders_by_maker(self.address)
-        our_sell_orders = filter(lambda order: order.pay_token == token, our_orders)
-        balance_in_our_sell_orders = sum(map(lambda order: order.pay_amount, our_sell_orders), Wad(0))
-
-        # ...and the balance left in the keeper accounnt
-        balance_in_account = ERC20Token(web3=self.web3, address=token).balance_of(self.address)
-
-        return balance_in_our_sell_orders + balance_in_account
-
-    def balance(self, token_name: str, token_address: Address) -> Wad:
-        assert(isinstance(token_name, str))
+    def balance_queries(self, token_address: Address) -> list:
         assert(isinstance(token_address, Address) or (token_address is None))
 
-        if token_address == RAW_ETH:
-            return eth_balance(self.web3, self.address)
-        else:
-            return consistent_read(lambda: self._oasis_balance(token_address))
-
-    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        if token_address == RAW_ETH:
-            max_amount = base.balance(token_name, token_address) - base.min_eth_balance
-            final_amount = min(amount, max_amount)
-
-            if final_amount > Wad(0):
-                return eth_transfer(web3=self.web3, to=self.address, amount=final_amount) \
-                    .transact(from_address=base.address) \
-                    .successful
-            else:
-                raise Exception("No ETH left in the base account")
-        else:
-            max_amount = base.balance(token_name, token_address)
-            final_amount = min(amount, max_amount)
-
-            if final_amount > Wad(0):
-                return ERC20Token(web3=self.web3, address=token_address).transfer(self.address, final_amount) \
-                    .transact(from_address=base.address) \
-                    .successful
-            else:
-                raise Exception(f"No {token_name} left in the base account")
-
-    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        if token_address == RAW_ETH:
-            raise Exception(f"ETH withdrawals from OasisDEX are not supported")
+        if token_address is None:
+            return []
         else:
-            return ERC20Token(web3=self.web3, address=token_address).transfer_from(self.address, base.address, amount) \
-                .transact(from_address=base.address) \
-                .successful
+            return [BalanceQuery(token_address, self.address)]
 
-
-class EtherDeltaMarketMakerKeeper:
-    def __init__(self, web3: Web3, etherdelta: EtherDelta, address: Address):
-        self.web3 = web3
-        self.etherdelta = etherdelta
-        self.address = address
+    def watched_addresses(self) -> list:
+        return [self.address]
 
     def balance(self, token_name: str, token_address: Address) -> Wad:
         assert(isinstance(token_name, str))
         assert(isinstance(token_address, Address) or (token_address is None))
 
-        if token_address == RAW_ETH:
-            return eth_balance(self.web3, self.address) + self.etherdelta.balance_of(self.address)
-        else:
-            return ERC20Token(self.web3, token_address).balance_of(self.address) \
-                   + self.etherdelta.balance_of_token(token_address, self.address)
-
-    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        if token_address == RAW_ETH:
-            max_amount = base.balance(token_name, token_address) - base.min_eth_balance
-            final_amount = min(amount, max_amount)
-
-            if final_amount > Wad(0):
-                return eth_transfer(web3=self.web3, to=self.address, amount=final_amount) \
-                    .transact(from_address=base.address) \
-                    .successful
-            else:
-                raise Exception("No ETH left in the base account")
+        if token_address is None:
+            return Wad(0)
         else:
-            max_amount = base.balance(token_name, token_address)
-            final_amount = min(amount, max_amount)
-
-            if final_amount > Wad(0):
-                return ERC20Token(web3=self.web3, address=token_address).transfer(self.address, final_amount) \
-                    .transact(from_address=base.address) \
-                    .successful
-            else:
-                raise Exception(f"No {token_name} left in the base account")
-
-    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        raise Exception(f"Withdrawals from EtherDelta not supported")
+            return self.balance_reader.balance_of(BalanceQuery(token_address, self.address))
 
 
-class RadarRelayMarketMakerKeeper(EthereumAccount):
-    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        if token_address == RAW_ETH:
-            max_amount = base.balance(token_name, token_address) - base.min_eth_balance
-            final_amount = min(amount, max_amount)
-
-            if final_amount > Wad(0):
-                return eth_transfer(web3=self.web3, to=self.address, amount=final_amount) \
-                    .transact(from_address=base.address) \
-                    .successful
-            else:
-                raise Exception("No ETH left in the base account")
-        else:
-            max_amount = base.balance(token_name, token_address)
-            final_amount = min(amount, max_amount)
+class BaseAccount(EthereumAccount):
+    def __init__(self, web3: Web3, address: Address, balance_reader: BalanceReader, min_eth_balance: Wad,
+                 transfer_pipeline: TransferPipeline):
+        assert(isinstance(min_eth_balance, Wad))
+        assert(isinstance(transfer_pipeline, TransferPipeline))
 
-            if final_amount > Wad(0):
-                return ERC20Token(web3=self.web3, address=token_address).transfer(self.address, final_amount) \
-                    .transact(from_address=base.address) \
-                    .successful
-            else:
-                raise Exception(f"No {token_name} left in the base account")
+        super(BaseAccount, self).__init__(web3, address, balance_reader)
+        self.min_eth_balance = min_eth_balance
+        self.transfer_pipeline = transfer_pipeline
 
-    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
+    def available_balance(self, token_name: str, token_address: Address) -> Wad:
+        """Returns the balance which can be deposited to members, taking pending deposits into account."""
         assert(isinstance(token_name, str))
         assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
 
+        result = self.balance(token_name, token_address) - \
+                 self.transfer_pipeline.pending_outgoing(token_address, self.balance_reader.pinned_block())
         if token_address == RAW_ETH:
-            raise Exception(f"ETH withdrawals from RadarRelay are not supported")
-        else:
-            return ERC20Token(web3=self.web3, address=token_address).transfer_from(self.address, base.address, amount) \
-                .transact(from_address=base.address) \
-                .successful
-
-
-class BiboxMarketMakerKeeper:
-    def __init__(self, web3: Web3, bibox_api: BiboxApi):
-        assert(isinstance(web3, Web3))
-        assert(isinstance(bibox_api, BiboxApi))
-
-        self.web3 = web3
-        self.bibox_api = bibox_api
-
-    @retry(tries=5, delay=0.5, backoff=1.5, logger=logging.getLogger())
-    def balance(self, token_name: str, token_address: Address) -> Wad:
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-
-        all_balances = self.bibox_api.coin_list(retry=True)
-        token_balance = next(filter(lambda coin: coin['symbol'] == token_name, all_balances))
-        return Wad.from_number(token_balance['totalBalance'])
-
-    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        raise Exception(f"Deposits to Bibox not supported")
-
-    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        raise Exception(f"Withdrawals from Bibox not supported")
-
-
-class OkexMarketMakerKeeper:
-    def __init__(self, web3: Web3, okex_api: OKEXApi):
-        assert(isinstance(web3, Web3))
-        assert(isinstance(okex_api, OKEXApi))
-
-        self.web3 = web3
-        self.okex_api = okex_api
-
-    @retry(tries=5, delay=0.5, backoff=1.5, logger=logging.getLogger())
-    def balance(self, token_name: str, token_address: Address) -> Wad:
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-
-        balances = self.okex_api.get_balances()
-
-        return Wad.from_number(balances['free'][token_name.lower()]) + \
-               Wad.from_number(balances['freezed'][token_name.lower()])
-
-    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        raise Exception(f"Deposits to OKEX not supported")
-
-    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        raise Exception(f"Withdrawals from OKEX not supported")
-
-
-class GateIOMarketMakerKeeper:
-    def __init__(self, web3: Web3, gateio_api: GateIOApi):
-        assert(isinstance(web3, Web3))
-        assert(isinstance(gateio_api, GateIOApi))
-
-        self.web3 = web3
-        self.gateio_api = gateio_api
-
-    @retry(tries=5, delay=0.5, backoff=1.5, logger=logging.getLogger())
-    def balance(self, token_name: str, token_address: Address) -> Wad:
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-
-        balances = self.gateio_api.get_balances()
-
-        result = Wad(0)
-        if 'available' in balances:
-            if token_name.upper() in balances['available']:
-                result += Wad.from_number(balances['available'][token_name.upper()])
-        if 'locked' in balances:
-            if token_name.upper() in balances['locked']:
-                result += Wad.from_number(balances['locked'][token_name.upper()])
+            result = result - self.min_eth_balance
 
         return result
-
-    def deposit(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        raise Exception(f"Deposits to Gate.io not supported")
-
-    def withdraw(self, base: BaseAccount, token_name: str, token_address: Address, amount: Wad) -> bool:
-        assert(isinstance(base, BaseAccount))
-        assert(isinstance(token_name, str))
-        assert(isinstance(token_address, Address) or (token_address is None))
-        assert(isinstance(amount, Wad))
-
-        raise Exception(f"Withdrawals from Gate.io not supported")
@@ -0,0 +1,149 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from typing import Optional, Tuple
+
+from web3 import Web3
+
+from inventory_keeper.batch import RAW_ETH, batch_request
+
+TRANSFER = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+# marks an address which has sent a transaction itself, so any of its balances might have changed
+ALL_TOKENS = '*'
+
+
+def _topic_address(topic: str) -> str:
+    return '0x' + topic[-40:].lower()
+
+
+class BlockWatcher:
+    """Finds out which balances might have changed in new blocks.
+
+    Each call to `changes()` processes all blocks mined since the previous call. A balance
+    of an address is considered changed if it has been a sender or a recipient of an ERC20
+    `Transfer` event of one of the tokens, or a sender or a recipient of a transaction
+    carrying ETH. All transactions in a block, together with all `Transfer` events, are read
+    with a single JSON-RPC batch request.
+
+    ETH sent by contracts (internal transactions) can not be detected this way.
+
+    Attributes:
+        web3: An instance of `Web3`.
+        max_block_gap: Maximum number of blocks processed at once. If more blocks have been
+            mined since the previous call, they are not processed and all balances should be
+            read again instead.
+    """
+
+    logger = logging.getLogger('block-watcher')
+
+    def __init__(self, web3: Web3, max_block_gap: int = 20):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(max_block_gap, int))
+
+        self.web3 = web3
+        self.max_block_gap = max_block_gap
+        self.last_block = None
+
+    def changes(self, addresses: set, token_addresses: list) -> Tuple[int, Optional[dict]]:
+        """Returns the most recent block number, and balances changed since the previous call.
+
+        Args:
+            addresses: Set of watched addresses, as lowercase hex strings.
+            token_addresses: List of `Address` objects of watched ERC20 tokens.
+
+        Returns:
+            A tuple of the most recent block number and a `dict` keyed by the watched addresses
+            whose balances might have changed. Each value is a set of lowercase token addresses,
+            with the `0x00..00` address standing for ETH. If the address has sent a transaction
+            itself, the set contains `ALL_TOKENS`. Instead of the `dict`, `None` is returned on
+            the first call or if too many blocks have been mined since the previous call.
+        """
+        assert(isinstance(addresses, set))
+        assert(isinstance(token_addresses, list))
+
+        block_number = self.web3.eth.blockNumber
+        from_block = self.last_block + 1 if self.last_block is not None else None
+
+        if from_block is None or block_number - from_block >= self.max_block_gap:
+            self.last_block = block_number
+            return block_number, None
+
+        result = {}
+        if from_block <= block_number:
+            token_addresses = [token_address.address for token_address in token_addresses if token_address != RAW_ETH]
+
+            calls = [("eth_getBlockByNumber", [hex(number), True]) for number in range(from_block, block_number + 1)]
+            if len(token_addresses) > 0:
+                calls.append(("eth_getLogs", [{'fromBlock': hex(from_block),
+                                               'toBlock': hex(block_number),
+                                               'address': token_addresses,
+                                               'topics': [TRANSFER]}]))
+
+            responses = batch_request(self.web3, calls)
+            blocks = responses[:block_number - from_block + 1]
+            logs = responses[block_number - from_block + 1] if len(token_addresses) > 0 else []
+
+            self._process_transactions(blocks, addresses, result)
+            self._process_logs(logs, addresses, result)
+
+            self.logger.debug(f"Processed blocks #{from_block}-#{block_number},"
+                              f" balances of {len(result)} watched addresses might have changed")
+
+        self.last_block = block_number
+        return block_number, result
+
+    @staticmethod
+    def _process_transactions(blocks: list, addresses: set, result: dict):
+        eth = RAW_ETH.address.lower()
+
+        for block in blocks:
+            if block is None:
+                raise Exception("Block not available yet")
+
+            for transaction in block['transactions']:
+                sender = transaction['from'].lower()
+                recipient = transaction['to'].lower() if transaction['to'] else None
+
+                if sender in addresses:
+                    result.setdefault(sender, set()).add(ALL_TOKENS)
+
+                if recipient in addresses and int(transaction['value'], 16) > 0:
+                    result.setdefault(recipient, set()).add(eth)
+
+    @staticmethod
+    def _process_logs(logs: list, addresses: set, result: dict):
+        # all tokens moved in a single transaction are grouped together, as a transaction
+        # touching one of the watched addresses may change its balances held elsewhere
+        tokens_by_transaction = {}
+        addresses_by_transaction = {}
+        for log in logs:
+            if len(log['topics']) < 3:
+                continue
+
+            transaction_hash = log['transactionHash']
+            tokens_by_transaction.setdefault(transaction_hash, set()).add(log['address'].lower())
+
+            for topic in log['topics'][1:3]:
+                address = _topic_address(topic)
+                if address in addresses:
+                    addresses_by_transaction.setdefault(transaction_hash, set()).add(address)
+
+        for transaction_hash, transaction_addresses in addresses_by_transaction.items():
+            for address in transaction_addresses:
+                result.setdefault(address, set()).update(tokens_by_transaction[transaction_hash])
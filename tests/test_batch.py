@@ -0,0 +1,88 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from inventory_keeper.batch import BalanceQuery, BalanceReader, ERC20_BALANCE_OF, LEDGER_BALANCE_OF, RAW_ETH
+from pymaker import Address
+
+
+def word(value: int) -> str:
+    return hex(value)[2:].rjust(64, '0')
+
+
+TOKEN = Address('0x1111111111111111111111111111111111111111')
+OWNER = Address('0x2222222222222222222222222222222222222222')
+LEDGER = Address('0x3333333333333333333333333333333333333333')
+
+
+class TestBalanceReaderEncoding:
+    def setup_method(self):
+        # encoding does not need a node, so the reader is created without connecting to one
+        self.reader = BalanceReader.__new__(BalanceReader)
+
+    def test_should_encode_erc20_and_ledger_balance_calls(self):
+        # expect
+        assert self.reader._call_data(BalanceQuery(TOKEN, OWNER)) == ERC20_BALANCE_OF + ('22' * 20).rjust(64, '0')
+        assert self.reader._call_data(BalanceQuery(TOKEN, OWNER, LEDGER)) == \
+            LEDGER_BALANCE_OF + ('11' * 20).rjust(64, '0') + ('22' * 20).rjust(64, '0')
+        assert self.reader._call_target(BalanceQuery(TOKEN, OWNER, LEDGER)) == LEDGER
+        assert self.reader._call_target(BalanceQuery(TOKEN, OWNER)) == TOKEN
+
+    def test_should_encode_aggregate_calls(self):
+        # given
+        balance_of = ERC20_BALANCE_OF + ('22' * 20).rjust(64, '0')
+        calls = [(TOKEN, balance_of), (LEDGER, '4d2301cc')]
+
+        # when
+        encoded = self.reader._encode_aggregate(calls)
+
+        # then
+        assert encoded == word(0x20) + word(2) + \
+            word(0x40) + word(0xe0) + \
+            ('11' * 20).rjust(64, '0') + word(0x40) + word(36) + balance_of.ljust(128, '0') + \
+            ('33' * 20).rjust(64, '0') + word(0x40) + word(4) + '4d2301cc'.ljust(64, '0')
+
+    def test_should_encode_empty_aggregate(self):
+        assert self.reader._encode_aggregate([]) == word(0x20) + word(0)
+
+    def test_should_decode_aggregate_response(self):
+        # given
+        response = '0x' + word(5) + word(0x40) + \
+            word(3) + word(0x60) + word(0xa0) + word(0xc0) + \
+            word(32) + word(7) + \
+            word(0) + \
+            word(2) + 'abcd'.ljust(64, '0')
+
+        # when
+        result = BalanceReader._decode_aggregate(response)
+
+        # then
+        assert result == [(7).to_bytes(32, 'big'), b'', bytes.fromhex('abcd')]
+
+    def test_should_decode_aggregate_response_as_bytes(self):
+        # given
+        response = bytes.fromhex(word(5) + word(0x40) + word(1) + word(0x20) + word(32) + word(42))
+
+        # expect
+        assert BalanceReader._decode_aggregate(response) == [(42).to_bytes(32, 'big')]
+
+
+class TestBalanceQuery:
+    def test_should_compare_by_token_owner_and_ledger(self):
+        assert BalanceQuery(TOKEN, OWNER) == BalanceQuery(TOKEN, OWNER)
+        assert BalanceQuery(TOKEN, OWNER) != BalanceQuery(TOKEN, OWNER, LEDGER)
+        assert BalanceQuery(RAW_ETH, OWNER) != BalanceQuery(TOKEN, OWNER)
+        assert len({BalanceQuery(TOKEN, OWNER), BalanceQuery(TOKEN, OWNER)}) == 1
@@ -0,0 +1,166 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from inventory_keeper import breaker
+from inventory_keeper.breaker import CircuitBreaker, CircuitBreakers, CircuitOpenError
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def failing():
+    raise Exception("Backend is down")
+
+
+class TestCircuitBreaker:
+    def setup_method(self):
+        self.time = FakeTime()
+        self.breaker = CircuitBreaker('backend', threshold=3, backoff=10.0, max_backoff=30.0)
+
+    @pytest.fixture(autouse=True)
+    def fake_time(self, monkeypatch):
+        monkeypatch.setattr(breaker, 'time', self.time)
+
+    def fail(self, times: int):
+        for _ in range(times):
+            with pytest.raises(Exception, match="Backend is down"):
+                self.breaker.call(failing)
+
+    def test_should_stay_closed_below_threshold(self):
+        # when
+        self.fail(2)
+
+        # then
+        assert not self.breaker.is_open()
+        assert self.breaker.call(lambda: 42) == 42
+
+    def test_should_reset_failure_count_after_success(self):
+        # when
+        self.fail(2)
+        self.breaker.call(lambda: 42)
+        self.fail(2)
+
+        # then
+        assert not self.breaker.is_open()
+
+    def test_should_open_after_threshold_and_reject_calls(self):
+        # given
+        calls = []
+
+        # when
+        self.fail(3)
+
+        # then
+        assert self.breaker.is_open()
+        with pytest.raises(CircuitOpenError):
+            self.breaker.call(lambda: calls.append(1))
+        assert calls == []
+
+    def test_should_let_a_single_probe_through_after_backoff(self):
+        # given
+        self.fail(3)
+        self.time.now += 10.0
+
+        # expect
+        assert self.breaker.allow()
+        assert not self.breaker.allow()
+
+    def test_should_close_after_successful_probe(self):
+        # given
+        self.fail(3)
+        self.time.now += 10.0
+
+        # when
+        assert self.breaker.call(lambda: 42) == 42
+
+        # then
+        assert not self.breaker.is_open()
+        assert self.breaker.allow()
+
+    def test_should_double_backoff_after_failed_probe_up_to_maximum(self):
+        # given
+        self.fail(3)
+
+        # when
+        self.time.now += 10.0
+        self.fail(1)
+
+        # then
+        self.time.now += 19.0
+        assert not self.breaker.allow()
+        self.time.now += 1.0
+        assert self.breaker.allow()
+
+        # when
+        self.breaker.failed()
+
+        # then
+        self.time.now += 29.0
+        assert not self.breaker.allow()
+        self.time.now += 1.0
+        assert self.breaker.allow()
+
+    def test_should_not_count_open_breakers_of_other_backends(self):
+        # given
+        self.fail(3)
+        self.time.now += 10.0
+
+        # when
+        def dependency_open():
+            raise CircuitOpenError("Other backend is failing")
+
+        with pytest.raises(CircuitOpenError):
+            self.breaker.call(dependency_open)
+
+        # then
+        assert self.breaker.allow()
+
+    def test_should_release_probe_without_recording_outcome(self):
+        # given
+        self.fail(3)
+        self.time.now += 10.0
+        assert self.breaker.allow()
+
+        # when
+        self.breaker.release()
+
+        # then
+        assert self.breaker.is_open()
+        assert self.breaker.allow()
+
+
+class TestCircuitBreakers:
+    def test_should_create_one_breaker_per_key(self):
+        # given
+        breakers = CircuitBreakers(threshold=2, backoff=5.0, max_backoff=50.0)
+
+        # when
+        first = breakers.get(('member', 'a'), "Member 'a'")
+
+        # then
+        assert breakers.get(('member', 'a'), "Member 'a'") is first
+        assert breakers.get(('member', 'b'), "Member 'b'") is not first
+        assert first.threshold == 2
+        assert first.backoff == 5.0
+        assert first.max_backoff == 50.0
@@ -0,0 +1,77 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from inventory_keeper.forecast import BurnRateForecaster
+from pymaker.numeric import Wad
+
+
+def forecaster() -> BurnRateForecaster:
+    return BurnRateForecaster(window=3600.0, horizon=600.0, lead_time=60.0)
+
+
+class TestBurnRateForecaster:
+    def test_should_not_have_burn_rate_without_enough_samples(self):
+        # given
+        burn_rate_forecaster = forecaster()
+        burn_rate_forecaster.observe('Oasis', 'DAI', 0.0, Wad.from_number(100))
+        burn_rate_forecaster.observe('Oasis', 'DAI', 10.0, Wad.from_number(90))
+
+        # expect
+        assert burn_rate_forecaster.burn_rate('Oasis', 'DAI') is None
+
+    def test_should_use_net_flow_of_oscillating_balance(self):
+        # given
+        burn_rate_forecaster = forecaster()
+        for index, balance in enumerate([100, 50, 100, 50, 100, 50, 90]):
+            burn_rate_forecaster.observe('Oasis', 'DAI', index * 10.0, Wad.from_number(balance))
+
+        # expect
+        assert burn_rate_forecaster.burn_rate('Oasis', 'DAI') == 10 / 60
+
+    def test_should_clamp_burn_rate_at_zero_if_balance_grows(self):
+        # given
+        burn_rate_forecaster = forecaster()
+        for index, balance in enumerate([100, 50, 120]):
+            burn_rate_forecaster.observe('Oasis', 'DAI', index * 10.0, Wad.from_number(balance))
+
+        # expect
+        assert burn_rate_forecaster.burn_rate('Oasis', 'DAI') == 0.0
+
+    def test_should_leave_transfers_sent_by_keeper_out(self):
+        # given
+        burn_rate_forecaster = forecaster()
+        burn_rate_forecaster.observe('Oasis', 'DAI', 0.0, Wad.from_number(100))
+        burn_rate_forecaster.observe('Oasis', 'DAI', 10.0, Wad.from_number(80))
+
+        # when
+        burn_rate_forecaster.transferred('Oasis', 'DAI', Wad.from_number(50), incoming=True)
+        burn_rate_forecaster.observe('Oasis', 'DAI', 20.0, Wad.from_number(110))
+        burn_rate_forecaster.transferred('Oasis', 'DAI', Wad.from_number(30), incoming=False)
+        burn_rate_forecaster.observe('Oasis', 'DAI', 30.0, Wad.from_number(70))
+
+        # then
+        assert burn_rate_forecaster.burn_rate('Oasis', 'DAI') == 50 / 30
+
+    def test_should_keep_members_apart(self):
+        # given
+        burn_rate_forecaster = forecaster()
+        burn_rate_forecaster.transferred('Oasis', 'DAI', Wad.from_number(50), incoming=True)
+        for index, balance in enumerate([100, 90, 80]):
+            burn_rate_forecaster.observe('OKEX', 'DAI', index * 10.0, Wad.from_number(balance))
+
+        # expect
+        assert burn_rate_forecaster.burn_rate('OKEX', 'DAI') == 20 / 20
@@ -0,0 +1,139 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from inventory_keeper.config import Config
+from inventory_keeper.fetcher import FetchResult
+from inventory_keeper.history import HistoryReader, HistoryWriter, RECORD, SAMPLES_FILE, SeriesStats
+from inventory_keeper.snapshot import InventorySnapshot
+from pymaker.numeric import Wad
+
+CONFIG = Config({'tokens': {'DAI': '0x1111111111111111111111111111111111111111'},
+                 'base': {'name': 'base', 'address': '0x2222222222222222222222222222222222222222', 'minEthBalance': 0},
+                 'members': [{'name': 'oasis', 'type': 'oasis-market-maker-keeper', 'config': {},
+                              'tokens': {'DAI': {}}},
+                             {'name': 'okex', 'type': 'okex-market-maker-keeper', 'config': {},
+                              'tokens': {'DAI': {}}}]})
+
+
+def snapshot(timestamp: float, block_number: int, base: float, oasis: float, okex_error: bool = False):
+    okex = FetchResult(None, Exception("Failed"), None) if okex_error \
+        else FetchResult(Wad.from_number(oasis * 2), None, timestamp)
+
+    return InventorySnapshot(config=CONFIG,
+                             block_number=block_number,
+                             timestamp=timestamp,
+                             base_balances={'DAI': Wad.from_number(base)},
+                             members_balances=[[FetchResult(Wad.from_number(oasis), None, timestamp)], [okex]])
+
+
+class TestHistory:
+    def record(self, directory: str, count: int):
+        writer = HistoryWriter(directory)
+        for index in range(count):
+            writer.record(snapshot(1000.0 + index * 10, 100 + index, 50.0 + index, 10.0 + index))
+
+    def test_should_read_recorded_balances(self, tmpdir):
+        # given
+        directory = str(tmpdir)
+        self.record(directory, 3)
+
+        # when
+        with HistoryReader(directory) as reader:
+            series = reader.series
+            samples = list(reader.samples(reader.series_ids(accounts={'oasis'})))
+
+        # then
+        assert series == [('base', 'DAI'), ('oasis', 'DAI'), ('okex', 'DAI')]
+        assert [(sample.timestamp, sample.block_number, sample.balance) for sample in samples] == \
+            [(1000.0, 100, 10.0), (1010.0, 101, 11.0), (1020.0, 102, 12.0)]
+
+    def test_should_find_samples_in_time_range(self, tmpdir):
+        # given
+        directory = str(tmpdir)
+        self.record(directory, 100)
+
+        # when
+        with HistoryReader(directory) as reader:
+            samples = list(reader.samples(reader.series_ids(accounts={'base'}), start=1205.0, end=1250.0))
+
+        # then
+        assert [sample.timestamp for sample in samples] == [1210.0, 1220.0, 1230.0, 1240.0]
+
+    def test_should_not_record_failed_balances(self, tmpdir):
+        # given
+        directory = str(tmpdir)
+        HistoryWriter(directory).record(snapshot(1000.0, 100, 50.0, 10.0, okex_error=True))
+
+        # when
+        with HistoryReader(directory) as reader:
+            samples = list(reader.samples(reader.series_ids()))
+
+        # then
+        assert len(samples) == 2
+
+    def test_should_append_to_existing_history_and_keep_timestamps_ordered(self, tmpdir):
+        # given
+        directory = str(tmpdir)
+        self.record(directory, 2)
+
+        # when
+        HistoryWriter(directory).record(snapshot(900.0, 102, 1.0, 1.0))
+
+        # then
+        with HistoryReader(directory) as reader:
+            timestamps = [sample.timestamp for sample in reader.samples(reader.series_ids(accounts={'base'}))]
+
+        assert timestamps == [1000.0, 1010.0, 1010.0]
+
+    def test_should_remove_incomplete_record(self, tmpdir):
+        # given
+        directory = str(tmpdir)
+        self.record(directory, 2)
+        with open(os.path.join(directory, SAMPLES_FILE), 'ab') as file:
+            file.write(b'\x00' * (RECORD.size // 2))
+
+        # when
+        HistoryWriter(directory).record(snapshot(1020.0, 102, 52.0, 12.0))
+
+        # then
+        with HistoryReader(directory) as reader:
+            assert len(reader) == 9
+
+    def test_should_read_empty_history(self, tmpdir):
+        with HistoryReader(str(tmpdir)) as reader:
+            assert len(reader) == 0
+            assert list(reader.samples(reader.series_ids(), start=0.0, end=2000.0)) == []
+
+
+class TestSeriesStats:
+    def test_should_aggregate_samples(self, tmpdir):
+        # given
+        directory = str(tmpdir)
+        HistoryWriter(directory).record(snapshot(1000.0, 100, 50.0, 10.0))
+        HistoryWriter(directory).record(snapshot(1010.0, 101, 40.0, 30.0))
+
+        # when
+        stats = SeriesStats()
+        with HistoryReader(directory) as reader:
+            for sample in reader.samples(reader.series_ids(accounts={'oasis'})):
+                stats.add(sample)
+
+        # then
+        assert (stats.count, stats.minimum, stats.maximum, stats.mean) == (2, 10.0, 30.0, 20.0)
+        assert (stats.first, stats.last) == (10.0, 30.0)
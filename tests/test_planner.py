@@ -0,0 +1,108 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from inventory_keeper.config import Member, Token
+from inventory_keeper.planner import Requirement, TransferPlanner
+from pymaker import Address
+from pymaker.numeric import Wad
+
+DAI = Token('DAI', Address('0x1111111111111111111111111111111111111111'))
+
+
+class OnChainMember:
+    def deposit_address(self, token_address: Address) -> Address:
+        return Address('0x2222222222222222222222222222222222222222')
+
+    def withdraw_to(self, base, destination: Address, token_name: str, token_address: Address, amount: Wad):
+        pass
+
+
+class ContractMember:
+    pass
+
+
+class ExchangeMember:
+    supports_deposits = False
+
+
+def requirement(name: str, implementation, amount: int, deficit: bool, urgent: bool = False) -> Requirement:
+    member = Member({'name': name,
+                     'type': 'test',
+                     'config': {},
+                     'tokens': {'DAI': {}}}, {'DAI': DAI})
+    return Requirement(member, implementation, member.tokens[0], Wad.from_number(amount), deficit, urgent)
+
+
+class TestTransferPlanner:
+    def setup_method(self):
+        self.planner = TransferPlanner()
+
+    @staticmethod
+    def summary(plan: list) -> list:
+        return [(planned_transfer.source.member.name if planned_transfer.source else None,
+                 planned_transfer.destination.member.name if planned_transfer.destination else None,
+                 planned_transfer.amount) for planned_transfer in plan]
+
+    def test_should_move_surplus_directly_to_deficit(self):
+        # given
+        surplus = requirement('a', OnChainMember(), 10, deficit=False)
+        deficit = requirement('b', OnChainMember(), 4, deficit=True)
+
+        # when
+        plan = self.planner.plan([surplus, deficit], {'DAI': Wad.from_number(100)})
+
+        # then
+        assert self.summary(plan) == [('a', None, Wad.from_number(6)),
+                                      ('a', 'b', Wad.from_number(4))]
+
+    def test_should_withdraw_and_deposit_if_members_can_not_transfer_directly(self):
+        # given
+        surplus = requirement('a', ContractMember(), 10, deficit=False)
+        deficit = requirement('b', ContractMember(), 4, deficit=True)
+
+        # when
+        plan = self.planner.plan([surplus, deficit], {'DAI': Wad.from_number(100)})
+
+        # then
+        assert self.summary(plan) == [('a', None, Wad.from_number(10)),
+                                      (None, 'b', Wad.from_number(4))]
+
+    def test_should_limit_deposits_to_base_balance_serving_urgent_deficits_first(self):
+        # given
+        large = requirement('a', ContractMember(), 8, deficit=True)
+        urgent = requirement('b', ContractMember(), 3, deficit=True, urgent=True)
+
+        # when
+        plan = self.planner.plan([large, urgent], {'DAI': Wad.from_number(5)})
+
+        # then
+        assert self.summary(plan) == [(None, 'b', Wad.from_number(3)),
+                                      (None, 'a', Wad.from_number(2))]
+
+    def test_should_not_spend_base_balance_on_members_which_do_not_support_deposits(self):
+        # given
+        exchange = requirement('a', ExchangeMember(), 10, deficit=True, urgent=True)
+        on_chain = requirement('b', ContractMember(), 5, deficit=True)
+
+        # when
+        plan = self.planner.plan([exchange, on_chain], {'DAI': Wad.from_number(5)})
+
+        # then
+        assert self.summary(plan) == [(None, 'b', Wad.from_number(5))]
+
+    def test_should_not_plan_anything_without_requirements(self):
+        assert self.planner.plan([], {'DAI': Wad.from_number(5)}) == []
@@ -0,0 +1,107 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from inventory_keeper.provider import PooledHTTPProvider
+
+LAGGING = 'http://lagging:8545'
+SYNCED = 'http://synced:8545'
+
+
+class TestPooledHTTPProvider:
+    def setup_method(self):
+        self.provider = PooledHTTPProvider([LAGGING, SYNCED], health_check_interval=3600.0)
+        self.requests = []
+
+        # both nodes have seen the block, but only one of them can serve reads as of it
+        for endpoint in self.provider.endpoints:
+            endpoint.block_number = 100
+
+    def post(self, responses: dict):
+        def post(endpoint, payload):
+            self.requests.append(endpoint.uri)
+            response = responses[endpoint.uri]
+            return [dict(response, id=item['id']) for item in payload] if isinstance(payload, list) \
+                else dict(response, id=payload['id'])
+
+        return post
+
+    def test_should_retry_pinned_read_on_node_which_has_the_block(self, monkeypatch):
+        # given
+        monkeypatch.setattr(self.provider, '_post', self.post({
+            LAGGING: {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'header not found'}},
+            SYNCED: {'jsonrpc': '2.0', 'result': '0x01'}}))
+        monkeypatch.setattr(self.provider, '_choose', self.choose_lagging_first(self.provider._choose))
+
+        # when
+        response = self.provider.make_request('eth_call', [{'to': '0x00', 'data': '0x'}, hex(100)])
+
+        # then
+        assert response['result'] == '0x01'
+        assert self.requests == [LAGGING, SYNCED]
+        assert self.provider.endpoints[0].block_number == 99
+
+    def test_should_retry_batch_if_any_of_its_reads_hits_missing_state(self, monkeypatch):
+        # given
+        monkeypatch.setattr(self.provider, '_post', self.post({
+            LAGGING: {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'missing trie node abcd (path )'}},
+            SYNCED: {'jsonrpc': '2.0', 'result': '0x01'}}))
+        monkeypatch.setattr(self.provider, '_choose', self.choose_lagging_first(self.provider._choose))
+
+        # when
+        response = self.provider.make_batch_request([
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'eth_getBalance', 'params': ['0x00', hex(100)]},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'eth_getBalance', 'params': ['0x01', hex(100)]}])
+
+        # then
+        assert [item['result'] for item in response] == ['0x01', '0x01']
+        assert self.requests == [LAGGING, SYNCED]
+
+    def test_should_return_error_if_no_node_has_the_block(self, monkeypatch):
+        # given
+        error = {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'header not found'}}
+        monkeypatch.setattr(self.provider, '_post', self.post({LAGGING: error, SYNCED: error}))
+
+        # when
+        response = self.provider.make_request('eth_call', [{'to': '0x00', 'data': '0x'}, hex(100)])
+
+        # then
+        assert response['error']['message'] == 'header not found'
+        assert sorted(self.requests) == [LAGGING, SYNCED]
+
+    def test_should_not_retry_other_errors(self, monkeypatch):
+        # given
+        monkeypatch.setattr(self.provider, '_post', self.post({
+            LAGGING: {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'execution reverted'}},
+            SYNCED: {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'execution reverted'}}}))
+
+        # when
+        response = self.provider.make_request('eth_call', [{'to': '0x00', 'data': '0x'}, hex(100)])
+
+        # then
+        assert response['error']['message'] == 'execution reverted'
+        assert len(self.requests) == 1
+
+    @staticmethod
+    def choose_lagging_first(choose):
+        # nodes are normally chosen at random, so the test makes sure the lagging one gets asked first
+        def choose_endpoint(required_block, excluded):
+            if len(excluded) == 0:
+                return next(endpoint for endpoint in choose.__self__.endpoints if endpoint.uri == LAGGING)
+
+            return choose(required_block, excluded)
+
+        return choose_endpoint
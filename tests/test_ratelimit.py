@@ -0,0 +1,186 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+import pytest
+
+from inventory_keeper import ratelimit
+from inventory_keeper.breaker import CircuitBreakers, CircuitOpenError
+from inventory_keeper.ratelimit import ExchangeScheduler, RateLimits, TokenBucket
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket:
+    @pytest.fixture(autouse=True)
+    def fake_time(self, monkeypatch):
+        self.time = FakeTime()
+        monkeypatch.setattr(ratelimit, 'time', self.time)
+
+    def test_should_allow_burst_without_waiting(self):
+        # given
+        bucket = TokenBucket(2.0, 5)
+
+        # when
+        for _ in range(5):
+            bucket.acquire()
+
+        # then
+        assert self.time.sleeps == []
+
+    def test_should_wait_for_tokens_once_burst_is_used_up(self):
+        # given
+        bucket = TokenBucket(2.0, 5)
+        for _ in range(5):
+            bucket.acquire()
+
+        # when
+        bucket.acquire()
+
+        # then
+        assert sum(self.time.sleeps) == pytest.approx(0.5)
+
+    def test_should_refill_tokens_with_time_up_to_burst(self):
+        # given
+        bucket = TokenBucket(2.0, 3)
+        for _ in range(3):
+            bucket.acquire()
+
+        # when
+        self.time.now += 100.0
+        for _ in range(3):
+            bucket.acquire()
+
+        # then
+        assert self.time.sleeps == []
+
+        # when
+        bucket.acquire()
+
+        # then
+        assert sum(self.time.sleeps) == pytest.approx(0.5)
+
+    def test_should_not_hand_out_tokens_while_paused(self):
+        # given
+        bucket = TokenBucket(2.0, 5)
+
+        # when
+        bucket.pause(10.0)
+        bucket.acquire()
+
+        # then
+        assert sum(self.time.sleeps) == pytest.approx(10.5)
+
+
+class TestRateLimits:
+    def test_should_use_defaults(self):
+        assert RateLimits("").budget('okex-market-maker-keeper') == (2.0, 5)
+
+    def test_should_parse_default_and_per_exchange_budgets(self):
+        # given
+        rate_limits = RateLimits("1/3,okex-market-maker-keeper=5/10,bibox-market-maker-keeper=4")
+
+        # expect
+        assert rate_limits.budget('gateio-market-maker-keeper') == (1.0, 3)
+        assert rate_limits.budget('okex-market-maker-keeper') == (5.0, 10)
+        assert rate_limits.budget('bibox-market-maker-keeper') == (4.0, 4)
+
+
+class TestExchangeScheduler:
+    @pytest.fixture(autouse=True)
+    def fake_time(self, monkeypatch):
+        self.time = FakeTime()
+        monkeypatch.setattr(ratelimit, 'time', self.time)
+
+    def setup_method(self):
+        self.scheduler = ExchangeScheduler(RateLimits("1000/1000"), CircuitBreakers(), tries=3, retry_after=0.01)
+
+    def test_should_retry_failed_calls(self):
+        # given
+        attempts = []
+
+        def function():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise Exception("Temporary failure")
+            return 'balances'
+
+        # expect
+        assert self.scheduler.call('okex', 'key', 'get_balances', function) == 'balances'
+        assert len(attempts) == 3
+
+    def test_should_coalesce_concurrent_identical_calls(self):
+        # given
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def function():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'balances'
+
+        first = threading.Thread(target=lambda: results.append(self.scheduler.call('okex', 'key', 'get_balances',
+                                                                                    function)))
+        first.start()
+        started.wait(5)
+
+        # when
+        second = threading.Thread(target=lambda: results.append(self.scheduler.call('okex', 'key', 'get_balances',
+                                                                                     function)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        # then
+        assert results == ['balances', 'balances']
+        assert len(calls) == 1
+
+    def test_should_stop_calling_failing_account(self):
+        # given
+        scheduler = ExchangeScheduler(RateLimits("1000/1000"), CircuitBreakers(threshold=1), tries=2)
+        attempts = []
+
+        def function():
+            attempts.append(1)
+            raise Exception("Exchange is down")
+
+        with pytest.raises(Exception, match="Exchange is down"):
+            scheduler.call('okex', 'key', 'get_balances', function)
+
+        # expect
+        with pytest.raises(CircuitOpenError):
+            scheduler.call('okex', 'key', 'get_balances', function)
+        assert len(attempts) == 2
@@ -0,0 +1,143 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from inventory_keeper.shard import ShardCoordinator, ShardRing
+from pymaker import Address
+from pymaker.numeric import Wad
+
+MEMBERS = [f"member-{index}" for index in range(1000)]
+
+SENDER = Address('0x1111111111111111111111111111111111111111')
+TOKEN = Address('0x2222222222222222222222222222222222222222')
+
+
+class TestShardRing:
+    def test_should_assign_members_regardless_of_shard_order(self):
+        # given
+        ring = ShardRing(['a', 'b', 'c'])
+        reversed_ring = ShardRing(['c', 'b', 'a'])
+
+        # expect
+        assert all(ring.shard(member) == reversed_ring.shard(member) for member in MEMBERS)
+
+    def test_should_spread_members_evenly(self):
+        # given
+        ring = ShardRing(['a', 'b', 'c', 'd'])
+
+        # when
+        counts = {}
+        for member in MEMBERS:
+            counts[ring.shard(member)] = counts.get(ring.shard(member), 0) + 1
+
+        # then
+        assert set(counts.keys()) == {'a', 'b', 'c', 'd'}
+        assert all(150 < count < 350 for count in counts.values())
+
+    def test_should_only_move_members_of_removed_shard(self):
+        # given
+        ring = ShardRing(['a', 'b', 'c'])
+        smaller_ring = ShardRing(['a', 'b'])
+
+        # expect
+        for member in MEMBERS:
+            if ring.shard(member) != 'c':
+                assert smaller_ring.shard(member) == ring.shard(member)
+
+    def test_should_assign_everything_to_single_shard(self):
+        assert {ShardRing(['a']).shard(member) for member in MEMBERS} == {'a'}
+
+
+class TestShardCoordinator:
+    def setup_method(self):
+        self.count = {'latest': 5, 'pending': 5}
+
+    def transaction_count(self, block):
+        return self.count[block]
+
+    def coordinator(self, tmpdir, shard: str) -> ShardCoordinator:
+        return ShardCoordinator(os.path.join(str(tmpdir), 'state.json'), shard)
+
+    def test_should_hand_out_sequential_nonces_across_shards(self, tmpdir):
+        # given
+        first = self.coordinator(tmpdir, 'a')
+        second = self.coordinator(tmpdir, 'b')
+
+        # expect
+        assert first.next_nonce(SENDER, self.transaction_count) == 5
+        assert second.next_nonce(SENDER, self.transaction_count) == 6
+        assert first.next_nonce(SENDER, self.transaction_count) == 7
+
+    def test_should_reuse_released_nonces(self, tmpdir):
+        # given
+        first = self.coordinator(tmpdir, 'a')
+        second = self.coordinator(tmpdir, 'b')
+        nonce = first.next_nonce(SENDER, self.transaction_count)
+        first.next_nonce(SENDER, self.transaction_count)
+
+        # when
+        first.release_nonce(SENDER, nonce)
+
+        # then
+        assert second.next_nonce(SENDER, self.transaction_count) == nonce
+        assert second.next_nonce(SENDER, self.transaction_count) == 7
+
+    def test_should_only_rewind_last_nonce_handed_out(self, tmpdir):
+        # given
+        first = self.coordinator(tmpdir, 'a')
+        second = self.coordinator(tmpdir, 'b')
+        nonce = first.next_nonce(SENDER, self.transaction_count)
+        later_nonce = second.next_nonce(SENDER, self.transaction_count)
+
+        # expect
+        assert not first.rewind_nonce(SENDER, nonce)
+        assert second.rewind_nonce(SENDER, later_nonce)
+        assert first.next_nonce(SENDER, self.transaction_count) == later_nonce
+
+    def test_should_share_reservations_until_all_shards_see_confirmation(self, tmpdir):
+        # given
+        first = self.coordinator(tmpdir, 'a')
+        second = self.coordinator(tmpdir, 'b')
+        first.reserve(SENDER, TOKEN, Wad.from_number(10), 5)
+
+        # expect
+        assert second.reserved(TOKEN, 100) == Wad.from_number(10)
+
+        # when
+        first.confirm(SENDER, 5, 101)
+
+        # then
+        assert second.reserved(TOKEN, 100) == Wad.from_number(10)
+        assert first.reserved(TOKEN, 101) == Wad(0)
+
+        # when
+        second.reserved(TOKEN, 101)
+
+        # then
+        assert second.reserved(TOKEN, None) == Wad(0)
+
+    def test_should_drop_released_reservations(self, tmpdir):
+        # given
+        coordinator = self.coordinator(tmpdir, 'a')
+        coordinator.reserve(SENDER, TOKEN, Wad.from_number(10), 5)
+
+        # when
+        coordinator.release(SENDER, 5)
+
+        # then
+        assert coordinator.reserved(TOKEN, None) == Wad(0)
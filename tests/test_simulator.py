@@ -0,0 +1,120 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+
+import pytest
+
+from inventory_keeper.simulator import DEFAULT_SORT, Trace, parse_values, rank, simulate, simulate_vectorised
+
+
+class TestSimulate:
+    def test_should_deposit_after_balance_drops_below_minimum(self):
+        # given
+        trace = Trace([0.0, 1.0, 2.0, 3.0, 4.0], [-6.0, 0.0, 0.0, 0.0, 0.0])
+
+        # when
+        result = simulate(trace, 5.0, 10.0, 20.0, confirmation_delay=2, gas_per_transfer=1.5)
+
+        # then
+        assert result['deposits'] == 1
+        assert result['withdrawals'] == 0
+        assert result['time_below_min'] == 2.0
+        assert result['gas'] == 1.5
+
+    def test_should_withdraw_after_balance_exceeds_maximum(self):
+        # given
+        trace = Trace([0.0, 1.0, 2.0, 3.0], [15.0, 0.0, 0.0, 0.0])
+
+        # when
+        result = simulate(trace, 5.0, 10.0, 20.0, confirmation_delay=1, gas_per_transfer=1.0)
+
+        # then
+        assert (result['deposits'], result['withdrawals']) == (0, 1)
+
+    def test_should_report_shortfall_instead_of_negative_balance(self):
+        # given
+        trace = Trace([0.0, 1.0], [-15.0, 0.0])
+
+        # when
+        result = simulate(trace, 5.0, 10.0, 20.0, confirmation_delay=1, gas_per_transfer=1.0)
+
+        # then
+        assert result['shortfall'] == 5.0
+
+
+class TestRank:
+    def test_should_not_rank_combination_running_dry_first(self):
+        # given
+        trace = Trace([float(timestamp) for timestamp in range(10)], [-2.0] * 10)
+        combinations = [(0.0, 0.0, 20.0), (5.0, 10.0, 20.0)]
+        results = [dict(simulate(trace, min_amount, avg_amount, max_amount, confirmation_delay=1, gas_per_transfer=1.0),
+                        minAmount=min_amount)
+                   for min_amount, avg_amount, max_amount in combinations]
+        assert results[0]['shortfall'] > 0
+        assert results[0]['time_below_min'] == 0
+        assert results[0]['transfers'] < results[1]['transfers']
+
+        # when
+        ranked = rank(results, DEFAULT_SORT)
+
+        # then
+        assert ranked[0]['minAmount'] == 5.0
+        assert ranked[0]['shortfall'] == 0
+
+    def test_should_sort_by_fields_in_order(self):
+        # given
+        results = [{'shortfall': 0.0, 'transfers': 3}, {'shortfall': 0.0, 'transfers': 1}, {'shortfall': 1.0, 'transfers': 0}]
+
+        # expect
+        assert rank(results, ['shortfall', 'transfers']) == [results[1], results[0], results[2]]
+        assert rank(results, ['transfers']) == [results[2], results[1], results[0]]
+
+
+class TestSimulateVectorised:
+    @pytest.fixture(autouse=True)
+    def require_numpy(self):
+        pytest.importorskip('numpy')
+
+    def test_should_give_same_results_as_scalar_simulation(self):
+        # given
+        trace = Trace.synthetic(days=3, interval=60.0, burn_rate=1.0, volatility=5.0, seed=1)
+        combinations = [(min_amount, avg_amount, max_amount)
+                        for min_amount in [1.0, 2.0, 5.0]
+                        for avg_amount in [3.0, 6.0, 10.0]
+                        for max_amount in [8.0, 12.0, 20.0]
+                        if min_amount <= avg_amount <= max_amount]
+
+        # when
+        vectorised = simulate_vectorised(trace, *zip(*combinations), confirmation_delay=3, gas_per_transfer=1.0)
+
+        # then
+        for (min_amount, avg_amount, max_amount), result in zip(combinations, vectorised):
+            expected = simulate(trace, min_amount, avg_amount, max_amount, confirmation_delay=3, gas_per_transfer=1.0)
+            assert result == pytest.approx(expected)
+
+
+class TestParseValues:
+    def test_should_parse_numbers_and_ranges(self):
+        assert parse_values("1,2.5") == [1.0, 2.5]
+        assert parse_values("1:3:1,7") == [1.0, 2.0, 3.0, 7.0]
+        assert parse_values("0:1:0.25") == [0.0, 0.25, 0.5, 0.75, 1.0]
+
+    @pytest.mark.parametrize('value', ["1:5:0", "1:5:-1", "5:1:1", "a", "1:2"])
+    def test_should_reject_invalid_values(self, value):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_values(value)
@@ -0,0 +1,124 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from web3 import Web3
+
+from inventory_keeper import transfer
+from inventory_keeper.transfer import Transfer, TransferPipeline
+from pymaker import Address, Transact
+from pymaker.numeric import Wad
+
+BASE = Address('0x1111111111111111111111111111111111111111')
+
+
+class FakeReceipt:
+    def __init__(self, block_number: int):
+        self.successful = True
+        self.block_number = block_number
+
+
+class FakeNode(Web3):
+    # the pipeline only reads transaction counts from the node, so no provider is needed
+    def __init__(self):
+        self.eth = self
+        self.sent = {}
+        self.started = threading.Event()
+
+    def getTransactionCount(self, address, block):
+        count = 0
+        while count in self.sent:
+            count += 1
+        return count
+
+
+class FakeTransact(Transact):
+    def __init__(self, node: FakeNode, name: str, fail: bool = False):
+        self.node = node
+        self.name = name
+        self.fail = fail
+        self.nonce = None
+
+    def transact(self, **kwargs):
+        # nothing gets sent before all transfers of a batch have got their nonces
+        self.node.started.wait()
+        if self.fail:
+            raise Exception("Failed before sending")
+
+        self.node.sent[self.nonce] = self.name
+        return FakeReceipt(100 + self.nonce)
+
+
+class TestTransferPipeline:
+    def setup_method(self):
+        self.node = FakeNode()
+        # a single worker executes transfers one by one, in the order of their nonces
+        self.pipeline = TransferPipeline(self.node, max_pending=1)
+
+    def submit(self, name: str, fail: bool = False):
+        return self.pipeline.submit(from_address=BASE, member_name=name, token_name='DAI', token_address=None,
+                                    deposit=True, transfer=Transfer(FakeTransact(self.node, name, fail), Wad(1)))
+
+    def test_should_fill_gap_left_by_transfer_failed_in_the_middle_of_batch(self, monkeypatch):
+        # given
+        monkeypatch.setattr(transfer, 'eth_transfer', lambda web3, to, amount: FakeTransact(self.node, 'filler'))
+
+        # when
+        for name, fail in [('first', False), ('second', True), ('third', False)]:
+            self.submit(name, fail)
+        self.node.started.set()
+        self.pipeline.wait()
+
+        # then
+        assert self.node.sent == {0: 'first', 1: 'filler', 2: 'third'}
+        assert not self.pipeline.unconfirmed('third', 'DAI')
+
+        # and
+        self.submit('fourth')
+        self.pipeline.wait()
+        assert self.node.sent[3] == 'fourth'
+
+    def test_should_use_gap_for_next_transfer_if_it_can_not_be_filled(self, monkeypatch):
+        # given
+        monkeypatch.setattr(transfer, 'eth_transfer', lambda web3, to, amount: FakeTransact(self.node, 'filler', True))
+
+        # when
+        for name, fail in [('first', False), ('second', True), ('third', False)]:
+            self.submit(name, fail)
+        self.node.started.set()
+        self.pipeline.wait()
+        self.submit('fourth')
+        self.pipeline.wait()
+
+        # then
+        assert self.node.sent == {0: 'first', 1: 'fourth', 2: 'third'}
+
+    def test_should_reuse_nonce_of_last_transfer_if_it_failed(self, monkeypatch):
+        # given
+        monkeypatch.setattr(transfer, 'eth_transfer', lambda web3, to, amount: FakeTransact(self.node, 'filler'))
+
+        # when
+        self.submit('first')
+        self.submit('second', fail=True)
+        self.node.started.set()
+        self.pipeline.wait()
+        self.submit('third')
+        self.pipeline.wait()
+
+        # then
+        assert self.node.sent == {0: 'first', 1: 'third'}
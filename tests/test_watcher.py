@@ -0,0 +1,101 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from inventory_keeper.watcher import ALL_TOKENS, BlockWatcher, TRANSFER
+
+WATCHED = '0x1111111111111111111111111111111111111111'
+OTHER = '0x2222222222222222222222222222222222222222'
+DAI = '0xaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'
+MKR = '0xbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb'
+ETH = '0x0000000000000000000000000000000000000000'
+
+
+def topic(address: str) -> str:
+    return '0x' + address[2:].rjust(64, '0')
+
+
+def transfer_log(token: str, source: str, destination: str, transaction_hash: str) -> dict:
+    return {'address': token,
+            'topics': [TRANSFER, topic(source), topic(destination)],
+            'transactionHash': transaction_hash}
+
+
+def transaction(source: str, destination, value: int) -> dict:
+    return {'from': source, 'to': destination, 'value': hex(value)}
+
+
+class TestBlockWatcher:
+    def test_should_group_tokens_moved_in_one_transaction(self):
+        # given
+        logs = [transfer_log(DAI, OTHER, WATCHED, '0x01'),
+                transfer_log(MKR, OTHER, OTHER, '0x01'),
+                transfer_log(MKR, OTHER, OTHER, '0x02')]
+        result = {}
+
+        # when
+        BlockWatcher._process_logs(logs, {WATCHED}, result)
+
+        # then
+        assert result == {WATCHED: {DAI, MKR}}
+
+    def test_should_detect_watched_address_as_sender_or_recipient(self):
+        # given
+        logs = [transfer_log(DAI, WATCHED, OTHER, '0x01'),
+                transfer_log(MKR, OTHER, WATCHED, '0x02')]
+        result = {}
+
+        # when
+        BlockWatcher._process_logs(logs, {WATCHED}, result)
+
+        # then
+        assert result == {WATCHED: {DAI, MKR}}
+
+    def test_should_ignore_logs_without_indexed_addresses_and_unwatched_addresses(self):
+        # given
+        logs = [{'address': DAI, 'topics': [TRANSFER], 'transactionHash': '0x01'},
+                transfer_log(DAI, OTHER, OTHER, '0x02')]
+        result = {}
+
+        # when
+        BlockWatcher._process_logs(logs, {WATCHED}, result)
+
+        # then
+        assert result == {}
+
+    def test_should_detect_transactions_sent_and_eth_received(self):
+        # given
+        blocks = [{'transactions': [transaction(WATCHED, OTHER, 0)]},
+                  {'transactions': [transaction(OTHER, WATCHED, 10),
+                                    transaction(OTHER, None, 10)]}]
+        result = {}
+
+        # when
+        BlockWatcher._process_transactions(blocks, {WATCHED}, result)
+
+        # then
+        assert result == {WATCHED: {ALL_TOKENS, ETH}}
+
+    def test_should_ignore_transactions_to_watched_address_without_value(self):
+        # given
+        blocks = [{'transactions': [transaction(OTHER, WATCHED, 0)]}]
+        result = {}
+
+        # when
+        BlockWatcher._process_transactions(blocks, {WATCHED}, result)
+
+        # then
+        assert result == {}